@@ -2,12 +2,17 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
+import uuid
 
+from typing import Dict, Iterable, List
 from pyad import ADQuery, ADUser
 from active_directory.exceptions import TooManyResults
 
 logger = logging.getLogger("active_directory.search")
 
+#: The number of values that are matched by each query of the batch searches
+SEARCH_BATCH = 100
+
 
 def get_by_employee_id(id: int, base_dn: str = None) -> ADUser:
     """
@@ -98,3 +103,104 @@ def get_by_guid(guid: str) -> ADUser:
     """
 
     return ADUser.from_guid(guid)
+
+
+def guid_key(guid: str) -> str:
+    """
+    Normalize a GUID so that the braced, upper case form returned by pyad and the
+    form stored against an employee can be compared.
+
+    :param guid: The GUID string
+    :type guid: str
+    :raises ValueError: If the string is not a valid GUID
+    :return: The lower case GUID without braces
+    :rtype: str
+    """
+
+    return str(uuid.UUID(str(guid)))
+
+
+def get_by_guids(guids: Iterable[str], base_dn: str = None) -> Dict[str, ADUser]:
+    """
+    Get the AD Users of many GUIDs. The GUIDs are matched by LDAP filter queries of
+    SEARCH_BATCH GUIDs each and only the users that were found are bound, instead of
+    binding every GUID on its own.
+
+    :param guids: The GUIDs to retrieve
+    :type guids: Iterable[str]
+    :param base_dn: the base path to search within, defaults to None
+    :type base_dn: str, optional
+    :return: The ADUsers that were found keyed by their guid_key
+    :rtype: Dict[str, ADUser]
+    """
+
+    keys = set()
+    for guid in guids:
+        try:
+            keys.add(guid_key(guid))
+        except ValueError:
+            logger.warning(f"{guid} is not a valid GUID")
+
+    keys = sorted(keys)
+    output = {}
+    for x in range(0, len(keys), SEARCH_BATCH):
+        # objectGUID is binary, it can only be matched with the escaped bytes
+        where = "".join(
+            "(objectGUID=%s)" % "".join("\\%02x" % b for b in uuid.UUID(k).bytes_le)
+            for k in keys[x : x + SEARCH_BATCH]
+        )
+        q = ADQuery()
+        q.execute_query(where_clause=f"(|{where})", base_dn=base_dn, ldap_dialect=True)
+        for row in q.get_results():
+            user = ADUser.from_dn(row["distinguishedName"])
+            output[guid_key(user.guid)] = user
+
+    logger.debug(f"Found {len(output)} of {len(keys)} users by GUID")
+    return output
+
+
+def find_by_values(
+    fields: Iterable[str], values: Iterable, base_dn: str = None
+) -> Dict[str, List[str]]:
+    """
+    Find the AD objects where any of the fields is equal to any of the values. The
+    values are matched by queries of SEARCH_BATCH values each that return the fields
+    along with the distinguishedName, instead of a query per value.
+
+    :param fields: The attributes to match, such as employeeNumber and employeeID
+    :type fields: Iterable[str]
+    :param values: The values to find
+    :type values: Iterable
+    :param base_dn: the base path to search within, defaults to None
+    :type base_dn: str, optional
+    :return: The distinct DNs of the objects that matched each value, keyed by the
+        lower case value. Values that didn't match are not included
+    :rtype: Dict[str, List[str]]
+    """
+
+    fields = list(fields)
+    values = sorted({str(v).lower() for v in values if v is not None and v != ""})
+    output = {}
+    for x in range(0, len(values), SEARCH_BATCH):
+        chunk = values[x : x + SEARCH_BATCH]
+        where = " or ".join(
+            "%s = '%s'" % (field, value.replace("'", "''"))
+            for value in chunk
+            for field in fields
+        )
+        q = ADQuery()
+        q.execute_query(
+            attributes=["distinguishedName"] + fields,
+            where_clause=where,
+            base_dn=base_dn,
+        )
+        wanted = set(chunk)
+        for row in q.get_results():
+            dn = row["distinguishedName"]
+            for field in fields:
+                value = str(row.get(field) or "").lower()
+                if value in wanted and dn not in output.setdefault(value, []):
+                    output[value].append(dn)
+
+    logger.debug(f"Found {len(output)} of {len(values)} values in {fields}")
+    return output
@@ -20,7 +20,8 @@ INIT_ERROR = [("Not Loaded", "System not initialized")]
 
 
 class DnValidator(RegexValidator):
-    regex = (r"^((CN=([^,]*)),)?((((?:CN|OU)=[^,]+,?)+),)?((DC=[^,]+,?)+)$",)
+    # the RDNs may be separated by spaces and their values may contain escaped commas
+    regex = r"^([A-Z][\w-]*=(\\.|[^,\\])+,\s*)*DC=(\\.|[^,\\])+$"
     message = _t("Not a valid DN string")
     flags = re.IGNORECASE
 
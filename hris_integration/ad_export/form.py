@@ -84,20 +84,12 @@ class BaseExport:
         If the employee is new their AD account is created first.
         Then all of the attributes are updated. see :ref:`references/ad_export/index`
         """
+        duplicates = self.find_users()
         logger.debug("Starting AD Export main loop")
         for employee in self.employees:
             logger.debug(f"Processing {str(employee)}")
-            if employee.ad_user is None and employee.employee.state:
-                logger.debug("User is new or guid is missing, trying to find user")
-                if employee.id > 0:
-                    user = self._ad.get_user_by_id(employee.id)
-                else:
-                    user = self._ad.get_user_by_username(employee.username)
-                if user:
-                    logger.debug(f"Found user {str(user)}")
-                    employee.ad_user = user
-                    employee.guid = str(user.guid)
-                    employee.employee.save()
+            if employee in duplicates:
+                continue
 
             if isinstance(employee.ad_user, ADUser):
                 try:
@@ -173,6 +165,51 @@ class BaseExport:
         self.run_post()
         config.set_last_run()
 
+    def find_users(self) -> List[config.EmployeeManager]:
+        """
+        Find the AD users of the active employees that are new or are missing their
+        GUID. The users are searched for in batches instead of one query per employee,
+        an employee that is matched to a user is updated with the user and its GUID.
+
+        Employees that match more than one user, or match the same user as another
+        employee, can't be exported safely and are returned so that they are skipped.
+
+        :return: The employees with duplicate matches
+        :rtype: List[config.EmployeeManager]
+        """
+
+        employees = [
+            e for e in self.employees if e.ad_user is None and e.employee.state
+        ]
+        logger.debug(f"Trying to find AD users for {len(employees)} employees")
+        found = self._ad.find_users(employees)
+
+        owners = {}
+        for employee, dns in found.items():
+            for dn in dns:
+                owners.setdefault(dn, []).append(employee)
+
+        duplicates = []
+        for employee, dns in found.items():
+            if len(dns) > 1 or len(owners[dns[0]]) > 1:
+                if len(dns) > 1:
+                    reason = "matched more than one AD user"
+                else:
+                    reason = "matched the same AD user as another employee"
+                others = {dn: [str(e) for e in owners[dn]] for dn in dns}
+                logger.error(f"{str(employee)} {reason} {others}")
+                self.errors.append(f"Skipped {str(employee)}, {reason}")
+                duplicates.append(employee)
+                continue
+
+            user = ADUser.from_dn(dns[0])
+            logger.debug(f"Found user {str(user)}")
+            employee.ad_user = user
+            employee.employee.guid = str(user.guid)
+            employee.employee.save()
+
+        return duplicates
+
     def run_post(self):
         """To be implemented in a sub-class. Any final task before completion."""
         pass
@@ -7,7 +7,7 @@ from pyad import ADContainer, ADGroup, ADQuery, ADUser, InvalidAttribute, win32E
 from active_directory import search, TooManyResults
 from active_directory.exceptions import get_com_exception, raise_from_com
 from pywintypes import com_error
-from typing import Dict
+from typing import Dict, Iterable, List
 
 from . import config
 from ad_export.exceptions import ADResultsError, UserDoesNotExist, ADCreateError
@@ -32,6 +32,41 @@ class AD:
     def get_user_by_upn(self, upn: str) -> ADUser:
         return search.get_by_upn(upn, self.base_dn)
 
+    def find_users(
+        self, employees: Iterable[config.EmployeeManager]
+    ) -> Dict[config.EmployeeManager, List[str]]:
+        """
+        Find the AD users of many employees in batches. Employees with an ID are found
+        by employeeNumber or employeeID, the others by sAMAccountName, the same way as
+        get_user_by_id and get_user_by_username.
+
+        :param employees: The employees to find
+        :type employees: Iterable[config.EmployeeManager]
+        :return: The DNs of the users that match each employee, more than one DN is a
+            duplicate match. Employees that share a value are matched to the same DNs.
+            Employees without a match are not included
+        :rtype: Dict[config.EmployeeManager, List[str]]
+        """
+
+        by_id, by_username = {}, {}
+        for employee in employees:
+            if employee.id > 0:
+                by_id.setdefault(str(employee.id), []).append(employee)
+            elif employee.username:
+                by_username.setdefault(employee.username.lower(), []).append(employee)
+
+        output = {}
+        for fields, employees in (
+            (("employeeNumber", "employeeID"), by_id),
+            (("sAMAccountName",), by_username),
+        ):
+            found = search.find_by_values(fields, employees, self.base_dn)
+            for value, dns in found.items():
+                for employee in employees[value]:
+                    output[employee] = dns
+
+        return output
+
     def user_exists(self, employee: config.EmployeeManager) -> bool:
         if employee.employee.is_exported_ad and employee.guid:
             try:
@@ -9,7 +9,7 @@ from typing import Any
 from settings.config_manager import ConfigurationManagerBase
 from django.utils.timezone import now
 from employee.models import Employee
-from employee.data_structures import EmployeeManager
+from employee.data_structures import EmployeeLoader, EmployeeManager
 from warnings import warn
 
 from .settings_fields import *  # Yes I hate this, deal with it!
@@ -48,7 +48,9 @@ class EmployeeManager(EmployeeManager):
 
         super().__init__(employee)
         self.config = Config()
-        self.only_primary = self.config(EMPLOYEE_CAT, EMPLOYEE_IMPORT_ANY)
+        self.only_primary = self.shared_value(
+            "only_primary", lambda: self.config(EMPLOYEE_CAT, EMPLOYEE_IMPORT_ANY)
+        )
 
     def pre_merge(self) -> None:
         # TODO: is this needed?
@@ -168,9 +170,17 @@ def get_employees(
     else:
         employees = Employee.objects.all()
 
-    for employee in employees:
-        logger.debug(f"Processing Employee {str(employee)}")
-        add_emp(employee)
+    employees = employees.select_related("primary_job__business_unit", "location")
+    loader = EmployeeLoader(employees)
+    with loader.activate():
+        for employee in loader.employees:
+            logger.debug(f"Processing Employee {str(employee)}")
+            add_emp(employee)
+
+    for manager in EmployeeManager.resolve_ad_users(output):
+        logger.debug(f"GUID {manager.guid} doesn't match an AD user")
+        logger.error(f"Failed to get Employee {str(manager)}")
+        output.remove(manager)
 
     logger.debug(f"Processed {len(output)} Employees")
 
@@ -185,11 +195,7 @@ def base_dn() -> str:
 
 def fuzzy_employee(username: str) -> list[EmployeeManager]:
     users = Employee.objects.filter(_username__startswith=username)
-    output = []
-    for employee in users:
-        output.append(EmployeeManager(employee))
-
-    return output
+    return EmployeeManager.bulk(users)
 
 
 def set_last_run():
@@ -6,7 +6,7 @@ import re
 
 from typing import Any
 from django.utils.timezone import now
-from employee.data_structures import EmployeeManager
+from employee.data_structures import EmployeeLoader, EmployeeManager
 from employee.models import Employee
 from settings.models import Setting
 from settings.config_manager import ConfigurationManagerBase
@@ -124,21 +124,24 @@ def get_employees(
     else:
         emps = Employee.objects.all()
 
-    for employee in emps:
-        # if terminated(Exclude Terminated) is False and status = Terminated == True
-        #   or
-        # if user status is not Terminated
-        if (
-            (not employee.state and not terminated)
-            or employee.state
-            and employee.is_imported
-        ):
-            try:
-                output.append(CPEmployeeManager(employee))
-            except Exception as e:
-                logger.error(
-                    f"Failed to get Employee {employee.employee_id} - Error {e}"
-                )
+    emps = emps.select_related("primary_job__business_unit", "location")
+    loader = EmployeeLoader(emps)
+    with loader.activate():
+        for employee in loader.employees:
+            # if terminated(Exclude Terminated) is False and status = Terminated == True
+            #   or
+            # if user status is not Terminated
+            if (
+                (not employee.state and not terminated)
+                or employee.state
+                and employee.is_imported
+            ):
+                try:
+                    output.append(CPEmployeeManager(employee))
+                except Exception as e:
+                    logger.error(
+                        f"Failed to get Employee {employee.employee_id} - Error {e}"
+                    )
 
     return output
 
@@ -2,10 +2,16 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
+import threading
 
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List
 from warnings import warn
 from datetime import datetime
+from django.db.models import prefetch_related_objects
 from organization.group_manager import GroupManager
+from organization.group_rules import GroupRules
 from user_applications.models import Account
 from active_directory import search
 
@@ -14,6 +20,112 @@ from .models import Employee, EmployeeImport, Phone, Address
 
 logger = logging.getLogger("employee.data_structures")
 
+#: The number of employees that the related objects are loaded for per query, keeps
+#: the queries under the parameter limit of the database
+LOAD_BATCH = 1000
+
+_local = threading.local()
+
+
+class EmployeeLoader:
+    """
+    Load the objects that make up a batch of employees up front. The EmployeeImport,
+    Phone, Address and Account objects of the employees and their jobs, business units
+    and locations are loaded with a fixed number of queries for every LOAD_BATCH
+    employees. The group mappings are compiled and the group names that the employees
+    use are resolved once for the batch.
+
+    While the loader is active the EmployeeManagers of its employees are built from the
+    loaded objects, any other employee is loaded the same way as it always was.
+    """
+
+    def __init__(self, employees: Iterable[Employee]) -> None:
+        """
+        :param employees: The employees of the batch, a QuerySet is evaluated
+        :type employees: Iterable[Employee]
+        """
+
+        self.employees: List[Employee] = list(employees)
+        self.imports: Dict[int, EmployeeImport] = {}
+        self.phones: Dict[int, List[Phone]] = defaultdict(list)
+        self.addresses: Dict[int, List[Address]] = defaultdict(list)
+        self.accounts: Dict[int, List[Account]] = defaultdict(list)
+        self.loaded = set()
+        #: Values that are the same for every employee of the batch
+        self.shared: Dict[str, Any] = {}
+
+        for x in range(0, len(self.employees), LOAD_BATCH):
+            self.load(self.employees[x : x + LOAD_BATCH])
+
+        # compiled for each batch so that changes made by other processes are seen
+        self.rules = GroupRules.load()
+        # resolve all of the group names that the employees use with one query
+        apps = [
+            account.software.mapped_group
+            for accounts in self.accounts.values()
+            for account in accounts
+        ]
+        GroupManager.warm([self.rules.leave_setting] + apps)
+        logger.debug(f"Loaded {len(self.loaded)} employees")
+
+    def load(self, employees: List[Employee]) -> None:
+        """Load the related objects of a chunk of employees"""
+
+        prefetch_related_objects(employees, "primary_job__business_unit", "location")
+        pks = [e.pk for e in employees]
+
+        imports = EmployeeImport.objects.filter(employee__in=pks).select_related(
+            "primary_job", "location"
+        )
+        for employee in imports:
+            self.imports[employee.employee_id] = employee
+        for phone in Phone.objects.filter(employee__in=pks):
+            self.phones[phone.employee_id].append(phone)
+        for addr in Address.objects.filter(employee__in=pks):
+            self.addresses[addr.employee_id].append(addr)
+        accounts = Account.objects.filter(employee__in=pks).select_related("software")
+        for account in accounts:
+            self.accounts[account.employee_id].append(account)
+
+        self.loaded.update(pks)
+
+    def value(self, key: str, func: Callable[[], Any]) -> Any:
+        """
+        Get a value that is the same for every employee of the batch, such as a
+        setting. The value is computed on first use.
+
+        :param key: The name of the value
+        :type key: str
+        :param func: Computes the value
+        :type func: Callable[[], Any]
+        :return: The value
+        :rtype: Any
+        """
+
+        if key not in self.shared:
+            self.shared[key] = func()
+        return self.shared[key]
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the loader that EmployeeManagers are built from in this thread. The
+        previous loader is restored when the context exits.
+        """
+
+        previous = getattr(_local, "loader", None)
+        _local.loader = self
+        try:
+            yield self
+        finally:
+            _local.loader = previous
+
+
+def active_loader() -> EmployeeLoader:
+    """Get the loader that is active in this thread, None if there isn't one"""
+
+    return getattr(_local, "loader", None)
+
 
 class EmployeeManager:
     """
@@ -25,13 +137,17 @@ class EmployeeManager:
     duplication every time an interaction is needed with the employee.
     """
 
-    #: The ADUser object related to the employee
-    ad_user: "pyad.ADUser" = None
+    #: The ADUser object related to the employee, see ad_user
+    _ad_user: "pyad.ADUser" = None
+    #: True once the ADUser has been looked up or set
+    _ad_resolved: bool = False
     #: The source HRIS Employee object
     __employee: EmployeeImport = None
-    #: The QuerySet of the Phone objects for the employee
+    #: The QuerySet of the Phone objects for the employee, a list if the employee was
+    #: loaded by an EmployeeLoader
     _qs_phone: "django.db.models.QuerySet" = None
-    #: The QuerySet of the Address objects for the employee
+    #: The QuerySet of the Address objects for the employee, a list if the employee was
+    #: loaded by an EmployeeLoader
     _qs_addr: "django.db.models.QuerySet" = None
     #: True if the employee is imported
     merge: bool = False
@@ -56,7 +172,13 @@ class EmployeeManager:
         self.merge = False
         self.get()
         try:
-            self.__employee = EmployeeImport.objects.get(employee=self.employee)
+            loader = self._loader()
+            if loader:
+                self.__employee = loader.imports.get(employee.pk)
+                if self.__employee is None:
+                    raise EmployeeImport.DoesNotExist
+            else:
+                self.__employee = EmployeeImport.objects.get(employee=self.employee)
             self.merge = not self.employee.is_imported
             if not employee.is_imported:
                 self.merge = True
@@ -103,25 +225,123 @@ class EmployeeManager:
 
         return cls(employee.employee)
 
+    @classmethod
+    def bulk(cls, employees: Iterable[Employee]) -> List["EmployeeManager"]:
+        """
+        Build the managers for many employees, the objects that make up the employees
+        are loaded up front by an EmployeeLoader instead of by each manager.
+
+        :param employees: The employees to build managers for
+        :type employees: Iterable[Employee]
+        :return: The managers in the same order as the employees
+        :rtype: List[EmployeeManager]
+        """
+
+        loader = EmployeeLoader(employees)
+        with loader.activate():
+            return [cls(employee) for employee in loader.employees]
+
+    def _loader(self) -> EmployeeLoader:
+        """The active loader if it has loaded this employee"""
+
+        loader = active_loader()
+        if loader and self.employee.pk in loader.loaded:
+            return loader
+
+    def shared_value(self, key: str, func: Callable[[], Any]) -> Any:
+        """
+        Get a value that is the same for every employee, computed once per batch when
+        the manager is built by an EmployeeLoader.
+
+        :param key: The name of the value
+        :type key: str
+        :param func: Computes the value
+        :type func: Callable[[], Any]
+        :return: The value
+        :rtype: Any
+        """
+
+        loader = self._loader()
+        if loader:
+            return loader.value(key, func)
+        return func()
+
     def get(self):
         """Get the specific sub-objects for the employee"""
 
-        self._qs_phone = Phone.objects.filter(employee=self.employee)
-        self._qs_addr = Address.objects.filter(employee=self.employee)
+        loader = self._loader()
+        if loader:
+            pk = self.employee.pk
+            self._qs_phone = loader.phones[pk]
+            self._qs_addr = loader.addresses[pk]
+            accounts = loader.accounts[pk]
+            rules = loader.rules
+        else:
+            self._qs_phone = Phone.objects.filter(employee=self.employee)
+            self._qs_addr = Address.objects.filter(employee=self.employee)
+            accounts = Account.objects.filter(employee=self.employee)
+            rules = None
+
         self.group_manager = GroupManager(
             self.employee.primary_job,
             self.employee.primary_job.business_unit,
             self.employee.location,
+            rules,
         )
 
-        for app in Account.objects.filter(employee=self.employee):
-            logger
+        for app in accounts:
             self.group_manager.add_application(app.software)
 
-        if self.guid == None:
-            self.get_guid()
-        else:
-            self.ad_user = search.get_by_guid(self.guid)
+    @property
+    def ad_user(self) -> "pyad.ADUser":
+        """
+        The ADUser object related to the employee. The user is only looked up in AD
+        the first time it's accessed, use resolve_ad_users to look up the users of
+        many employees at once.
+
+        :return: The ADUser or None if the employee doesn't have one
+        :rtype: pyad.ADUser
+        """
+
+        if not self._ad_resolved:
+            if self.guid == None:
+                self.get_guid()
+            else:
+                self._ad_user = search.get_by_guid(self.guid)
+            self._ad_resolved = True
+        return self._ad_user
+
+    @ad_user.setter
+    def ad_user(self, user: "pyad.ADUser") -> None:
+        self._ad_user = user
+        self._ad_resolved = True
+
+    @staticmethod
+    def resolve_ad_users(
+        managers: Iterable["EmployeeManager"],
+    ) -> List["EmployeeManager"]:
+        """
+        Look up the AD users of the managers that have a GUID with batched searches
+        instead of a bind per employee when their ad_user is accessed. Managers without
+        a GUID are still looked up on access.
+
+        :param managers: The managers to resolve
+        :type managers: Iterable[EmployeeManager]
+        :return: The managers whose GUID doesn't match an AD user, these raise the
+            lookup error when their ad_user is accessed
+        :rtype: List[EmployeeManager]
+        """
+
+        pending = [m for m in managers if not m._ad_resolved and m.guid]
+        users = search.get_by_guids([m.guid for m in pending])
+
+        missing = []
+        for manager in pending:
+            try:
+                manager.ad_user = users[search.guid_key(manager.guid)]
+            except (KeyError, ValueError):
+                missing.append(manager)
+        return missing
 
     def groups_add(self) -> list:
         """
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2022-06-20 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employee", "0003_migrate_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="employeeimport",
+            name="row_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
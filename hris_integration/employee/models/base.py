@@ -2,9 +2,10 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
-from typing import List
+from typing import Any, Dict, List
 
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from django.utils.translation import gettext_lazy as _t
 from mptt.models import MPTTModel, TreeForeignKey
 from hris_integration.models import ChangeLogMixin
@@ -133,9 +134,108 @@ class EmployeeBase(MPTTModel, ChangeLogMixin, EmployeeState):
     #: The employee type as defined by the HRIS system.
     type: str = models.CharField(max_length=64, null=True, blank=True)
 
+    #: The fields that are compared to decide if the employee has changed.
+    TRACKED_FIELDS: List[str] = []
+
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}.objects.get(id={self.id})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.field_values()
+        return instance
+
+    def save(self, *args, **kwargs) -> None:
+        super().save(*args, **kwargs)
+        self.mark_stored(kwargs.get("update_fields"))
+
+    def refresh_from_db(self, using=None, fields=None) -> None:
+        super().refresh_from_db(using=using, fields=fields)
+        self.mark_stored(fields)
+
+    def mark_stored(self, fields: List[str] = None) -> None:
+        """
+        Capture the current values of the fields as the values stored in the database.
+        This is done by save, objects that are written with bulk_update or a queryset
+        update need to be marked by the caller.
+
+        :param fields: The names of the fields that were written, defaults to all fields
+        :type fields: List[str], optional
+        """
+
+        if fields is None:
+            self._loaded_values = self.field_values()
+        elif hasattr(self, "_loaded_values"):
+            attnames = [self._meta.get_field(f).attname for f in fields]
+            self._loaded_values.update(self.field_values(attnames))
+
+    def field_values(self, attnames: List[str] = None) -> Dict[str, Any]:
+        """
+        Get the current values of the concrete fields, keyed by the field attname.
+        Deferred fields are not included.
+
+        :param attnames: Limit the values to these fields, defaults to all fields
+        :type attnames: List[str], optional
+        :return: The field values
+        :rtype: Dict[str, Any]
+        """
+
+        values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if attnames is not None and field.attname not in attnames:
+                continue
+            value = self.__dict__[field.attname]
+            values[field.attname] = (
+                value.name if isinstance(value, FieldFile) else value
+            )
+        return values
+
+    def stored_instance(self) -> "EmployeeBase":
+        """
+        Get the employee as it is stored in the database. The values that were captured
+        when the employee was loaded or last saved are used so that no query is needed,
+        the employee is only queried if it wasn't loaded from the database or some of
+        its fields were deferred.
+
+        :return: The stored employee, None if it hasn't been saved yet
+        :rtype: EmployeeBase
+        """
+
+        if self.pk is None:
+            return None
+
+        values = getattr(self, "_loaded_values", None)
+        fields = self._meta.concrete_fields
+        if values is None or len(values) != len(fields):
+            return self.__class__.objects.filter(pk=self.pk).first()
+
+        return self.from_db(
+            self._state.db,
+            [f.attname for f in fields],
+            [values[f.attname] for f in fields],
+        )
+
+    def changed_fields(self, other: "EmployeeBase") -> List[str]:
+        """
+        Compare the tracked fields to another instance of the employee. Related objects
+        are compared by their id so that they don't need to be loaded.
+
+        :param other: The instance to compare to, usually the stored_instance
+        :type other: EmployeeBase
+        :return: The names of the tracked fields that differ
+        :rtype: List[str]
+        """
+
+        changed = []
+        for name in self.TRACKED_FIELDS:
+            attname = self._meta.get_field(name).attname
+            if getattr(self, attname) != getattr(other, attname):
+                changed.append(name)
+        return changed
+
     @property
     def secondary_jobs(self) -> "django.db.models.QuerySet":
         """Returns the query set for secondary jobs"""
@@ -4,7 +4,8 @@
 import logging
 
 from pathlib import Path
-from django.db import models, IntegrityError
+from typing import Dict
+from django.db import models, transaction, IntegrityError
 from django.db.models.signals import pre_save
 from django.utils import timezone
 from django.conf import settings
@@ -12,7 +13,7 @@ from common.functions import password_generator
 from hris_integration.models.encryption import PasswordField
 from hris_integration.models import InactiveMixin
 from time import time
-from employee.validators import UPNValidator, UsernameValidator
+from employee.usernames import get_allocator
 from extras.models import Notification
 
 from .base import EmployeeBase
@@ -83,6 +84,23 @@ class Employee(EmployeeBase, InactiveMixin):
     #: The employees password (encrypted at the database level).
     password: str = PasswordField(null=True, blank=True, default=password_generator)
 
+    #: The fields that are compared to decide if the employee has changed.
+    TRACKED_FIELDS = [
+        "first_name",
+        "last_name",
+        "middle_name",
+        "suffix",
+        "start_date",
+        "state",
+        "leave",
+        "username",
+        "photo",
+        "email_alias",
+        "manager",
+        "location",
+        "primary_job",
+    ]
+
     def __eq__(self, other) -> bool:
         """Checks if the two models are the same using key fields."""
 
@@ -92,54 +110,7 @@ class Employee(EmployeeBase, InactiveMixin):
         if int(self.id) != int(other.pk):
             return False
 
-        for field in [
-            "first_name",
-            "last_name",
-            "middle_name",
-            "suffix",
-            "start_date",
-            "state",
-            "leave",
-            "username",
-            "photo",
-            "email_alias",
-        ]:
-            if getattr(self, field) != getattr(other, field):
-                return False
-
-        if (
-            self.manager is None
-            and other.manager is not None
-            or self.manager is not None
-            and other.manager is None
-        ):
-            return False
-        elif self.manager and other.manager and self.manager.pk != other.manager.pk:
-            return False
-        if (
-            self.location is None
-            and other.location is not None
-            or self.location is not None
-            and other.location is None
-        ):
-            return False
-        elif self.location and other.location and self.location.pk != other.location.pk:
-            return False
-        if (
-            self.primary_job is None
-            and other.primary_job is not None
-            or self.primary_job is not None
-            and other.primary_job is None
-        ):
-            return False
-        elif (
-            self.primary_job
-            and other.primary_job
-            and self.primary_job.pk != other.primary_job.pk
-        ):
-            return False
-
-        return True
+        return not self.changed_fields(other)
 
     def __ne__(self, other) -> bool:
         return not self.__eq__(other)
@@ -166,22 +137,8 @@ class Employee(EmployeeBase, InactiveMixin):
         :param instance: Employee
         :raises ValueError: If the username cannot be generated after 10 cycles
         """
-        for x in range(0, 10):
-            username = UsernameValidator(instance.first_name, instance.last_name, x)
-            username.clean()
-            if username.username == instance.username:
-                return
-            if username.is_valid():
-                try:
-                    e = cls.objects.get(username=username.username)
-                    if e.id == instance.id:
-                        return
-
-                except Employee.DoesNotExist:
-                    instance.username = username.username
-                    return
 
-        raise ValueError("Could not generate a unique username")
+        cls._allocate(instance, "username")
 
     @classmethod
     def reset_upn(cls, instance: "Employee") -> None:
@@ -193,32 +150,65 @@ class Employee(EmployeeBase, InactiveMixin):
         :param instance: Employee
         :raises ValueError: If the username cannot be generated after 10 cycles
         """
-        for x in range(0, 10):
-            upn = UPNValidator(instance.first_name, instance.last_name, x)
-            upn.clean()
-            if upn.username == instance.email_alias:
-                return
-            if upn.is_valid():
-                try:
-                    e = cls.objects.get(email_alias=upn.username)
-                    if e.id == instance.id:
-                        return
 
-                except Employee.DoesNotExist:
-                    instance.email_alias = upn.username
-                    return
+        cls._allocate(instance, "email_alias")
+
+    @classmethod
+    def _allocate(cls, instance: "Employee", field: str) -> None:
+        allocator = get_allocator(cls)[field]
+        value = allocator.allocate(instance, instance.first_name, instance.last_name)
+        if value != getattr(instance, field):
+            setattr(instance, field, value)
+            # the value is retried by save if it was taken by another writer
+            instance.__dict__.setdefault("_allocated", {})[field] = value
+
+    def save(self, *args, **kwargs) -> None:
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        for attempt in range(0, 3):
+            self._allocated = {}
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = self._taken(self._allocated)
+                if not taken or attempt == 2:
+                    raise
+
+            # the allocated names were taken since they were loaded, reload them and
+            # allocate new ones
+            logger.warning(f"{taken} of {self} were taken, retrying")
+            allocator = get_allocator(self.__class__)
+            for field, value in taken.items():
+                allocator[field].forget(value)
+                setattr(self, field, None)
+            opts = self._mptt_meta
+            for attr in (opts.left_attr, opts.right_attr, opts.tree_id_attr):
+                setattr(self, attr, None)
+
+    def _taken(self, allocated: Dict[str, str]) -> Dict[str, str]:
+        """
+        Get the allocated names that are stored for another employee, an insert that
+        failed for any other reason isn't retried.
+
+        :param allocated: The allocated names keyed by field
+        :type allocated: Dict[str, str]
+        :return: The names that were taken keyed by field
+        :rtype: Dict[str, str]
+        """
 
-        raise ValueError("Could not generate a unique username")
+        return {
+            field: value
+            for field, value in allocated.items()
+            if self.__class__._base_manager.filter(**{f"{field}__iexact": value})
+            .exclude(pk=self.pk)
+            .exists()
+        }
 
     @classmethod
     def pre_save(cls, sender, instance, raw, using, update_fields, **kwargs):
-        try:
-            if instance.id:
-                prev_instance = Employee.objects.get(id=instance.id)
-            else:
-                prev_instance = None
-        except Employee.DoesNotExist:
-            prev_instance = None
+        prev_instance = instance.stored_instance()
 
         if prev_instance:
             if (
@@ -284,6 +274,27 @@ class EmployeeImport(EmployeeBase):
     employee: Employee = models.OneToOneField(
         Employee, on_delete=models.PROTECT, blank=True, null=True
     )
+    #: The fingerprint of the source row that was last imported for the employee.
+    row_hash: str = models.CharField(max_length=64, blank=True, null=True)
+
+    #: The fields that are compared to decide if the employee has changed, changes are
+    #: propagated to the matched employee.
+    TRACKED_FIELDS = [
+        "first_name",
+        "last_name",
+        "middle_name",
+        "suffix",
+        "start_date",
+        "state",
+        "leave",
+        "type",
+        "username",
+        "email_alias",
+        "manager",
+        "location",
+        "primary_job",
+        "employee",
+    ]
 
     def __eq__(self, other) -> bool:
         """Check if two EmployeeImport objects are equal using key values."""
@@ -300,33 +311,12 @@ class EmployeeImport(EmployeeBase):
             "suffix",
             "state",
             "leave",
+            "location_id",
+            "primary_job_id",
         ]:
             if getattr(self, field) != getattr(other, field):
                 return False
 
-        if (
-            self.location is None
-            and other.location is not None
-            or self.location is not None
-            and other.location is None
-        ):
-            return False
-        elif self.location and other.location and self.location.pk != other.location.pk:
-            return False
-        if (
-            self.primary_job is None
-            and other.primary_job is not None
-            or self.primary_job is not None
-            and other.primary_job is None
-        ):
-            return False
-        elif (
-            self.primary_job
-            and other.primary_job
-            and self.primary_job.pk != other.primary_job.pk
-        ):
-            return False
-
         return True
 
     def __ne__(self, other) -> bool:
@@ -347,22 +337,16 @@ class EmployeeImport(EmployeeBase):
         elif instance.employee is None and instance.is_matched:
             instance.is_matched = False
 
-        if instance.id:
-            try:
-                prev_instance = EmployeeImport.objects.get(id=instance.id)
-            except EmployeeImport.DoesNotExist:
-                prev_instance = None
-        else:
-            prev_instance = None
+        prev_instance = instance.stored_instance()
 
-        if prev_instance and instance != prev_instance:
+        if prev_instance and instance.changed_fields(prev_instance):
             instance.updated_on = timezone.now()
 
             if instance.is_matched:
                 ec = False
                 if (
-                    instance.manager
-                    and instance.manager != prev_instance.manager
+                    instance.manager_id
+                    and instance.manager_id != prev_instance.manager_id
                     and instance.manager.is_matched
                 ):
                     instance.employee.manager = instance.manager.employee
@@ -373,6 +357,8 @@ class EmployeeImport(EmployeeBase):
                         ec = True
 
                 for key in UPDATE_FIELDS_OPTIONAL:
+                    # compare the ids of related objects so they aren't loaded
+                    key = instance._meta.get_field(key).attname
                     if (
                         getattr(instance.employee, key, None) is None
                         or getattr(instance.employee, key)
@@ -383,15 +369,17 @@ class EmployeeImport(EmployeeBase):
                         ec = True
 
                 for key in UPDATE_FIELDS_ALWAYS:
+                    key = instance._meta.get_field(key).attname
                     if getattr(instance, key, None) != None:
                         setattr(instance.employee, key, getattr(instance, key))
                         ec = True
 
-                if prev_instance.employee is None:
+                if prev_instance.employee_id is None:
                     try:
                         instance.employee.employee_id = instance.id
                         instance.employee.is_imported = True
-                        instance.employee.save()
+                        with transaction.atomic():
+                            instance.employee.save()
                     except IntegrityError:
                         logger.warning(
                             "Employee ID is already associated with an employee,"
@@ -406,7 +394,8 @@ class EmployeeImport(EmployeeBase):
                             try:
                                 instance.employee.employee_id = instance.id
                                 instance.employee.is_imported = True
-                                instance.employee.save()
+                                with transaction.atomic():
+                                    instance.employee.save()
                             except IntegrityError:
                                 logger.error(
                                     f"Failed to unlink employee id {instance.id} from "
@@ -437,10 +426,12 @@ class EmployeeImport(EmployeeBase):
             for job in instance.jobs.all():
                 instance.employee.jobs.add(job)
             for key in UPDATE_FIELDS_ALWAYS:
+                key = instance._meta.get_field(key).attname
                 if getattr(instance, key, None) != None:
                     setattr(instance.employee, key, getattr(instance, key))
 
             for key in UPDATE_FIELDS_OPTIONAL:
+                key = instance._meta.get_field(key).attname
                 if getattr(instance.employee, key, None) is None:
                     setattr(instance.employee, key, getattr(instance, key))
 
@@ -448,7 +439,8 @@ class EmployeeImport(EmployeeBase):
                 try:
                     instance.employee.employee_id = instance.id
                     instance.employee.is_imported = True
-                    instance.employee.save()
+                    with transaction.atomic():
+                        instance.employee.save()
                     ec = True
                 except IntegrityError:
                     logger.warning(
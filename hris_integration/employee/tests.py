@@ -1,7 +1,9 @@
 # Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+from django.db import connection
 from django.test import TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 from .validators import UsernameValidator, UPNValidator
 
@@ -71,3 +73,230 @@ class Validators(SimpleTestCase):
         v = UPNValidator("Issac", "Asimov", "0")
         self.assertEqual(v.is_valid(), True)
         self.assertEqual(v.username, "Issac.Asimov0")
+
+
+class Usernames(TestCase):
+    def test_allocator(self):
+        from .models import Employee
+        from .usernames import UsernameAllocator
+
+        existing = Employee.objects.create(first_name="Issac", last_name="Asimov")
+        allocator = UsernameAllocator(Employee)
+        with allocator.activate():
+            with self.assertNumQueries(2):
+                allocator.preload([("Issac", "Asimov"), ("Issac", "Asimov")])
+            first = Employee.objects.create(first_name="Issac", last_name="Asimov")
+            # taken by another writer after the names were loaded
+            Employee.objects.filter(pk=existing.pk).update(username="IAsimov2")
+            second = Employee.objects.create(first_name="Issac", last_name="Asimov")
+
+        self.assertEqual(first.username, "IAsimov1")
+        # the taken names were reloaded by the retry
+        self.assertEqual(second.username, "IAsimov")
+        self.assertEqual(second.email_alias, "Issac.Asimov2")
+
+    def test_conflict(self):
+        from unittest import mock
+        from django.db import IntegrityError
+        from .models import Employee
+
+        Employee.objects.create(first_name="Ursula", last_name="Le Guin", employee_id=9)
+        with mock.patch("employee.usernames.NameAllocator.forget") as forget:
+            # only a conflict on the allocated names is retried
+            with self.assertRaises(IntegrityError):
+                Employee.objects.create(
+                    first_name="Ursula", last_name="Le Guin", employee_id=9
+                )
+        forget.assert_not_called()
+
+
+class Managers(TestCase):
+    def setUp(self):
+        from organization.models import BusinessUnit, JobRole
+
+        self.bu = BusinessUnit.objects.create(id=1, name="BU")
+        self.job = JobRole.objects.create(id=1, name="Job", business_unit=self.bu)
+
+    def test_bulk(self):
+        from organization.models import GroupMapping, Location
+        from .data_structures import EmployeeManager
+        from .models import Employee, Phone
+
+        job = self.job
+        location = Location.objects.create(id=1, name="Location")
+        GroupMapping.objects.create(dn="CN=All,DC=test", all=True)
+        GroupMapping.objects.create(dn="CN=Job,DC=test").jobs.add(job)
+
+        def add(count):
+            for x in range(count):
+                employee = Employee.objects.create(
+                    first_name="Issac",
+                    last_name="Asimov",
+                    primary_job=job,
+                    location=location,
+                )
+                Phone.objects.create(employee=employee, number=f"555{x}", primary=True)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                managers = EmployeeManager.bulk(Employee.objects.all())
+            return len(queries), managers
+
+        add(2)
+        count_queries()
+        small, _ = count_queries()
+        add(3)
+        large, managers = count_queries()
+
+        self.assertEqual(small, large)
+        for manager in managers:
+            single = EmployeeManager(manager.employee)
+            self.assertEqual(manager.groups_add(), single.groups_add())
+            self.assertEqual(manager.phone, single.phone)
+
+    def test_lazy_ad_user(self):
+        from unittest import mock
+        from .data_structures import EmployeeManager
+        from .models import Employee
+
+        employee = Employee.objects.create(
+            first_name="Issac", last_name="Asimov", primary_job=self.job, guid="{0}"
+        )
+        with mock.patch("employee.data_structures.search.get_by_guid") as get:
+            manager = EmployeeManager(employee)
+            get.assert_not_called()
+            self.assertEqual(manager.ad_user, get.return_value)
+            manager.ad_user
+            get.assert_called_once_with("{0}")
+
+    def test_group_rules(self):
+        from organization.group_manager import GroupManager
+        from organization.models import GroupMapping, JobRole
+
+        bu, job = self.bu, self.job
+        other = JobRole.objects.create(id=2, name="Other", business_unit=bu)
+        GroupMapping.objects.create(dn="CN=All,DC=test", all=True)
+        mapping = GroupMapping.objects.create(dn="CN=NotOther,DC=test", jobs_not=True)
+        mapping.jobs.add(other)
+        # install the settings
+        GroupManager.config_groups()
+
+        groups = GroupManager(job, bu, None)
+        self.assertEqual(groups.add_groups, ["CN=All,DC=test", "CN=NotOther,DC=test"])
+        with self.assertNumQueries(0):
+            groups = GroupManager(other, bu, None)
+        self.assertEqual(groups.remove_groups, ["CN=NotOther,DC=test"])
+
+        mapping.jobs.add(job)
+        groups = GroupManager(job, bu, None)
+        self.assertEqual(groups.add_groups, ["CN=All,DC=test"])
+
+    def test_group_names(self):
+        from unittest import mock
+        from organization.group_manager import GroupManager
+        from organization.group_names import GroupNames
+
+        GroupNames.clear()
+        with mock.patch("organization.group_names.ADQuery") as query:
+            query.return_value.get_results.return_value = [
+                {"cn": "Leave", "distinguishedName": "CN=Leave,OU=Groups,DC=test"}
+            ]
+            GroupManager.warm(["Leave,Missing", "CN=App,DC=test"])
+            for _ in range(2):
+                groups = GroupManager.parse_group("Leave,Missing,CN=App,DC=test")
+            query.return_value.execute_query.assert_called_once()
+
+        self.assertEqual(groups, ["CN=Leave,OU=Groups,DC=test", "CN=App,DC=test"])
+
+        GroupNames.clear()
+        with mock.patch("organization.group_names.ADQuery") as query:
+            query.return_value.execute_query.side_effect = Exception("unavailable")
+            self.assertEqual(GroupManager.parse_group("Leave"), [])
+            # a failed query isn't cached as an invalid name
+            self.assertEqual(GroupNames.cached("Leave"), (False, None))
+            GroupManager.parse_group("Leave")
+            self.assertEqual(query.return_value.execute_query.call_count, 2)
+
+    def test_group_dns(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from active_directory.validators import DnValidator
+        from organization.group_manager import GroupManager
+        from organization.group_names import GroupNames
+
+        dns = [
+            "CN=App Users, OU=Groups, DC=test, DC=local",
+            "CN=Smith\\, John,OU=Groups,DC=test",
+            "CN=App,OU=Groups,O=Org,DC=test",
+        ]
+        GroupNames.clear()
+        for dn in dns:
+            DnValidator()(dn)
+        self.assertRaises(ValidationError, DnValidator(), "CN=App,OU=Groups")
+        with mock.patch("organization.group_names.ADQuery") as query:
+            self.assertEqual(GroupManager.parse_group(",".join(dns)), dns)
+            query.return_value.execute_query.assert_not_called()
+
+        rules = SimpleNamespace(actions=lambda *args: [], groups_leave=[])
+        manager = GroupManager(None, None, None, rules)
+        for dn in dns:
+            manager.add_application(SimpleNamespace(name="App", mapped_group=dn))
+        self.assertEqual(manager.add_groups, dns)
+
+    def test_find_users(self):
+        from unittest import mock
+        from ad_export.form import BaseExport
+        from .data_structures import EmployeeManager
+        from .models import Employee, EmployeeImport
+
+        def employee(username, emp_id=None):
+            e = Employee.objects.create(
+                first_name="Issac",
+                last_name="Asimov",
+                username=username,
+                primary_job=self.job,
+                is_imported=emp_id is not None,
+            )
+            if emp_id is not None:
+                EmployeeImport.objects.create(
+                    id=emp_id, first_name="Issac", last_name="Asimov", employee=e
+                )
+            return EmployeeManager(e)
+
+        one = employee("One")
+        two = employee("Two")
+        shared = [employee("Shared"), employee("shared")]
+        by_id = employee("Id", 1001)
+        same = [employee("Same", 1002), employee("Same2")]
+        users = [
+            {"distinguishedName": "CN=One", "sAMAccountName": "one"},
+            {"distinguishedName": "CN=Two,OU=A", "sAMAccountName": "two"},
+            {"distinguishedName": "CN=Two,OU=B", "sAMAccountName": "TWO"},
+            {"distinguishedName": "CN=Shared", "sAMAccountName": "shared"},
+            # employees with an id are only matched on the employee number and id
+            {"distinguishedName": "CN=Name", "sAMAccountName": "id"},
+            {"distinguishedName": "CN=Id", "employeeID": "1001"},
+            {
+                "distinguishedName": "CN=Same",
+                "employeeNumber": 1002,
+                "sAMAccountName": "same2",
+            },
+        ]
+
+        with mock.patch("ad_export.form.config.get_employees") as get_employees:
+            get_employees.return_value = [one, two, *shared, by_id, *same]
+            export = BaseExport()
+        with mock.patch("active_directory.search.ADQuery") as query, mock.patch(
+            "ad_export.form.ADUser"
+        ) as user:
+            query.return_value.get_results.return_value = users
+            user.from_dn.return_value.guid = "{0}"
+            duplicates = export.find_users()
+
+        self.assertEqual(query.return_value.execute_query.call_count, 2)
+        self.assertCountEqual(
+            [call.args[0] for call in user.from_dn.call_args_list], ["CN=One", "CN=Id"]
+        )
+        self.assertEqual((one.guid, by_id.guid), ("{0}", "{0}"))
+        self.assertCountEqual(duplicates, [two, *shared, *same])
+        self.assertEqual(len(export.errors), 5)
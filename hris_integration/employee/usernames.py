@@ -0,0 +1,227 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+import os
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Tuple
+from django.db.models import Q
+
+from .validators import UPNValidator, UsernameValidator
+
+logger = logging.getLogger("employee.usernames")
+
+__all__ = ("NameAllocator", "UsernameAllocator", "active", "get_allocator")
+
+#: The number of suffixes that are tried before giving up on a name
+ATTEMPTS = 10
+#: The number of prefixes that are loaded per query by preload
+PRELOAD_BATCH = 100
+
+_local = threading.local()
+
+
+class NameAllocator:
+    """
+    Allocate unique values for the username or email_alias field of a model.
+
+    The candidates for a name are built by the validator with the suffixes 0 to 9, the
+    same way that the names have always been generated. All of the taken values that
+    start with the common prefix of the candidates are loaded with a single query and
+    kept in memory, so the candidates of a name are checked without further queries and
+    every name that is handed out is reserved for the rest of the batch.
+
+    The values are compared case insensitively. The taken values may become stale if
+    other writers save employees at the same time, the save then fails on the unique
+    constraint and the caller needs to reload the prefix with forget and retry.
+    """
+
+    def __init__(self, model, field: str, validator) -> None:
+        """
+        :param model: The model that the values need to be unique in
+        :type model: django.db.models.Model
+        :param field: The name of the unique field
+        :type field: str
+        :param validator: The validator class that builds the candidates
+        :type validator: UsernameValidatorBase
+        """
+
+        self.model = model
+        self.field = field
+        self.validator = validator
+        #: The primary key of the owner of each taken value, or the owner itself if it
+        #: hasn't been saved yet, keyed by the lower case value
+        self.taken: Dict[str, Any] = {}
+        self.loaded = set()
+
+    def candidates(self, first: str, last: str) -> List[str]:
+        """
+        Build the valid candidates for a name, in the order that they are tried.
+
+        :param first: The first name
+        :type first: str
+        :param last: The last name
+        :type last: str
+        :return: The candidate values
+        :rtype: List[str]
+        """
+
+        output = []
+        for x in range(0, ATTEMPTS):
+            name = self.validator(first, last, x)
+            name.clean()
+            if name.is_valid():
+                output.append(name.username)
+        return output
+
+    @staticmethod
+    def prefix(candidates: List[str]) -> str:
+        """The lower case prefix that all of the candidates start with"""
+
+        return os.path.commonprefix([c.lower() for c in candidates])
+
+    def load(self, prefixes: Iterable[str]) -> None:
+        """
+        Load the taken values that start with any of the prefixes that haven't been
+        loaded yet.
+
+        :param prefixes: The lower case prefixes
+        :type prefixes: Iterable[str]
+        """
+
+        prefixes = [p for p in set(prefixes) if p not in self.loaded]
+        for i in range(0, len(prefixes), PRELOAD_BATCH):
+            query = Q()
+            for prefix in prefixes[i : i + PRELOAD_BATCH]:
+                query |= Q(**{f"{self.field}__istartswith": prefix})
+            values = self.model._base_manager.filter(query).values_list(
+                self.field, "pk"
+            )
+            for value, pk in values:
+                self.taken[value.lower()] = pk
+        self.loaded.update(prefixes)
+        if prefixes:
+            logger.debug(f"Loaded the {self.field} values of {len(prefixes)} names")
+
+    def forget(self, value: str) -> None:
+        """
+        Forget the taken values that share a loaded prefix with the value, they are
+        loaded again by the next allocation.
+
+        :param value: The value that turned out to be taken
+        :type value: str
+        """
+
+        value = value.lower()
+        stale = {p for p in self.loaded if value.startswith(p)}
+        self.loaded -= stale
+        for key in [k for k in self.taken if any(k.startswith(p) for p in stale)]:
+            del self.taken[key]
+
+    def allocate(self, instance, first: str, last: str) -> str:
+        """
+        Get a unique value for the instance. The current value of the instance is kept
+        if it is one of the candidates for the name and is available.
+
+        :param instance: The instance that the value is for
+        :type instance: django.db.models.Model
+        :param first: The first name
+        :type first: str
+        :param last: The last name
+        :type last: str
+        :raises ValueError: If none of the candidates are available
+        :return: The value, reserved for the instance
+        :rtype: str
+        """
+
+        candidates = self.candidates(first, last)
+        if candidates:
+            self.load([self.prefix(candidates)])
+
+        current = getattr(instance, self.field)
+        for candidate in candidates:
+            key = candidate.lower()
+            owner = self.taken.get(key)
+            mine = owner is instance or (
+                instance.pk is not None and getattr(owner, "pk", owner) == instance.pk
+            )
+            if key not in self.taken or mine:
+                # unsaved instances reserve the value until they have a primary key
+                self.taken[key] = instance.pk if instance.pk is not None else instance
+                return candidate
+            if candidate == current:
+                return candidate
+
+        raise ValueError(f"Could not generate a unique {self.field}")
+
+
+class UsernameAllocator:
+    """
+    The username and email alias allocators of the employees saved in a batch. While the
+    allocator is active the employee usernames and aliases are handed out by it, the
+    names of a batch can be loaded up front with preload.
+    """
+
+    def __init__(self, model) -> None:
+        self.usernames = NameAllocator(model, "username", UsernameValidator)
+        self.aliases = NameAllocator(model, "email_alias", UPNValidator)
+
+    def __getitem__(self, field: str) -> NameAllocator:
+        return self.usernames if field == "username" else self.aliases
+
+    def preload(self, names: Iterable[Tuple[str, str]]) -> None:
+        """
+        Load the taken usernames and aliases for a batch of new employees.
+
+        :param names: The first and last name of each employee
+        :type names: Iterable[Tuple[str, str]]
+        """
+
+        names = list(names)
+        for allocator in (self.usernames, self.aliases):
+            prefixes = []
+            for first, last in names:
+                if not first:
+                    continue
+                candidates = allocator.candidates(first, last)
+                if candidates:
+                    prefixes.append(allocator.prefix(candidates))
+            allocator.load(prefixes)
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the allocator that is used by the Employee model in this thread. The
+        previous allocator is restored when the context exits.
+        """
+
+        previous = getattr(_local, "allocator", None)
+        _local.allocator = self
+        try:
+            yield self
+        finally:
+            _local.allocator = previous
+
+
+def active() -> UsernameAllocator:
+    """Get the allocator that is active in this thread, None if there isn't one"""
+
+    return getattr(_local, "allocator", None)
+
+
+def get_allocator(model) -> UsernameAllocator:
+    """
+    Get the active allocator, or a new allocator if there isn't one.
+
+    :param model: The model that the names need to be unique in
+    :type model: django.db.models.Model
+    :return: The allocator
+    :rtype: UsernameAllocator
+    """
+
+    allocator = active()
+    if allocator is None or allocator.usernames.model is not model:
+        allocator = UsernameAllocator(model)
+    return allocator
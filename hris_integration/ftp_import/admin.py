@@ -2,9 +2,14 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 from django.contrib import admin
-from .models import FileTrack
+from .models import FileTrack, ImportRun
 
 
 @admin.register(FileTrack)
 class FileTrackAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ("name", "time_start", "rows_processed", "errors", "queries")
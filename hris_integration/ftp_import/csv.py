@@ -2,20 +2,73 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
-import string
 import importlib
-import csv
 
-from .helpers import config
-from .helpers.stats import Stats
-from .helpers.text_utils import safe, decode
-from .exceptions import ConfigurationError, ObjectCreationError
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from typing import Dict, Iterator, List, Set, Tuple
+from django.db import connections, transaction
+from common.functions import get_model_pk_name
+from employee.models import Employee, EmployeeImport
+from employee.usernames import UsernameAllocator
+
+from . import readers
+from .helpers import config, parallel, tree
+from .helpers.cache import ImportCache
+from .helpers.columns import ColumnPlan
+from .helpers.diff import ImportDiff
+from .helpers.pending import PendingIndex
+from .helpers.stats import Metrics, Stats
+from .helpers.text_utils import safe, int_or_str
+from .models import FileTrack
+from .exceptions import ConfigurationError
 
 logger = logging.getLogger("ftp_import.CSVImport")
 
 
+@contextmanager
+def _rollback():
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
 class CsvImport:
-    def __init__(self, file_handle) -> None:
+    """
+    Import a csv file using the configured import form.
+
+    The file is streamed through the parse and save steps, each row is passed to the
+    form as soon as it has been read so the memory use doesn't depend on the size of
+    the file. The rows are read by the Reader for the format of the file, see
+    readers.get_reader, csv files are read with the csv module so quoted fields may
+    contain the separator or span multiple lines.
+
+    When the import is tracked with a FileTrack object the line of the last row of each
+    committed batch is checkpointed, the rows up to the checkpoint are skipped when the
+    import of the file is resumed.
+
+    The metrics of the import are kept in a Metrics object that is merged into the
+    metrics of the active run once the file has been imported. The caller can pass in
+    the Metrics object to keep the metrics of an import that raised.
+
+    A dry run records the changes that the file would make in an ImportDiff, available
+    as diff, instead of saving them. The rows are compared against the objects that are
+    preloaded for each batch and everything runs in a transaction that is rolled back.
+
+    The MPTT tree updates of the employees, business units and locations can be
+    deferred to a rebuild of the trees once the rows of the file have been saved, see
+    helpers.tree.
+    """
+
+    def __init__(
+        self,
+        file_handle,
+        track: FileTrack = None,
+        dry_run: bool = False,
+        name: str = None,
+        metrics: Metrics = None,
+    ) -> None:
         if not hasattr(file_handle, "readable"):
             try:
                 _ = file_handle.readable()
@@ -23,40 +76,65 @@ class CsvImport:
                 raise ValueError("expected open file handle")
 
         self.fields = []
-        self.data = []
-        self.sep = config.get_config(config.CAT_CSV, config.CSV_FIELD_SEP)
-        self.form = config.get_config(config.CAT_CSV, config.CSV_IMPORT_CLASS)
+        self.parse_error = []
+        self.track = track
+        self.resume_line = track.line if track is not None else 0
+        # the configuration is loaded once so that the whole run uses the same settings
+        self.config = config.ConfigSnapshot()
+        self.form = self.config(config.CAT_CSV, config.CSV_IMPORT_CLASS)
+        if name is None and track is not None:
+            name = track.name
+        self.reader = readers.get_reader(self.config, name)
+        # the pending employees are only loaded if a new employee needs to be matched
+        self.pending = PendingIndex()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.diff = ImportDiff() if dry_run else None
+        #: The tree nodes moved while the tree updates are deferred
+        self.tree_changes = None
+        # the usernames and aliases of the new employees are allocated for the file
+        self.allocator = UsernameAllocator(Employee)
 
-        self.parse_headers(file_handle)
-        self.parse_data(file_handle)
-        self.add_data()
+        run = Stats()
+        stream = readers.text_stream(file_handle)
+        try:
+            with self.metrics.activate(), self.dry_run_transaction():
+                with self.metrics.phase("parse"):
+                    self.parse_headers(stream)
+                with self.tree_updates() as self.tree_changes, self.allocator.activate():
+                    self.add_data(self.time_parse(self.parse_data(stream)))
+        finally:
+            self.metrics.finish()
+            run.merge(self.metrics.collect())
+            readers.release_stream(stream, file_handle)
 
-    def parse_headers(self, file_handle) -> None:
-        import_fields = config.get_fields()
+    def dry_run_transaction(self):
+        """Get the transaction that a dry run is rolled back in"""
 
-        # ensure we're at the start of the file to grab the header row
-        file_handle.seek(0)
+        if self.diff is None:
+            return nullcontext()
+        return _rollback()
 
-        headers = decode(file_handle.readline())
-        logger.debug(f"parsing potential header row {headers[0:60]}")
+    def tree_updates(self):
+        """
+        Get the context that the rows are saved in, the tree updates are deferred to a
+        rebuild at the end of the file if they are configured to be.
+        """
 
-        while headers[0] not in string.ascii_letters + string.digits + "'" + '"':
-            logger.debug(
-                "Discarding starting line(s) as it doesn't start with a valid character"
-            )
-            logger.debug(f"line: {headers}")
-            if headers[0] == self.sep:
-                logger.error(
-                    "The csv file doesn't seem to have a valid header row or we discarded it"
-                )
-                raise IndexError(
-                    "The csv file does not seem to have a valid header row"
-                )
-            headers = decode(file_handle.readline())
-            logger.debug(f"parsing potential header row {headers[0:60]}")
+        if self.diff is None and self.config(config.CAT_CSV, config.CSV_DEFER_TREE):
+            return tree.deferred_tree_updates()
+        return nullcontext()
+
+    @property
+    def id_field(self) -> str:
+        """The name of the field that is imported as the employee id"""
+
+        return self.fields.field_name(get_model_pk_name(EmployeeImport)) or None
+
+    def parse_headers(self, file_handle) -> None:
+        import_fields = config.get_fields()
 
         new_fields = []
-        for key in next(csv.reader([headers], delimiter=self.sep)):
+        for key in self.reader.headers(file_handle):
             key = safe(key)
             logger.debug(f"Processing header key: {key}")
             if key not in import_fields:
@@ -78,28 +156,72 @@ class CsvImport:
             return self.parse_headers(file_handle)
         else:
             logger.debug(f"There are {len(self.fields)} headers in the file")
+            self.fields = ColumnPlan(self.fields)
 
-    def parse_data(self, file_handle):
-        self.parse_error = []
+    def parse_data(self, file_handle) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """
+        Parse the rows following the header row.
 
-        for row in file_handle:
-            for vals in csv.reader([decode(row)]):
-                row_data = {}
-                if len(vals) != len(self.fields):
-                    logger.debug(f"Headers: {len(self.fields)} This row: {len(vals)}")
-                    logger.error(f"Unable to parse employee {vals[0]}")
-                    Stats.errors.append(
-                        f"Unable to parse employee {vals[0]} - Incorrect number of fields"
-                    )
-                    self.parse_error.append(vals[0])
-                else:
-                    for x in range(len(self.fields)):
-                        if self.fields[x] and self.fields[x]["import"]:
-                            row_data[self.fields[x]["field"]] = vals[x]
-                    # logger.debug(f"Parsed keys for row: {row_data.keys()}")
-                    self.data.append(row_data)
+        :param file_handle: The text file handle positioned after the header row
+        :type file_handle: io.TextIOBase
+        :yield: The line number that the row starts on and the row data keyed by the
+            field name for the fields that are imported
+        :rtype: Iterator[Tuple[int, Dict[str, str]]]
+        """
+
+        for line, vals in self.reader.rows(file_handle):
+            if line <= self.resume_line:
+                continue
+
+            if vals is None:
+                logger.error(f"Unable to parse line {line}")
+                Stats.errors.append(f"Line: {line} - Unable to parse row")
+                self.parse_error.append(str(line))
+                continue
+
+            if not vals:
+                continue
+
+            if len(vals) != len(self.fields):
+                logger.debug(f"Headers: {len(self.fields)} This row: {len(vals)}")
+                logger.error(f"Unable to parse employee {vals[0]} on line {line}")
+                Stats.errors.append(
+                    f"Line: {line} - Unable to parse employee {vals[0]} - "
+                    "Incorrect number of fields"
+                )
+                self.parse_error.append(vals[0])
+                continue
+
+            yield line, self.fields.row(vals)
+
+    def time_parse(
+        self, rows: Iterator[Tuple[int, Dict[str, str]]]
+    ) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """
+        Count the time spent reading the rows towards the parse phase.
+
+        :param rows: The parsed rows as returned by parse_data
+        :type rows: Iterator[Tuple[int, Dict[str, str]]]
+        :yield: The rows
+        :rtype: Iterator[Tuple[int, Dict[str, str]]]
+        """
+
+        while True:
+            with self.metrics.phase("parse"):
+                row = next(rows, None)
+            if row is None:
+                return
+            yield row
+
+    def add_data(self, rows: Iterator[Tuple[int, Dict[str, str]]]) -> None:
+        """
+        Load the configured form and save each of the parsed rows.
+
+        :param rows: The parsed rows as returned by parse_data
+        :type rows: Iterator[Tuple[int, Dict[str, str]]]
+        :raises ConfigurationError: The form module can't be loaded
+        """
 
-    def add_data(self):
         try:
             form_module = importlib.import_module(self.form)
         except ModuleNotFoundError as e:
@@ -118,20 +240,265 @@ class CsvImport:
             logger.critical(f"Form module has no attribute form")
             raise ConfigurationError(f"Form module has no attribute form")
 
-        for row in range(0, len(self.data)):
-            try:
-                # logger.debug(f"{type(self.data[row])} - {self.data[row]}")
-                f = form(self.fields, **self.data[row])
-                f.save()
-            except ValueError as e:
-                logger.error(
-                    "Failed to save Employee refer to previous logs for more details"
-                )
-                logger.debug(f"{e}")
-                Stats.errors.append(f"Line: {row} - Error: {e}")
-            except ObjectCreationError as e:
-                logger.error(
-                    "Caught exception while creating employee, failed to create reference "
-                    "object. Refer to above logs"
-                )
-                Stats.errors.append(f"Line: {row} - Error: {e}")
+        if self.diff is not None:
+            return self.plan_data(form, rows)
+
+        workers = self.config(config.CAT_CSV, config.CSV_WORKERS)
+        if workers > 1:
+            if not parallel.supported():
+                logger.warning("The database doesn't support parallel imports")
+            elif hasattr(form, "can_defer_writes") and form.can_defer_writes():
+                return self.add_data_parallel(form, rows, workers)
+            else:
+                logger.warning("The import form overrides save, importing serially")
+
+        if self.config(config.CAT_CSV, config.CSV_BULK_IMPORT):
+            batch_size = self.config(config.CAT_CSV, config.CSV_BULK_SIZE)
+            defer = hasattr(form, "can_defer_writes") and form.can_defer_writes()
+            logger.info(f"Running bulk import, batch size {batch_size} defer {defer}")
+            cache = ImportCache(self.fields, defer, batch_size, self.config)
+        else:
+            # without a transaction every row is committed and checkpointed on its own
+            batch_size = self.config(config.CAT_CSV, config.CSV_COMMIT_SIZE) or 1
+            cache = None
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            with parallel.batch_transaction(self.config):
+                if cache is not None:
+                    with self.metrics.phase("map"):
+                        cache.preload([row for _, row in batch])
+                for line, row in batch:
+                    self.add_row(form, line, row, cache)
+                if cache is not None:
+                    with self.metrics.phase("save"):
+                        cache.flush()
+                self.checkpoint(batch[-1][0])
+
+    def plan_data(self, form, rows: Iterator[Tuple[int, Dict[str, str]]]) -> None:
+        """
+        Record the changes of the rows in the diff without saving them. The rows are
+        planned in batches of the bulk import size against a preloaded ImportCache.
+
+        :param form: The configured import form class
+        :type form: ftp_import.forms.BaseImport
+        :param rows: The parsed rows as returned by parse_data
+        :type rows: Iterator[Tuple[int, Dict[str, str]]]
+        """
+
+        batch_size = self.config(config.CAT_CSV, config.CSV_BULK_SIZE)
+        cache = ImportCache(self.fields, False, batch_size, self.config)
+        logger.info(f"Running dry run, batch size {batch_size}")
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            with self.metrics.phase("map"):
+                cache.preload([row for _, row in batch])
+                for line, row in batch:
+                    try:
+                        form(
+                            self.fields,
+                            cache=cache,
+                            snapshot=self.config,
+                            pending=self.pending,
+                            **row,
+                        ).plan(self.diff)
+                    except ValueError as e:
+                        logger.error(f"Unable to plan line {line}, {e}")
+                        self.diff.errors.append(f"Line: {line} - Error: {e}")
+
+    def checkpoint(self, line: int) -> None:
+        """
+        Record that the rows up to the line have been saved, if the import is tracked.
+
+        :param line: The line number of the last saved row
+        :type line: int
+        """
+
+        if self.track is not None:
+            self.track.checkpoint(line)
+
+    def add_data_parallel(
+        self, form, rows: Iterator[Tuple[int, Dict[str, str]]], workers: int
+    ) -> None:
+        """
+        Import the rows in batches using a pool of worker processes. Each batch is split
+        so that an employee only appears once in it.
+
+        :param form: The configured import form class
+        :type form: ftp_import.forms.BaseImport
+        :param rows: The parsed rows as returned by parse_data
+        :type rows: Iterator[Tuple[int, Dict[str, str]]]
+        :param workers: The number of worker processes
+        :type workers: int
+        """
+
+        batch_size = self.config(config.CAT_CSV, config.CSV_BULK_SIZE)
+        id_field = self.id_field
+        logger.info(
+            f"Running parallel import, {workers} workers batch size {batch_size}"
+        )
+
+        with ProcessPoolExecutor(workers, initializer=parallel.init_worker) as pool:
+            batch, ids = [], set()
+            for line, row in rows:
+                emp_id = int_or_str(row.get(id_field))
+                if emp_id in ids or len(batch) >= batch_size:
+                    self.add_batch(form, batch, pool, workers)
+                    batch, ids = [], set()
+                batch.append((line, row))
+                ids.add(emp_id)
+
+            if batch:
+                self.add_batch(form, batch, pool, workers)
+
+    def add_batch(
+        self,
+        form,
+        batch: List[Tuple[int, Dict[str, str]]],
+        pool: ProcessPoolExecutor,
+        workers: int,
+    ) -> None:
+        """
+        Save a batch of rows. The rows are processed in file order by the parent process,
+        except that the save_main and save_post steps of the independent rows are
+        partitioned by employee id and run by the workers once the rest of the batch has
+        been saved. The result is the same as importing the batch serially.
+
+        :param form: The configured import form class
+        :type form: ftp_import.forms.BaseImport
+        :param batch: The line number and parsed data of the rows
+        :type batch: List[Tuple[int, Dict[str, str]]]
+        :param pool: The worker pool
+        :type pool: ProcessPoolExecutor
+        :param workers: The number of worker processes
+        :type workers: int
+        """
+
+        independent = self.plan_batch(form, batch)
+        cache = ImportCache(self.fields, False, len(batch), self.config)
+        partitions = [[] for _ in range(workers)]
+
+        with parallel.batch_transaction(self.config):
+            with self.metrics.phase("map"):
+                cache.preload([row for _, row in batch])
+            for idx, (line, row) in enumerate(batch):
+                if idx in independent:
+                    with self.metrics.phase("map"):
+                        f = form(
+                            self.fields,
+                            cache=cache,
+                            snapshot=self.config,
+                            pending=self.pending,
+                            **row,
+                        )
+                    with self.metrics.phase("save"):
+                        f.save_pre()
+                    partitions[f.employee_id % workers].append((line, row))
+                else:
+                    self.add_row(form, line, row, cache)
+
+        partitions = [p for p in partitions if p]
+        logger.debug(
+            f"Saving {len(independent)} of {len(batch)} rows in {len(partitions)} workers"
+        )
+        if partitions:
+            # the workers must not share the connections of this process
+            connections.close_all()
+            futures = [
+                pool.submit(parallel.import_rows, form, self.fields, self.config, p)
+                for p in partitions
+            ]
+            for future in futures:
+                # the rows were already counted when save_pre was run
+                self.metrics.merge(future.result(), skip=("rows_processed",))
+
+        # the workers commit on their own so the batch is checkpointed once they finish
+        self.checkpoint(batch[-1][0])
+
+    def plan_batch(self, form, batch: List[Tuple[int, Dict[str, str]]]) -> Set[int]:
+        """
+        Find the rows of the batch that can be saved by the workers. The forms are
+        initialized against a separate cache and nothing is saved. Rows that are managed
+        by an employee with a dependent row in the batch are not independent.
+
+        :param form: The configured import form class
+        :type form: ftp_import.forms.BaseImport
+        :param batch: The line number and parsed data of the rows
+        :type batch: List[Tuple[int, Dict[str, str]]]
+        :return: The indexes of the independent rows in the batch
+        :rtype: Set[int]
+        """
+
+        with self.metrics.phase("map"):
+            return self._plan_batch(form, [row for _, row in batch])
+
+    def _plan_batch(self, form, rows: List[Dict[str, str]]) -> Set[int]:
+        cache = ImportCache(self.fields, False, len(rows), self.config)
+        cache.preload(rows)
+        stored = {
+            v["id"]: v
+            for v in EmployeeImport.objects.filter(
+                pk__in=[pk for pk, obj in cache.maps[EmployeeImport].items() if obj]
+            ).values(*form.INDEPENDENT_VALUES)
+        }
+
+        independent = {}
+        dependent = set()
+        stats = self.metrics.collect()
+        try:
+            for idx, row in enumerate(rows):
+                try:
+                    f = form(
+                        self.fields,
+                        cache=cache,
+                        snapshot=self.config,
+                        pending=self.pending,
+                        **row,
+                    )
+                except Exception:
+                    # raised again when the row is saved
+                    continue
+                if f.employee is None or f.unchanged():
+                    continue
+                if f.independent(stored.get(f.employee_id)):
+                    independent[idx] = stored[f.employee_id]["manager_id"]
+                else:
+                    dependent.add(f.employee_id)
+        finally:
+            self.metrics.restore(stats)
+
+        # a row that is only dependent on its manager doesn't change anything that the
+        # rows it manages read, so this doesn't need to be repeated
+        return {idx for idx, manager in independent.items() if manager not in dependent}
+
+    def add_row(
+        self, form, line: int, row: Dict[str, str], cache: ImportCache = None
+    ) -> None:
+        """
+        Initialize the form with the row data and save it.
+
+        :param form: The configured import form class
+        :type form: ftp_import.forms.BaseImport
+        :param line: The line number of the row in the file, used for error reporting
+        :type line: int
+        :param row: The parsed row data
+        :type row: Dict[str, str]
+        :param cache: The lookup cache when running a bulk import, defaults to None
+        :type cache: ImportCache, optional
+        """
+
+        kwargs = {"snapshot": self.config, "pending": self.pending}
+        if cache is not None:
+            kwargs["cache"] = cache
+        if not parallel.save_row(form, self.fields, line, row, **kwargs):
+            # the objects loaded by the row may hold changes that were rolled back
+            if cache is not None:
+                cache.rollback(int_or_str(row.get(self.id_field)))
+            self.pending.clear()
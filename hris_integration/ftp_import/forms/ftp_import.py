@@ -3,23 +3,30 @@
 
 from cProfile import label
 import datetime
+import hashlib
 import logging
 import re
 
-from typing import Dict, List
+from typing import Any, Dict, List
 from django.utils import timezone
 from distutils.util import strtobool
 from settings.models import WordList
 from employee.models import Employee, EmployeeImport, Phone, Address
 from extras.models import Notification
 from organization.models import JobRole, Location, BusinessUnit
+from django.db import transaction
 from django.db.utils import IntegrityError
 from django.db.models import Q
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from common.functions import get_model_pk_name, PhoneNumber
 
 
 from ftp_import.helpers import config
-from ftp_import.helpers.text_utils import int_or_str, fuzz_name, parse_date
+from ftp_import.helpers.cache import ImportCache
+from ftp_import.helpers.columns import ColumnPlan
+from ftp_import.helpers.diff import ImportDiff
+from ftp_import.helpers.pending import PendingIndex
+from ftp_import.helpers.text_utils import int_or_str, parse_date
 from ftp_import.helpers.stats import Stats
 from ftp_import.exceptions import ConfigurationError
 
@@ -48,23 +55,71 @@ class BaseImport:
        - Employee object is initialized either with the existing object or an empty object
        - The status field from the import is re-mapped to the expected model value
        - If this is a "new" Employee the save attribute is set
+
+      When the import is run in bulk mode an ImportCache is passed in as cache. The
+      lookup method will resolve objects against the cache instead of the database.
+
+      The configuration is read from the ConfigSnapshot of the import run, passed in as
+      snapshot, so self.config(category, item) doesn't query the settings for each row.
+      New employees are matched against the PendingIndex of the import run, passed in as
+      pending.
     """
 
     save_user = True
-
-    def __init__(self, field_config: List[Dict], **kwargs) -> None:
+    #: The stored values of the employee that are passed to independent
+    INDEPENDENT_VALUES = (
+        "id",
+        "state",
+        "leave",
+        "first_name",
+        "username",
+        "email_alias",
+        "manager_id",
+        "manager__state",
+        "manager__is_matched",
+        "manager__employee_id",
+        "employee__state",
+        "employee__leave",
+        "employee__first_name",
+        "employee__username",
+        "employee__email_alias",
+        "employee__manager_id",
+    )
+
+    def __init__(
+        self,
+        field_config: List[Dict],
+        cache: ImportCache = None,
+        snapshot: config.ConfigSnapshot = None,
+        pending: PendingIndex = None,
+        **kwargs,
+    ) -> None:
         """
         The Base initialization module.
 
-        :param field_config: a mapping of kwargs to the target model field
+        :param field_config: a mapping of kwargs to the target model field, compiled to
+            a ColumnPlan if a plain list is provided
         :type field_config: List[Dict]
+        :param cache: the lookup cache for the import run, defaults to None
+        :type cache: ImportCache, optional
+        :param snapshot: the configuration for the import run, loaded if not provided
+        :type snapshot: config.ConfigSnapshot, optional
+        :param pending: the pending employee index for the import run, defaults to None
+        :type pending: PendingIndex, optional
         :param kwargs: a list of kwargs to be parsed into the model
         :raises ValueError: if the employee id field is missing from the kwargs
         """
 
-        self.config = config.Config()
+        self.config = snapshot if snapshot is not None else config.ConfigSnapshot()
+        self.cache = cache
+        self.pending = pending
         self.kwargs = kwargs
+        if not isinstance(field_config, ColumnPlan):
+            field_config = ColumnPlan(field_config)
         self.field_config = field_config
+        self.fingerprint = self.row_fingerprint()
+        self.unresolved = False
+        self.full_refresh = self.config(config.CAT_CSV, config.CSV_FULL_REFRESH)
         self.expand = self.config(config.CAT_CSV, config.CSV_USE_EXP)
         self.import_jobs = self.config(config.CAT_CSV, config.CSV_IMPORT_JOBS)
         self.import_bu = self.config(config.CAT_CSV, config.CSV_IMPORT_BU)
@@ -89,13 +144,19 @@ class BaseImport:
             )
         else:
             self.employee_id = int_or_str(kwargs[employee_id_field])
+            if not isinstance(self.employee_id, int):
+                raise ValueError(f"Invalid employee id '{self.employee_id}'")
 
-        try:
-            self.employee = EmployeeImport.objects.get(id=self.employee_id)
+        self.employee = self.lookup(EmployeeImport, self.employee_id)
+        if self.employee is not None:
+            self.stored_fingerprint = self.employee.row_hash
+            self.stored_status = self.employee.status
             self.new = False
             logger.debug(f"Updating Employee {self.employee}")
-        except EmployeeImport.DoesNotExist:
+        else:
             self.employee = EmployeeImport(id=self.employee_id)
+            self.stored_fingerprint = None
+            self.stored_status = None
             self.new = True
             logger.debug(f"{self.employee_id} is a new Employee")
 
@@ -110,10 +171,9 @@ class BaseImport:
 
     def fuzz_pending(self) -> tuple:
         """
-        Check the employee object against the pending employee table. Returns the closest
-        matching employee pending object.
-
-        Returns
+        Check the employee object against the pending employee index. Returns the closest
+        matching employee pending object. A single match is removed from the index as it
+        will be matched to this employee.
 
         :return: The best matched employee and if there were multiple matches above the threshold.
         :rtype: Tuple[(EmployeePending,None),Multiple]
@@ -122,33 +182,23 @@ class BaseImport:
         fuzz_pcent = self.config(config.CAT_CSV, config.CSV_FUZZ_PCENT)
         logger.debug(f"Fuzz percent: {fuzz_pcent}")
 
-        potentials = []
-        for emp in Employee.objects.filter(is_imported=False):
-            state, pcent = fuzz_name(
-                self.employee.first_name,
-                self.employee.last_name,
-                emp.first_name,
-                emp.last_name,
-                fuzz_pcent,
-            )
-            if state:
-                potentials.append([emp, pcent])
+        if self.pending is None:
+            self.pending = PendingIndex()
 
+        potentials = self.pending.match(
+            self.employee.first_name, self.employee.last_name, fuzz_pcent
+        )
         logger.debug(f"Got {len(potentials)} potential matches. {potentials}")
 
         if len(potentials) == 1:
-            return potentials[0][0], False
+            employee = potentials[0][0]
+            self.pending.remove(employee)
+            # the indexed copy may have stale tree fields
+            employee.refresh_from_db()
+            return employee, False
 
         elif len(potentials) > 1:
-            hmark = 0
-            emp = None
-
-            for opt in potentials:
-                if hmark < opt[1]:
-                    hmark = opt[1]
-                    emp = opt[0]
-
-            return emp, True
+            return potentials[0][0], True
 
         else:
             return None, False
@@ -222,22 +272,94 @@ class BaseImport:
             return data
         logger.debug(f"Attempting to expand {data}")
 
-        words = data.split()
-        exp_list = WordList.objects.all()
+        output = WordList.expand(data)
+        logger.debug(f"Expanded Value is {output}")
+        return output
+
+    @classmethod
+    def can_defer_writes(cls) -> bool:
+        """
+        Whether the EmployeeImport writes of this form can be deferred to a bulk write.
+        Forms that override save or save_post may depend on the row already being
+        saved, so they are always written as the row is processed.
+
+        :return: If the writes can be deferred
+        :rtype: bool
+        """
 
-        output = []
+        return cls.save is BaseImport.save and cls.save_post is BaseImport.save_post
 
-        for word in words:
-            for expansion in exp_list:
-                if word == expansion.src:
-                    word = expansion.replace
-                    logger.debug(f"Replaced {expansion.src} with {word}")
-                    break
+    def lookup(self, model, id: int):
+        """
+        Get an object by primary key from the import cache or the database.
 
-            output.append(word)
+        :param model: The model to retrieve the object from
+        :type model: django.db.models.Model
+        :param id: The primary key of the object
+        :type id: int
+        :return: The object or None if it doesn't exist
+        """
 
-        logger.debug(f"Expanded Value is {' '.join(output)}")
-        return " ".join(output)
+        if self.cache is not None:
+            return self.cache.get(model, id)
+
+        try:
+            if model is EmployeeImport:
+                return model.objects.get(id=id)
+            return model.objects.get(pk=id)
+        except (model.DoesNotExist, ValueError):
+            return None
+
+    @staticmethod
+    def is_valid(obj) -> bool:
+        """Check that a looked up JobRole, Location or BusinessUnit is usable"""
+
+        return obj is not None and not (obj.is_deleted or obj.is_inactive)
+
+    def refresh_tree(self, *objs) -> None:
+        """
+        Reload the tree fields of cached objects before they are saved, a save of an
+        earlier row may have moved them in the tree.
+
+        :param objs: The EmployeeImport or BusinessUnit objects to refresh
+        """
+
+        if self.cache is None:
+            return
+
+        for obj in objs:
+            if obj is not None and not obj._state.adding:
+                self.cache.refresh_tree(obj)
+
+    def _refresh_employee_tree(self) -> None:
+        manager = None
+        if EmployeeImport.manager.is_cached(self.employee):
+            manager = self.employee.manager
+        self.refresh_tree(self.employee, manager)
+
+    @staticmethod
+    def flag_updated(**filters) -> None:
+        """
+        Flag the employees that reference an updated Location, JobRole or BusinessUnit
+        as updated so that the change is included in the next export. The EmployeeImport
+        objects and both their matched and the directly referencing Employee objects are
+        updated with one query per model.
+
+        :param filters: The queryset filter for the referencing employees
+        """
+
+        now = timezone.now()
+        imported = Q(**{f"employeeimport__{k}": v for k, v in filters.items()})
+        with Stats.phase("cascade"):
+            count = EmployeeImport.objects.filter(**filters).update(updated_on=now)
+            count += Employee.objects.filter(Q(**filters) | imported).update(
+                updated_on=now
+            )
+        logger.debug(f"Flagged {count} employees as updated for {filters}")
+
+    def _cache_add(self, obj) -> None:
+        if self.cache is not None and obj is not None:
+            self.cache.add(obj)
 
     @staticmethod
     def location_check(id: int) -> bool:
@@ -293,12 +415,14 @@ class BaseImport:
         loc_desc = self.config(config.CAT_FIELD, config.FIELD_LOC_NAME)
         changed = False
 
-        location, new = Location.objects.get_or_create(id=id)
+        location = self.lookup(Location, id)
+        new = location is None
 
         if new and not self.import_loc:
             logger.debug("Importing new jobs is disabled")
-            location.delete()
             return
+        elif new:
+            location = Location(id=id)
 
         if (
             loc_desc in self.kwargs.keys()
@@ -307,8 +431,11 @@ class BaseImport:
         ):
             location.name = self._expand(int_or_str(self.kwargs[loc_desc]))
             changed = True
+
+        if new or changed:
             try:
-                location.save()
+                with transaction.atomic():
+                    location.save()
                 if new:
                     logger.info(f"Added new location {location}")
             except IntegrityError as e:
@@ -316,18 +443,14 @@ class BaseImport:
                     f"Unable to save '{location.id} - {location.name}' error {e}"
                 )
                 if new:
-                    location.delete()
                     return
 
+            self._cache_add(location)
+
         logger.debug(f"location: {location} - changed {changed}")
 
         if not new and changed:
-            for u in Employee.objects.filter(location=location):
-                u.updated_on = timezone.now()
-                u.save()
-            for u in EmployeeImport.objects.filter(location=location):
-                u.employee.updated_on = timezone.now()
-                u.save()
+            self.flag_updated(location=location)
 
         return location
 
@@ -355,12 +478,14 @@ class BaseImport:
         job_bu = self.config(config.CAT_FIELD, config.FIELD_JD_BU)
         changed = False
 
-        job, new = JobRole.objects.get_or_create(pk=id)
+        job = self.lookup(JobRole, id)
+        new = job is None
 
         if new and not self.import_jobs or not self.import_jobs_all:
             logger.debug("Importing new jobs is disabled")
-            job.delete()
             return
+        elif new:
+            job = JobRole(pk=id)
 
         logger.debug(
             f"Add Jobs Fields - Description '{job_desc}', Business Unit '{job_bu}'"
@@ -381,13 +506,14 @@ class BaseImport:
             job.name = self._expand(int_or_str(self.kwargs[job_desc]))
             changed = True
 
-        if new or (job.business_unit != bu):
+        if new or job.business_unit_id != (bu.pk if bu else None):
             job.business_unit = bu
             changed = True
 
         if changed:
             try:
-                job.save()
+                with transaction.atomic():
+                    job.save()
                 if new:
                     logger.info(f"Added new job: {job}")
                 elif changed:
@@ -395,16 +521,12 @@ class BaseImport:
             except IntegrityError as e:
                 logger.error(f"Unable to save job '{job.id} - {job.name}' error {e}")
                 if new:
-                    job.delete()
                     return
 
+            self._cache_add(job)
+
         if not new and changed:
-            for u in Employee.objects.filter(primary_job=job):
-                u.updated_on = timezone.now()
-                u.save()
-            for u in EmployeeImport.objects.filter(primary_job=job):
-                u.updated_on = timezone.now()
-                u.save()
+            self.flag_updated(primary_job=job)
 
         return job
 
@@ -429,13 +551,15 @@ class BaseImport:
         bu_desc = self.config(config.CAT_FIELD, config.FIELD_BU_NAME)
         bu_parent = self.config(config.CAT_FIELD, config.FIELD_BU_PARENT)
 
-        bu, new = BusinessUnit.objects.get_or_create(pk=id)
+        bu = self.lookup(BusinessUnit, id)
+        new = bu is None
         changed = False
 
         if new and not self.import_bu:
             logger.debug("Importing BU's disabled in configuration")
-            bu.delete()
             return
+        elif new:
+            bu = BusinessUnit(pk=id)
 
         if (
             bu_desc in self.kwargs.keys()
@@ -445,19 +569,20 @@ class BaseImport:
             bu.name = self._expand(self.kwargs[bu_desc])
             changed = True
 
-        if bu_parent in self.kwargs.keys() and self.business_unit_check(
-            int(self.kwargs[bu_parent])
-        ):
-            parent = BusinessUnit.objects.get(pk=int(self.kwargs[bu_parent]))
-            if parent != bu.parent:
+        if bu_parent in self.kwargs.keys():
+            parent = self.lookup(BusinessUnit, int(self.kwargs[bu_parent]))
+            if self.is_valid(parent) and parent.pk != bu.parent_id:
                 bu.parent = parent
                 changed = True
 
         logger.debug(f"Business Unit: {bu}")
 
-        if changed:
+        if new or changed:
             try:
-                bu.save()
+                parent = bu.parent if BusinessUnit.parent.is_cached(bu) else None
+                self.refresh_tree(bu, parent)
+                with transaction.atomic():
+                    bu.save()
                 if new:
                     logger.info(f"Added new business unit {bu}")
             except IntegrityError as e:
@@ -465,17 +590,12 @@ class BaseImport:
                     f"Unable to save business unit '{bu.id} - {bu.name}' error {e}"
                 )
                 if new:
-                    bu.delete()
                     return
 
+            self._cache_add(bu)
+
         if not new and changed:
-            for job in JobRole.objects.filter(bu=bu):
-                for u in Employee.objects.filter(primary_job=job):
-                    u.updated_on = timezone.now()
-                    u.save()
-                for u in EmployeeImport.objects.filter(primary_job=job):
-                    u.updated_on = timezone.now()
-                    u.save()
+            self.flag_updated(primary_job__business_unit=bu)
 
         return bu
 
@@ -494,9 +614,8 @@ class BaseImport:
         ):
             return
 
-        fields = config.CsvSetting()
-        job_id = fields.get_by_map_val("primary_job")
-        loc_id = fields.get_by_map_val("location")
+        job_id = self.get_field_name("primary_job")
+        loc_id = self.get_field_name("location")
 
         if (
             self.import_jobs_all
@@ -504,14 +623,16 @@ class BaseImport:
             and job_id in self.kwargs.keys()
         ):
             try:
-                self.add_job(int_or_str(self.kwargs[job_id]))
+                with transaction.atomic():
+                    self.add_job(int_or_str(self.kwargs[job_id]))
             except Exception as e:
                 logger.debug(f"Caught Error while adding job: {e}")
                 Stats.errors.append(f"Pre-Save (job) - {e}")
 
         if self.import_loc and self.save_user and loc_id in self.kwargs.keys():
             try:
-                self.add_location(int_or_str(self.kwargs[loc_id]))
+                with transaction.atomic():
+                    self.add_location(int_or_str(self.kwargs[loc_id]))
             except Exception as e:
                 logger.debug(f"Caught Error while adding location: {e}")
                 Stats.errors.append(f"Pre-Save (location) - {e}")
@@ -529,16 +650,247 @@ class BaseImport:
 
         pass
 
-    def save(self):
+    def save(self, pre_saved: bool = False):
         """
         This is a wrapper function to call the various save tasks in the correct order.
         If you are extending this method, the call order is save_pre, save_main, save_post
+
+        Matched employees whose row fingerprint is the same as the last import are skipped
+        unless a full refresh is configured.
+
+        :param pre_saved: save_pre has already been run for the row, defaults to False
+        :type pre_saved: bool, optional
         """
 
-        self.save_pre()
+        if self.unchanged():
+            logger.debug(f"Employee {self.employee} is unchanged, skipping")
+            Stats.rows_skipped += 1
+            return
+
+        if self.employee is not None:
+            if self.new:
+                Stats.rows_new += 1
+            else:
+                Stats.rows_changed += 1
+
+        if not pre_saved:
+            self.save_pre()
         self.save_main()
         self.save_post()
 
+        if self.employee is not None and not self.employee._state.adding:
+            self._cache_add(self.employee)
+            self.save_fingerprint()
+
+    def plan(self, diff: ImportDiff) -> None:
+        """
+        Record the changes that save would make in the diff without saving anything.
+        The call order is plan_pre, plan_main the same as save_pre, save_main. Forms that
+        override save_main should override plan_main as well, otherwise the employee is
+        only reported as new, terminated or updated.
+
+        :param diff: The diff of the dry run
+        :type diff: ImportDiff
+        """
+
+        if self.unchanged():
+            diff.unchanged += 1
+            return
+
+        self.plan_pre(diff)
+        self.plan_main(diff)
+
+    def plan_pre(self, diff: ImportDiff) -> None:
+        """Record the jobs, business units and locations that save_pre would change"""
+
+        if not (
+            self.import_jobs_all
+            or self.import_jobs
+            or self.import_bu
+            or self.import_loc
+        ):
+            return
+
+        job_id = self.get_field_name("primary_job")
+        loc_id = self.get_field_name("location")
+        job_desc = self.config(config.CAT_FIELD, config.FIELD_JD_NAME)
+        job_bu = self.config(config.CAT_FIELD, config.FIELD_JD_BU)
+
+        if job_id in self.kwargs.keys() and (
+            self.import_jobs_all or self.import_jobs and self.save_user
+        ):
+            job_id = int_or_str(self.kwargs[job_id])
+            job = self.lookup(JobRole, job_id)
+            # add_job only imports jobs when all jobs are imported
+            if self.import_jobs_all and (job is not None or self.import_jobs):
+                if job_bu in self.kwargs.keys():
+                    self._plan_object(
+                        diff,
+                        BusinessUnit,
+                        int_or_str(self.kwargs[job_bu]),
+                        self.config(config.CAT_FIELD, config.FIELD_BU_NAME),
+                        self.import_bu,
+                    )
+                self._plan_object(diff, JobRole, job_id, job_desc, True)
+
+        if self.import_loc and self.save_user and loc_id in self.kwargs.keys():
+            loc_desc = self.config(config.CAT_FIELD, config.FIELD_LOC_NAME)
+            self._plan_object(
+                diff, Location, int_or_str(self.kwargs[loc_id]), loc_desc, True
+            )
+
+    def _plan_object(
+        self, diff: ImportDiff, model, id: int, desc: str, create: bool
+    ) -> None:
+        if not isinstance(id, int) or diff.is_new(model, id):
+            return
+
+        name = self.kwargs.get(desc)
+        name = self._expand(str(int_or_str(name))) if name else None
+        obj = self.lookup(model, id)
+        if obj is None and create:
+            diff.add_object(model(pk=id), name)
+        elif obj is not None and name and obj.name != name:
+            diff.rename_object(obj, name)
+
+    def plan_main(self, diff: ImportDiff) -> None:
+        """
+        Record the employee as new, terminated or updated. The base form can't tell
+        which fields save_main changes so updates are reported without their changes.
+
+        :param diff: The diff of the dry run
+        :type diff: ImportDiff
+        """
+
+        if not self.save_user or self.employee is None:
+            diff.skipped += 1
+            return
+
+        if self.new:
+            diff.add_new(self.employee_id, {"status": self.employee.status})
+            return
+
+        if self.is_terminated():
+            diff.add_termination(self.employee_id)
+        diff.add_update(self.employee_id, {})
+
+    def is_terminated(self) -> bool:
+        """Check if the row changes the status of the stored employee to terminated"""
+
+        return (
+            not self.new
+            and self.stored_status != EmployeeImport.STATE_TERM
+            and self.employee.status == EmployeeImport.STATE_TERM
+        )
+
+    def save_fingerprint(self) -> None:
+        """
+        Store the fingerprint of the row for the employee. Rows that reference a manager,
+        job or location that doesn't exist yet are stored without a fingerprint so that
+        they are processed again on the next import.
+        """
+
+        fingerprint = None if self.unresolved else self.fingerprint
+        self.employee.row_hash = fingerprint
+        if fingerprint == self.stored_fingerprint:
+            return
+        if self.cache is not None and self.cache.is_deferred(self.employee):
+            # written with the rest of the deferred changes
+            return
+
+        EmployeeImport.objects.filter(pk=self.employee.pk).update(row_hash=fingerprint)
+        self.stored_fingerprint = fingerprint
+
+    def row_fingerprint(self) -> str:
+        """
+        Calculate the fingerprint of the source row. The hash covers the form, the
+        imported fields, their mapping and the row values so a change to any of them
+        will cause the row to be re-processed.
+
+        :return: The sha256 hex digest of the row
+        :rtype: str
+        """
+
+        fingerprint = hashlib.sha256(
+            f"{self.__class__.__module__}.{self.__class__.__name__}".encode("utf-8")
+        )
+        for key in self.field_config.names:
+            if key in self.kwargs:
+                map_to = self.field_config.map_to(key)
+                row = f"{key}\x1f{map_to}\x1f{self.kwargs[key]}\x1e"
+                fingerprint.update(row.encode("utf-8"))
+
+        return fingerprint.hexdigest()
+
+    def unchanged(self) -> bool:
+        """
+        Check if the row is the same as the last time that it was imported.
+
+        :return: True if the row can be skipped
+        :rtype: bool
+        """
+
+        return (
+            not self.full_refresh
+            and not self.new
+            and self.employee is not None
+            and self.employee.is_matched
+            and self.stored_fingerprint == self.fingerprint
+            and self.references_current()
+        )
+
+    def references_current(self) -> bool:
+        """
+        Check that the manager, jobs and location that the row references are still the
+        ones stored for the employee. A manager that was terminated, or a job or location
+        that was deleted since the last import changes the employee without changing the
+        row.
+
+        :return: True if the stored references still match the row
+        :rtype: bool
+        """
+
+        value = self.kwargs.get(self.get_field_name("manager"))
+        if value:
+            manager = self.lookup(EmployeeImport, int_or_str(value))
+            if manager is None:
+                return False
+            expected = manager.pk if manager.state else None
+            if self.employee.manager_id != expected:
+                return False
+
+        for key, model in (("primary_job", JobRole), ("location", Location)):
+            value = self.kwargs.get(self.get_field_name(key))
+            if value:
+                obj = self.lookup(model, int_or_str(value))
+                if (
+                    not self.is_valid(obj)
+                    or getattr(self.employee, f"{key}_id") != obj.pk
+                ):
+                    return False
+
+        for key in ("jobs", "secondary_jobs"):
+            value = self.kwargs.get(self.get_field_name(key))
+            for job in re.findall(r"(\d+)(?:,\s*(\d+))*", value or ""):
+                if job[0] and not self.is_valid(self.lookup(JobRole, int(job[0]))):
+                    return False
+
+        return True
+
+    def independent(self, stored: Dict[str, Any]) -> bool:
+        """
+        Check if the row can be saved by an import worker, in any order relative to the
+        other rows of the batch. The base form can't tell what save_main changes so rows
+        are never independent.
+
+        :param stored: The stored values of the employee, see INDEPENDENT_VALUES
+        :type stored: Dict[str, Any]
+        :return: If the row can be saved in parallel
+        :rtype: bool
+        """
+
+        return False
+
     def get_map_to(self, key: str) -> str:
         """
         Get the map value based on the field value
@@ -550,11 +902,7 @@ class BaseImport:
             str: the map to field or an empty string
         """
 
-        for field in self.field_config:
-            if field["field"] == key:
-                return field["map_to"]
-
-        return ""
+        return self.field_config.map_to(key)
 
     def get_field_name(self, key: str) -> str:
         """
@@ -567,11 +915,7 @@ class BaseImport:
             str: the field name or an empty string
         """
 
-        for field in self.field_config:
-            if field["map_to"] == key:
-                return field["field"]
-
-        return ""
+        return self.field_config.field_name(key)
 
 
 class EmployeeForm(BaseImport):
@@ -582,6 +926,171 @@ class EmployeeForm(BaseImport):
     for full details on writing your own import class.
     """
 
+    def independent(self, stored: Dict[str, Any]) -> bool:
+        """
+        Check if the row can be saved by an import worker. The row must be an update of a
+        matched employee that doesn't move either employee tree, doesn't change the status
+        or a generated name, and only references objects that already exist. The
+        EmployeeImport and Employee saves for such a row only change the row itself.
+
+        :param stored: The stored values of the employee, see INDEPENDENT_VALUES
+        :type stored: Dict[str, Any]
+        :return: If the row can be saved in parallel
+        :rtype: bool
+        """
+
+        employee = self.employee
+        if (
+            stored is None
+            or self.new
+            or employee is None
+            or not employee.is_matched
+            or employee.employee_id is None
+            or self.unchanged()
+        ):
+            return False
+
+        status = (employee.state, employee.leave)
+        if status != (stored["state"], stored["leave"]) or status != (
+            stored["employee__state"],
+            stored["employee__leave"],
+        ):
+            return False
+
+        # first_name orders the tree, username and email_alias are unique
+        for key in ("first_name", "username", "email_alias"):
+            value = self.kwargs.get(self.get_field_name(key))
+            if stored[f"employee__{key}"] is None or (value and value != stored[key]):
+                return False
+
+        value = self.kwargs.get(self.get_field_name("manager"))
+        if value and int_or_str(value) != stored["manager_id"]:
+            return False
+        if stored["manager_id"] is not None and (
+            not stored["manager__state"]
+            or stored["manager__is_matched"]
+            and stored["employee__manager_id"] != stored["manager__employee_id"]
+        ):
+            return False
+
+        for key, model in (("primary_job", JobRole), ("location", Location)):
+            value = self.kwargs.get(self.get_field_name(key))
+            if value and not self.is_valid(self.lookup(model, int_or_str(value))):
+                return False
+
+        for key in ("jobs", "secondary_jobs"):
+            value = self.kwargs.get(self.get_field_name(key))
+            for job in re.findall(r"(\d+)(?:,\s*(\d+))*", value or ""):
+                if job[0] and not self.is_valid(self.lookup(JobRole, int(job[0]))):
+                    return False
+
+        return True
+
+    def plan_main(self, diff: ImportDiff) -> None:
+        """
+        Record the employee as new with its imported values, or the fields that
+        save_employee would change for an existing employee. New and unmatched
+        employees are matched against the pending employees.
+
+        :param diff: The diff of the dry run
+        :type diff: ImportDiff
+        """
+
+        if not self.save_user or self.employee is None:
+            diff.skipped += 1
+            return
+
+        if self.new:
+            values = {"status": self.employee.status}
+            for key, value in self.kwargs.items():
+                map_val = self.get_map_to(key)
+                if value and map_val != "id" and hasattr(self.employee, map_val):
+                    values[map_val] = value
+            diff.add_new(self.employee_id, values)
+        else:
+            changes = self.changed_fields(diff)
+            if self.stored_status != self.employee.status:
+                changes["status"] = (self.stored_status, self.employee.status)
+            if self.is_terminated():
+                diff.add_termination(self.employee_id)
+            diff.add_update(self.employee_id, changes)
+
+        if self.new or not self.employee.is_matched:
+            first_name = self.kwargs.get(self.get_field_name("first_name"))
+            last_name = self.kwargs.get(self.get_field_name("last_name"))
+            if self.pending is None:
+                self.pending = PendingIndex()
+            matches = self.pending.match(
+                first_name or self.employee.first_name,
+                last_name or self.employee.last_name,
+                self.config(config.CAT_CSV, config.CSV_FUZZ_PCENT),
+            )
+            if len(matches) == 1:
+                # a later row can't be matched to the same employee
+                self.pending.remove(matches[0][0])
+            diff.add_matches(self.employee_id, matches)
+
+    def changed_fields(self, diff: ImportDiff) -> Dict[str, tuple]:
+        """
+        Compare the row to the stored employee the same way save_employee does.
+
+        :param diff: The diff of the dry run, for the objects created by earlier rows
+        :type diff: ImportDiff
+        :return: The stored and imported value keyed by the changed model field
+        :rtype: Dict[str, tuple]
+        """
+
+        changes = {}
+        for key, value in self.kwargs.items():
+            map_val = self.get_map_to(key)
+            if not value or map_val == "id" or not hasattr(self.employee, map_val):
+                continue
+
+            if map_val in ("manager", "primary_job", "location"):
+                model = {
+                    "manager": EmployeeImport,
+                    "primary_job": JobRole,
+                    "location": Location,
+                }[map_val]
+                current = getattr(self.employee, f"{map_val}_id")
+                value = int_or_str(value)
+                obj = self.lookup(model, value)
+                if diff.is_new(model, value):
+                    pass
+                elif model is EmployeeImport and (obj is None or not obj.state):
+                    # unknown and terminated managers are removed
+                    value = None
+                elif model is not EmployeeImport and not self.is_valid(obj):
+                    continue
+
+            elif map_val in ("jobs", "secondary_jobs"):
+                current = set(self.employee.jobs.values_list("id", flat=True))
+                jobs = re.findall(r"(\d+)(?:,\s*(\d+))*", value)
+                value = current | {int(job[0]) for job in jobs if job[0]}
+                current, value = sorted(current), sorted(value)
+
+            else:
+                current = getattr(self.employee, map_val)
+                if isinstance(current, (datetime.datetime, datetime.date)):
+                    try:
+                        value = parse_date(
+                            value, self.config(config.CAT_CSV, config.CSV_DATE_FMT)
+                        )
+                    except ValueError as e:
+                        diff.errors.append(f"Employee {self.employee_id} - {e}")
+                        continue
+                try:
+                    field = EmployeeImport._meta.get_field(map_val)
+                    # compare the value that would be stored, not the parsed value
+                    value = field.to_python(value)
+                except (FieldDoesNotExist, ValidationError):
+                    pass
+
+            if current != value:
+                changes[map_val] = (current, value)
+
+        return changes
+
     def save_employee(self) -> None:
         """The main save logic for an already existing employee"""
 
@@ -589,58 +1098,60 @@ class EmployeeForm(BaseImport):
 
         for key, value in self.kwargs.items():
             map_val = self.get_map_to(key)
-            if hasattr(self.employee, map_val):
+            # the id is set when the employee is initialized
+            if map_val != "id" and hasattr(self.employee, map_val):
                 # logger.debug(f"setting {map_val}")
                 if not value:
                     logger.debug(f"value is empty for {key} - {value}")
                     pass
                 elif map_val == "manager":
-                    try:
-                        manager = EmployeeImport.objects.get(pk=int_or_str(value))
-                        if self.employee.manager != manager and manager.state:
-                            self.employee.manager = manager
-                            changed = True
-                        elif manager.state == False and self.employee.manager != None:
-                            self.employee.manager = None
-                            changed = True
-                    except EmployeeImport.DoesNotExist:
+                    manager = self.lookup(EmployeeImport, int_or_str(value))
+                    if manager is None:
                         logger.warning(f"Manager {value} doesn't exist yet")
-                        if self.employee.manager:
-                            self.employee.manager = None
-                            changed = True
-                    except ValueError:
-                        if self.employee.manager:
+                        self.unresolved = True
+                        if self.employee.manager_id is not None:
                             self.employee.manager = None
                             changed = True
+                    elif self.employee.manager_id != manager.pk and manager.state:
+                        self.employee.manager = manager
+                        changed = True
+                    elif manager.state == False and self.employee.manager_id != None:
+                        self.employee.manager = None
+                        changed = True
 
                 elif map_val == "primary_job":
-                    if self.jobs_check(int_or_str(value)):
-                        primary_job = JobRole.objects.get(pk=int_or_str(value))
-                        if self.employee.primary_job != primary_job:
+                    primary_job = self.lookup(JobRole, int_or_str(value))
+                    if self.is_valid(primary_job):
+                        if self.employee.primary_job_id != primary_job.pk:
                             self.employee.primary_job = primary_job
                             changed = True
                     else:
                         logger.warning(f"Job {value} doesn't exist yet")
+                        self.unresolved = True
 
                 elif map_val == "location":
-                    if self.location_check(int_or_str(value)):
-                        location = Location.objects.get(pk=int_or_str(value))
-                        if self.employee.location != location:
+                    location = self.lookup(Location, int_or_str(value))
+                    if self.is_valid(location):
+                        if self.employee.location_id != location.pk:
                             self.employee.location = location
                             changed = True
+                    else:
+                        self.unresolved = True
 
                 elif map_val in ["jobs", "secondary_jobs"]:
                     jobs_re = re.compile(r"(\d+)(?:,\s*(\d+))*")
                     jobs = re.findall(jobs_re, value)
+                    current_jobs = set(self.employee.jobs.values_list("id", flat=True))
                     for job in jobs:
                         if job[0]:
-                            try:
-                                self.employee.jobs.add(
-                                    JobRole.objects.get(id=int(job[0]))
-                                )
-                            except (ValueError, JobRole.DoesNotExist):
+                            secondary_job = self.lookup(JobRole, int(job[0]))
+                            if secondary_job is None:
                                 logger.warning(f"Job {job[0]} doesn't exist yet")
+                                self.unresolved = True
                                 Stats.warnings.append(f"Job {job[0]} doesn't exist yet")
+                            elif secondary_job.pk not in current_jobs:
+                                self.employee.jobs.add(secondary_job)
+                                changed = True
                 else:
                     if hasattr(self.employee, map_val):
                         if isinstance(
@@ -648,7 +1159,10 @@ class EmployeeForm(BaseImport):
                             (datetime.datetime, datetime.date),
                         ):
                             try:
-                                value = parse_date(value)
+                                value = parse_date(
+                                    value,
+                                    self.config(config.CAT_CSV, config.CSV_DATE_FMT),
+                                )
                             except ValueError as e:
                                 logger.error(
                                     f"Failed to parse date time value for {key} - {str(e)}"
@@ -678,8 +1192,11 @@ class EmployeeForm(BaseImport):
             else:
                 logger.info(f"Employee {self.employee} has multiple matches")
 
-        if changed:
+        if changed and self.cache is not None and self.cache.defer(self.employee):
+            logger.debug(f"Employee {self.employee} changed, deferring save")
+        elif changed:
             logger.debug(f"Employee {self.employee} changed, saving")
+            self._refresh_employee_tree()
             self.employee.save()
         else:
             logger.debug(f"Employee {self.employee} unchanged")
@@ -696,33 +1213,40 @@ class EmployeeForm(BaseImport):
           an unmatched state, to be manually matched.
         """
 
+        # jobs can only be added once the employee has been saved
+        secondary_jobs = []
+
         for key, value in self.kwargs.items():
             map_val = self.get_map_to(key)
-            if hasattr(self.employee, map_val):
+            # the id is set when the employee is initialized
+            if map_val != "id" and hasattr(self.employee, map_val):
                 if value == "" or value == "''":
                     value = None
                 if map_val == "manager" and value:
                     try:
-                        self.employee.manager = EmployeeImport.objects.get(
-                            id=int(value)
-                        )
-                    except (Employee.DoesNotExist, ValueError):
+                        manager = self.lookup(EmployeeImport, int(value))
+                        if manager is None:
+                            raise ValueError(f"Manager {value} doesn't exist")
+                        self.employee.manager = manager
+                    except ValueError:
                         logger.warning(f"Manager {value} doesn't exist yet")
+                        self.unresolved = True
                         Stats.warnings.append(f"Manager {value} doesn't exist yet")
                     except Exception as e:
                         logger.debug(e)
 
                 elif map_val == "primary_job" and value:
                     try:
-                        if self.jobs_check(int(value)):
-                            self.employee.primary_job = JobRole.objects.get(
-                                id=int(value)
-                            )
+                        primary_job = self.lookup(JobRole, int(value))
+                        if self.is_valid(primary_job):
+                            self.employee.primary_job = primary_job
                         else:
                             logger.warning(f"Job {value} doesn't exist yet")
+                            self.unresolved = True
                             Stats.warnings.append(f"Job {value} doesn't exist yet")
                     except ValueError:
                         logger.warning(f"Job {value} doesn't exist yet")
+                        self.unresolved = True
                         Stats.warnings.append(f"Job {value} doesn't exist yet")
                     except IntegrityError:
                         Stats.warnings.append(
@@ -730,12 +1254,14 @@ class EmployeeForm(BaseImport):
                         )
                 elif map_val == "location" and value:
                     try:
-                        if self.location_check(int_or_str(value)):
-                            self.employee.location = Location.objects.get(
-                                id=int_or_str(value)
-                            )
+                        location = self.lookup(Location, int_or_str(value))
+                        if self.is_valid(location):
+                            self.employee.location = location
+                        else:
+                            self.unresolved = True
                     except ValueError:
                         logger.warning(f"Location {value} doesn't exist yet")
+                        self.unresolved = True
                         Stats.warnings.append(f"Location {value} doesn't exist yet")
                     except IntegrityError:
                         Stats.warnings.append(
@@ -747,23 +1273,23 @@ class EmployeeForm(BaseImport):
                     for job in jobs:
                         if job[0]:
                             try:
-                                self.employee.jobs.add(
-                                    JobRole.objects.get(id=int(job[0]))
-                                )
+                                secondary_job = self.lookup(JobRole, int(job[0]))
+                                if secondary_job is None:
+                                    raise JobRole.DoesNotExist
+                                secondary_jobs.append(secondary_job)
                             except (ValueError, JobRole.DoesNotExist):
                                 logger.warning(f"Job {job[0]} doesn't exist yet")
+                                self.unresolved = True
                                 Stats.warnings.append(f"Job {job[0]} doesn't exist yet")
-                            except IntegrityError:
-                                Stats.warnings.append(
-                                    f"Caught IntegrityError while adding job '{job[0]}' for {self.employee}"
-                                )
                 else:
                     if hasattr(self.employee, map_val) and value:
                         if isinstance(
                             getattr(self.employee, map_val),
                             (datetime.datetime, datetime.date),
                         ):
-                            value = parse_date(value)
+                            value = parse_date(
+                                value, self.config(config.CAT_CSV, config.CSV_DATE_FMT)
+                            )
                     try:
                         setattr(self.employee, map_val, value)
                     except IntegrityError:
@@ -791,7 +1317,9 @@ class EmployeeForm(BaseImport):
             self.employee.employee = mutable_employee
             self.employee.is_matched = True
             try:
-                self.employee.save()
+                self._refresh_employee_tree()
+                with transaction.atomic():
+                    self.employee.save()
                 Stats.new_users.append(str(self.employee))
             except IntegrityError as e:
                 Stats.errors.append(
@@ -800,6 +1328,7 @@ class EmployeeForm(BaseImport):
                 logger.exception(e)
                 if mutable_employee:
                     mutable_employee.delete()
+                return
 
         else:
             logger.debug(
@@ -808,9 +1337,23 @@ class EmployeeForm(BaseImport):
             Stats.pending_users.append(str(self.employee))
             self.employee.is_matched = False
             try:
-                self.employee.save()
+                self._refresh_employee_tree()
+                with transaction.atomic():
+                    self.employee.save()
             except IntegrityError:
                 logger.error(f"Failed to save {self.employee}")
+                return
+
+        if secondary_jobs:
+            try:
+                with transaction.atomic():
+                    self.employee.jobs.add(*secondary_jobs)
+                    if self.employee.is_matched:
+                        self.employee.employee.jobs.add(*secondary_jobs)
+            except IntegrityError:
+                Stats.warnings.append(
+                    f"Caught IntegrityError while adding jobs for {self.employee}"
+                )
 
     def _get_phone(self, label: str = None) -> Phone:
         """
@@ -966,14 +1509,16 @@ class EmployeeForm(BaseImport):
             if self.employee.is_matched and self.employee.employee:
                 try:
                     logger.debug("save_address")
-                    self.save_address()
+                    with transaction.atomic():
+                        self.save_address()
                 except IntegrityError as e:
                     logger.exception(
                         f"Failed to save employee address for {self.employee.id}"
                     )
                 try:
                     logger.debug("save_phone")
-                    self.save_phone()
+                    with transaction.atomic():
+                        self.save_phone()
                 except IntegrityError as e:
                     logger.exception(
                         f"Failed to save employee phone for {self.employee.id}"
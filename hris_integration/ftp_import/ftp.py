@@ -1,26 +1,62 @@
 # Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import hashlib
 import logging
 import paramiko
 import re
-import time
+import shutil
+import threading
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from django import conf
+from pathlib import Path
 from tempfile import TemporaryFile
+from typing import List, Tuple
 from smtp_client.smtp import Smtp
 from smtp_client import SmtpToInvalid, SmtpServerError, ConfigError
 
 from .helpers import config
-from .helpers.stats import Stats
+from .helpers.stats import Metrics
 from .helpers.text_utils import int_or_str
 from .exceptions import ConfigurationError, SFTPIOError
-from .models import FileTrack
+from .models import FileTrack, ImportRun
 from .csv import CsvImport
 
 logger = logging.getLogger("ftp.FTPClient")
 
 
+class LocalSFTP:
+    """
+    A stand-in for paramiko.SFTPClient that serves the files in a local directory. Pass
+    it to FTPClient to run the import without a server, remote paths are resolved
+    relative to the root directory.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+
+    def _path(self, path: str) -> Path:
+        return self.root / path.lstrip("/")
+
+    def listdir(self, path: str = ".") -> List[str]:
+        """List the names of the files in the directory"""
+
+        return sorted(p.name for p in self._path(path).iterdir() if p.is_file())
+
+    def getfo(self, remotepath: str, fl, callback=None) -> int:
+        """Copy the file to an open file object"""
+
+        with open(self._path(remotepath), "rb") as src:
+            shutil.copyfileobj(src, fl)
+            return src.tell()
+
+    def close(self) -> None:
+        pass
+
+
 class FTPClient:
     """
     FTP client interface. Initializing the class will setup the connection and start the
@@ -29,10 +65,14 @@ class FTPClient:
     Currently this module only implements FTP Support
     """
 
-    def __init__(self) -> None:
+    def __init__(self, sftp=None) -> None:
         """
         Initializing the class will setup and start the connection to the configured server.
 
+        Args:
+            sftp (LocalSFTP, optional): an already connected client to use instead of
+                connecting to the configured server.
+
         Raises:
             ConfigurationError: configured protocol is not supported.
         """
@@ -44,7 +84,11 @@ class FTPClient:
         file_expr = config.get_config(config.CAT_SERVER, config.SERVER_FILE_EXP)
         protocol = config.get_config(config.CAT_SERVER, config.SERVER_PROTOCOL)
         self.__password = config.get_config(config.CAT_SERVER, config.SERVER_PASSWORD)
-        Stats.time_start = time.time()
+        self.downloads = config.get_config(config.CAT_SERVER, config.SERVER_DOWNLOADS)
+        self.sock = None
+        self._sessions = []
+        self._local = threading.local()
+        self.metrics = None
 
         self.file_expr = re.compile(file_expr)
         self.basepath = ""
@@ -63,7 +107,9 @@ class FTPClient:
         except ValueError:
             self.port = 22
 
-        if protocol.lower() != "sftp":
+        if sftp is not None:
+            self.sftp = sftp
+        elif protocol.lower() != "sftp":
             logger.fatal(f"unsupported protocol specified {protocol}")
             raise ConfigurationError("currently only SFTP is supported")
 
@@ -111,8 +157,10 @@ class FTPClient:
         """Close the server connection and client socket"""
 
         logger.info("Closing the connection to the server")
+        self.close_sessions()
         self.sftp.close()
-        self.sock.close()
+        if self.sock is not None:
+            self.sock.close()
 
     def __del__(self):
         """Call the close method prior to deleting"""
@@ -120,41 +168,151 @@ class FTPClient:
         del self.user
         self.close()
 
+    def session(self):
+        """
+        Get the sftp session of the current thread. Each download thread opens its own
+        session on the shared transport as an SFTPClient can't be used concurrently.
+        """
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            if self.sock is None:
+                session = self.sftp
+            else:
+                session = paramiko.SFTPClient.from_transport(self.sock)
+                self._sessions.append(session)
+            self._local.session = session
+        return session
+
+    def close_sessions(self):
+        """Close the sessions opened by the download threads"""
+
+        while self._sessions:
+            self._sessions.pop().close()
+
+    def download(self, name: str) -> Tuple[TemporaryFile, str]:
+        """
+        Download a file to a temporary file.
+
+        Args:
+            name (str): The name of the file in the base path
+
+        Returns:
+            Tuple[TemporaryFile, str]: The open temporary file positioned at the start of
+                the file and the sha256 hash of its content
+        """
+
+        fh = TemporaryFile()
+        content_hash = hashlib.sha256()
+        try:
+            self.session().getfo(self.basepath + name, fh)
+            fh.seek(0)
+            for chunk in iter(lambda: fh.read(65536), b""):
+                content_hash.update(chunk)
+        except BaseException:
+            fh.close()
+            raise
+        fh.seek(0)
+        logger.debug(f"Downloaded {name}")
+        return fh, content_hash.hexdigest()
+
+    def new_files(self) -> List[str]:
+        """
+        Get the files in the base path that match the file expression and have not been
+        completely imported yet, in the order that they are listed by the server.
+
+        Returns:
+            List[str]: The file names
+        """
+
+        files = [
+            f for f in self.sftp.listdir(self.basepath) if self.file_expr.search(f)
+        ]
+        imported = set(
+            FileTrack.objects.filter(
+                name__in=files, status=FileTrack.STATUS_COMPLETE
+            ).values_list("name", flat=True)
+        )
+        logger.debug(f"Found {len(files)} matching files, {len(imported)} imported")
+        return [f for f in files if f not in imported]
+
     def run_import(self):
-        """Get all new files based on the configuration and imports them"""
+        """
+        Get all new files based on the configuration and imports them. The files are
+        imported one at a time in the order that they are listed, while the following
+        files are downloaded in the background. A file whose import was interrupted is
+        resumed from its last checkpoint.
+
+        The metrics of each file are recorded as an ImportRun, the metrics of the whole
+        run are kept in self.metrics for the summary.
+        """
 
         logger.warning("Starting ftp import cycle")
-        path = self.sftp.listdir(self.basepath)
-
-        for f in path:
-            logger.debug(f"Got file {f} for checking")
-            m = re.search(self.file_expr, f)
-            if m and not FileTrack.objects.filter(name=f).exists():
-                logger.debug(f"Importing {f}")
-                Stats.files.append(f)
-
-                with TemporaryFile() as fh:
-                    self.sftp.getfo(self.basepath + f, fh)
-                    fh.seek(0)
-                    logger.debug(f"header row of file should be {fh.readline(80)}")
-                    CsvImport(fh)
-                ft = FileTrack()
-                ft.name = f
-                ft.save()
-                del ft
+        self.metrics = Metrics()
+        with self.metrics.activate():
+            self.import_files()
+        self.metrics.finish()
 
         logger.info(f"Finished running import.")
-        Stats.time_end = time.time()
-        logger.info(str(Stats()))
-        if Stats.errors:
-            logger.error("Errors:\n\t" + "\n\t".join(Stats.errors))
+        logger.info(str(self.metrics))
+        if self.metrics.errors:
+            logger.error("Errors:\n\t" + "\n\t".join(self.metrics.errors))
+
+        with self.metrics.activate(), self.metrics.phase("notify"):
+            self.notify()
+
+    def import_files(self):
+        """Download and import the new files"""
+
+        files = iter(self.new_files())
+        pending = deque()
+
+        with ThreadPoolExecutor(self.downloads) as pool:
+            try:
+                for f in islice(files, self.downloads):
+                    pending.append((f, pool.submit(self.download, f)))
+
+                while pending:
+                    f, download = pending.popleft()
+                    n = next(files, None)
+                    if n is not None:
+                        pending.append((n, pool.submit(self.download, n)))
+
+                    logger.debug(f"Importing {f}")
+                    self.metrics.files.append(f)
+                    with self.metrics.phase("download"):
+                        fh, content_hash = download.result()
+                    # the run is recorded even if the import of the file fails
+                    metrics = Metrics()
+                    try:
+                        with fh:
+                            logger.debug(
+                                f"header row of file should be {fh.readline(80)}"
+                            )
+                            track = FileTrack.start(f, content_hash)
+                            CsvImport(fh, track, metrics=metrics)
+                        track.complete()
+                    finally:
+                        ImportRun.record(f, metrics)
+            finally:
+                for _, download in pending:
+                    if not download.cancel() and download.exception() is None:
+                        download.result()[0].close()
+        self.close_sessions()
+
+    def notify(self):
+        """Send the summary of the run to the configured notification addresses"""
 
         try:
-            to = config.get_config(config.CAT_CSV, config.CSV_FAIL_NOTIF).split(",")
+            to = config.get_config(config.CAT_CSV, config.CSV_FAIL_NOTIF) or ""
+            to = [t.strip() for t in to.split(",") if t.strip()]
             if to:
                 s = Smtp()
                 msg = s.mime_build(
-                    Stats().as_text, Stats().as_html, subject="FTP Import Job", to=to
+                    self.metrics.as_text,
+                    self.metrics.as_html,
+                    subject="FTP Import Job",
+                    to=to,
                 )
                 s.send_html(to, msg)
         except SmtpToInvalid as e:
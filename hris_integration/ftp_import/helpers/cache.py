@@ -0,0 +1,420 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+import re
+
+from typing import Any, Dict, List, Tuple
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from employee import usernames
+from employee.models import Employee, EmployeeImport
+from employee.models.employee import UPDATE_FIELDS_ALWAYS, UPDATE_FIELDS_OPTIONAL
+from organization.models import JobRole, Location, BusinessUnit
+
+from . import config
+from .text_utils import int_or_str
+
+logger = logging.getLogger("ftp_import.ImportCache")
+
+#: Changes to these fields need the model signals to be handled correctly, so employees
+#: with changes to any of them are never deferred.
+SIGNAL_FIELDS = ("manager", "employee", "state", "leave", "username", "email_alias")
+#: Fields of the EmployeeImport object that are kept from the preloaded state
+TRACKED_FIELDS = SIGNAL_FIELDS + tuple(
+    f for f in UPDATE_FIELDS_ALWAYS + UPDATE_FIELDS_OPTIONAL if f not in SIGNAL_FIELDS
+)
+
+JOBS_RE = re.compile(r"(\d+)(?:,\s*(\d+))*")
+
+
+def _attname(model: "django.db.models.Model", field: str) -> str:
+    return model._meta.get_field(field).attname
+
+
+def _tree_fields(model: "django.db.models.Model") -> List[str]:
+    mptt = model._mptt_meta
+    return [mptt.left_attr, mptt.right_attr, mptt.tree_id_attr, mptt.level_attr]
+
+
+class ImportCache:
+    """
+    Per-run lookup maps for the objects referenced by the rows of an import file.
+
+    Every EmployeeImport, JobRole, Location and BusinessUnit referenced by a batch of
+    rows is loaded with a single query per model by calling preload. The import forms
+    then resolve their references against the maps instead of querying the database
+    for each row. Objects that are created or updated by the forms are registered back
+    with add so that later rows see them.
+
+    Saving an EmployeeImport, Employee or BusinessUnit can move other nodes of the same
+    tree, so the tree fields of the cached objects need to be reloaded with refresh_tree
+    before they are saved.
+
+    When writes can be deferred, matched employees whose update does not require the
+    EmployeeImport pre_save signal (no manager, status, username or match changes) are
+    queued with defer and written with bulk_update when flush is called. Everything else
+    is still saved by the form as it is processed.
+    """
+
+    def __init__(
+        self,
+        field_config: List[Dict],
+        defer_writes: bool = False,
+        batch_size: int = 500,
+        snapshot: config.ConfigSnapshot = None,
+    ) -> None:
+        """
+        Setup the cache for an import run.
+
+        :param field_config: The field configuration of the file being imported
+        :type field_config: List[Dict]
+        :param defer_writes: Queue eligible EmployeeImport writes for bulk_update,
+            defaults to False
+        :type defer_writes: bool, optional
+        :param batch_size: The batch size used for the bulk writes, defaults to 500
+        :type batch_size: int, optional
+        :param snapshot: The configuration of the import run, loaded if not provided
+        :type snapshot: config.ConfigSnapshot, optional
+        """
+
+        self.defer_writes = defer_writes
+        self.batch_size = batch_size
+        self.maps: Dict[Any, Dict[int, Any]] = {
+            EmployeeImport: {},
+            JobRole: {},
+            Location: {},
+            BusinessUnit: {},
+        }
+        self._original: Dict[int, Dict[str, Any]] = {}
+        self._deferred: Dict[int, EmployeeImport] = {}
+
+        self.map_to = {}
+        for field in field_config:
+            if field and field.get("import"):
+                self.map_to[field["field"]] = field["map_to"]
+
+        conf = snapshot if snapshot is not None else config.ConfigSnapshot()
+        self.bu_fields = [
+            f
+            for f in (
+                conf(config.CAT_FIELD, config.FIELD_JD_BU),
+                conf(config.CAT_FIELD, config.FIELD_BU_PARENT),
+            )
+            if f
+        ]
+
+    def _queryset(self, model):
+        if model is EmployeeImport:
+            return EmployeeImport.objects.select_related("employee")
+        return model.objects
+
+    def _snapshot(self, employee: EmployeeImport) -> None:
+        self._original[employee.pk] = {
+            f: getattr(employee, _attname(EmployeeImport, f)) for f in TRACKED_FIELDS
+        }
+
+    def preload(self, rows: List[Dict]) -> None:
+        """
+        Load all of the objects referenced by the rows that are not already cached.
+
+        :param rows: The parsed rows of the import file
+        :type rows: List[Dict]
+        """
+
+        ids = {model: set() for model in self.maps}
+
+        def add(model, value):
+            value = int_or_str(value) if value else None
+            if isinstance(value, int) and value not in self.maps[model]:
+                ids[model].add(value)
+
+        for row in rows:
+            for key, value in row.items():
+                map_to = self.map_to.get(key)
+                if map_to in ("id", "manager"):
+                    add(EmployeeImport, value)
+                elif map_to == "primary_job":
+                    add(JobRole, value)
+                elif map_to == "location":
+                    add(Location, value)
+                elif map_to in ("jobs", "secondary_jobs") and value:
+                    for job in re.findall(JOBS_RE, value):
+                        add(JobRole, job[0])
+                if key in self.bu_fields:
+                    add(BusinessUnit, value)
+
+        for model, pks in ids.items():
+            if not pks:
+                continue
+            found = self._queryset(model).in_bulk(list(pks))
+            logger.debug(f"Preloaded {len(found)} of {len(pks)} {model.__name__}")
+            for pk in pks:
+                self.maps[model][pk] = found.get(pk)
+                if model is EmployeeImport and pk in found:
+                    self._snapshot(found[pk])
+
+        allocator = usernames.active()
+        if allocator is not None:
+            allocator.preload(self._new_names(rows))
+
+    def _new_names(self, rows: List[Dict]) -> List[Tuple[str, str]]:
+        """The first and last names of the rows of employees that don't exist yet"""
+
+        keys = {}
+        for key, map_to in self.map_to.items():
+            if map_to in ("id", "first_name", "last_name"):
+                keys[map_to] = key
+        if len(keys) < 3:
+            return []
+
+        names = []
+        for row in rows:
+            id = int_or_str(row.get(keys["id"]) or "")
+            if isinstance(id, int) and self.maps[EmployeeImport].get(id) is None:
+                names.append((row.get(keys["first_name"]), row.get(keys["last_name"])))
+        return names
+
+    def get(self, model, id: int) -> Any:
+        """
+        Get an object from the cache, falling back to the database if the id was not
+        preloaded. Missing objects are cached as None.
+
+        :param model: The model class to retrieve
+        :type model: django.db.models.Model
+        :param id: The primary key of the object
+        :type id: int
+        :return: The object or None if it doesn't exist
+        :rtype: Any
+        """
+
+        cache = self.maps[model]
+        if id not in cache:
+            try:
+                cache[id] = self._queryset(model).filter(pk=id).first()
+            except (ValueError, TypeError):
+                return None
+            if model is EmployeeImport and cache[id] is not None:
+                self._snapshot(cache[id])
+        return cache[id]
+
+    @staticmethod
+    def refresh_tree(obj: Any) -> None:
+        """
+        Reload the tree fields of a cached object, and of the matched employee for an
+        EmployeeImport object.
+
+        :param obj: The cached EmployeeImport or BusinessUnit object
+        :type obj: Any
+        """
+
+        model = obj.__class__
+        if not model._mptt_updates_enabled:
+            # the saves don't move other nodes while the tree updates are deferred
+            return
+        fields = _tree_fields(model)
+        employee = None
+        if model is EmployeeImport and model.employee.is_cached(obj):
+            employee = obj.employee
+        employee_fields = _tree_fields(Employee) if employee is not None else []
+
+        values = (
+            model.objects.filter(pk=obj.pk)
+            .values(*fields, *[f"employee__{f}" for f in employee_fields])
+            .first()
+        )
+        if values is not None:
+            for f in fields:
+                setattr(obj, f, values[f])
+            for f in employee_fields:
+                setattr(employee, f, values[f"employee__{f}"])
+
+    def add(self, obj: Any) -> None:
+        """Register a created or updated object with the cache"""
+
+        self.maps[obj.__class__][obj.pk] = obj
+
+    def remove(self, obj: Any) -> None:
+        """Mark an object as no longer existing"""
+
+        self.maps[obj.__class__][obj.pk] = None
+        if isinstance(obj, EmployeeImport):
+            self._deferred.pop(obj.pk, None)
+
+    def rollback(self, employee_id: int = None) -> None:
+        """
+        Forget the cached objects after the save of a row was rolled back, they may hold
+        changes that are no longer in the database. The employees that are queued by
+        the other rows are kept.
+
+        :param employee_id: The id of the employee of the rolled back row
+        :type employee_id: int, optional
+        """
+
+        self._deferred.pop(employee_id, None)
+        for model in self.maps:
+            self.maps[model] = {}
+        self.maps[EmployeeImport].update(self._deferred)
+        self._original = {pk: self._original[pk] for pk in self._deferred}
+
+    def can_defer(self, employee: EmployeeImport) -> bool:
+        """
+        Check if the pending changes to the employee can be written in bulk. Only
+        matched employees that existed when they were preloaded and have no changes that
+        need to be handled by the model signals are eligible.
+
+        :param employee: The changed EmployeeImport object
+        :type employee: EmployeeImport
+        :return: If the write can be deferred
+        :rtype: bool
+        """
+
+        original = self._original.get(employee.pk)
+        if not self.defer_writes or original is None:
+            return False
+        if not employee.is_matched or employee.employee is None:
+            return False
+        for field in SIGNAL_FIELDS:
+            if getattr(employee, _attname(EmployeeImport, field)) != original[field]:
+                return False
+
+        mutable = employee.employee
+        return (
+            mutable.username is not None
+            and mutable.email_alias is not None
+            and mutable.state == employee.state
+            and mutable.leave == employee.leave
+        )
+
+    def defer(self, employee: EmployeeImport) -> bool:
+        """
+        Queue the employee to be written on the next flush.
+
+        :param employee: The changed EmployeeImport object
+        :type employee: EmployeeImport
+        :return: True if the write was queued, False if the caller needs to save the
+            employee itself.
+        :rtype: bool
+        """
+
+        if self.can_defer(employee):
+            self._deferred[employee.pk] = employee
+            return True
+
+        self._deferred.pop(employee.pk, None)
+        return False
+
+    def is_deferred(self, employee: EmployeeImport) -> bool:
+        """Check if the employee is queued to be written on the next flush"""
+
+        return employee.pk in self._deferred
+
+    def flush(self) -> None:
+        """
+        Write all the deferred employees. The changes are propagated to the matched
+        Employee objects the same way that the EmployeeImport pre_save signal would,
+        then both tables are updated with bulk_update.
+        """
+
+        imports = list(self._deferred.values())
+        self._deferred = {}
+        if not imports:
+            return
+
+        now = timezone.now()
+        employees = []
+        for instance in imports:
+            prev = self._original[instance.pk]
+            mutable = instance.employee
+            changed = False
+            instance.updated_on = now
+
+            for key in UPDATE_FIELDS_OPTIONAL:
+                attname = _attname(Employee, key)
+                value = getattr(instance, attname)
+                if getattr(mutable, attname) is None or (
+                    getattr(mutable, attname) == prev[key] and value != prev[key]
+                ):
+                    if getattr(mutable, attname) != value:
+                        setattr(mutable, attname, value)
+                        changed = True
+
+            for key in UPDATE_FIELDS_ALWAYS:
+                attname = _attname(Employee, key)
+                value = getattr(instance, attname)
+                if value is not None and getattr(mutable, attname) != value:
+                    setattr(mutable, attname, value)
+                    changed = True
+
+            if changed:
+                mutable.updated_on = now
+                employees.append(mutable)
+
+        try:
+            with transaction.atomic():
+                EmployeeImport.objects.bulk_update(
+                    imports, self.import_fields(), batch_size=self.batch_size
+                )
+                if employees:
+                    Employee.objects.bulk_update(
+                        employees,
+                        UPDATE_FIELDS_ALWAYS + UPDATE_FIELDS_OPTIONAL + ["updated_on"],
+                        batch_size=self.batch_size,
+                    )
+                self._sync_jobs(imports)
+        except IntegrityError as e:
+            logger.warning(f"Bulk update failed, saving individually. Error: {e}")
+            for instance in imports:
+                try:
+                    self.refresh_tree(instance)
+                    with transaction.atomic():
+                        instance.save()
+                except IntegrityError:
+                    logger.exception(f"Failed to save {instance}")
+
+        for instance in imports:
+            instance.mark_stored(self.import_fields())
+            self._snapshot(instance)
+        for mutable in employees:
+            mutable.mark_stored(UPDATE_FIELDS_ALWAYS + UPDATE_FIELDS_OPTIONAL)
+
+        logger.debug(
+            f"Flushed {len(imports)} import records and {len(employees)} employees"
+        )
+
+    @staticmethod
+    def import_fields() -> List[str]:
+        """The EmployeeImport fields that are written by bulk_update"""
+
+        mptt = EmployeeImport._mptt_meta
+        skip = (
+            mptt.left_attr,
+            mptt.right_attr,
+            mptt.tree_id_attr,
+            mptt.level_attr,
+            "manager",
+            "employee",
+        )
+        return [
+            f.name
+            for f in EmployeeImport._meta.concrete_fields
+            if not f.primary_key and f.name not in skip
+        ]
+
+    @staticmethod
+    def _sync_jobs(imports: List[EmployeeImport]) -> None:
+        """Ensure that the secondary jobs of each import are set on the Employee"""
+
+        employee_ids = {i.pk: i.employee_id for i in imports}
+        through = EmployeeImport.jobs.through
+        pairs = through.objects.filter(
+            employeeimport_id__in=list(employee_ids)
+        ).values_list("employeeimport_id", "jobrole_id")
+
+        Employee.jobs.through.objects.bulk_create(
+            [
+                Employee.jobs.through(employee_id=employee_ids[i], jobrole_id=j)
+                for i, j in pairs
+            ],
+            ignore_conflicts=True,
+        )
@@ -0,0 +1,84 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger("ftp_import.ColumnPlan")
+
+
+class ColumnPlan(list):
+    """
+    The field configuration of the columns of an import file, in column order. The plan
+    is compiled once the header row has been parsed so that the rows can be mapped and
+    the fields looked up without scanning the configuration for every row and key.
+
+    The plan is still the list of field dicts so forms that iterate the field
+    configuration work unchanged.
+    """
+
+    def __init__(self, fields: Iterable[Dict] = ()) -> None:
+        """
+        Compile the plan for the fields of the file.
+
+        :param fields: The field config of each column, as returned by config.get_fields
+            with the column name added as "field"
+        :type fields: Iterable[Dict]
+        """
+
+        super().__init__(fields)
+
+        #: The indexes of the imported columns.
+        self.indexes: Tuple[int] = tuple(
+            x for x, field in enumerate(self) if field and field["import"]
+        )
+        #: The names of the imported columns, in the same order as indexes.
+        self.names: Tuple[str] = tuple(self[x]["field"] for x in self.indexes)
+
+        self._map_to: Dict[str, str] = {}
+        self._field_name: Dict[str, str] = {}
+        for field in self:
+            if not field:
+                continue
+            self._map_to.setdefault(field["field"], field["map_to"])
+            if field["import"]:
+                self._field_name.setdefault(field["map_to"], field["field"])
+
+        logger.debug(f"Compiled {len(self.indexes)} of {len(self)} columns")
+
+    def row(self, vals: List[str]) -> Dict[str, str]:
+        """
+        Map the values of a row to the names of the imported columns.
+
+        :param vals: The values of every column of the row
+        :type vals: List[str]
+        :return: The row data keyed by the column name
+        :rtype: Dict[str, str]
+        """
+
+        return dict(zip(self.names, map(vals.__getitem__, self.indexes)))
+
+    def map_to(self, key: str) -> str:
+        """
+        Get the model field that a column is mapped to.
+
+        :param key: The column name
+        :type key: str
+        :return: The map to field or an empty string
+        :rtype: str
+        """
+
+        return self._map_to.get(key, "")
+
+    def field_name(self, key: str) -> str:
+        """
+        Get the imported column that is mapped to a model field.
+
+        :param key: The model field name
+        :type key: str
+        :return: The column name or an empty string
+        :rtype: str
+        """
+
+        return self._field_name.get(key, "")
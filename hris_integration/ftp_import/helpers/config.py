@@ -5,11 +5,13 @@ import logging
 
 from distutils.util import strtobool
 from copy import deepcopy
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Dict, Tuple
 from warnings import warn
 from settings.models import Setting
 from settings.config_manager import ConfigurationManagerBase
-from warnings import warn
+from settings.helpers.field_manager import FieldConversion
+from settings.validators import ValidationError
 
 from .text_utils import safe
 from .settings_fields import *
@@ -105,8 +107,8 @@ class CsvSetting:
         for k, v in self.fields.items():
             if v["map_to"] == map_to and v["import"]:
                 return k
-            elif not v["import"]:
-                return None
+
+        return None
 
 
 def get_fields() -> dict:
@@ -120,6 +122,84 @@ class Config(ConfigurationManagerBase):
     fixtures = CONFIG_DEFAULTS
 
 
+class ConfigSnapshot:
+    """
+    A read only copy of the ftp_import configuration group. The whole group is loaded
+    with a single query when the snapshot is created so that an import run uses the
+    same configuration from start to finish without querying the settings for each row.
+
+    The snapshot is called the same way as Config, ``snapshot(category, item)``.
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self) -> None:
+        values = {}
+        for row in Setting.o2.get_by_path(GROUP_CONFIG):
+            if row.item not in CONFIG_DEFAULTS.get(row.category, {}):
+                continue
+            try:
+                field = FieldConversion(row.field_properties.get("type", "CharField"))
+                field(row.value)
+                values[(row.category, row.item)] = field.value
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Unable to load setting {row.setting}: {e}")
+                values[(row.category, row.item)] = e
+
+        conf = Config()
+        for category, items in CONFIG_DEFAULTS.items():
+            for item in items.keys():
+                if (category, item) not in values:
+                    # falling back to Config installs any missing fixtures
+                    values[(category, item)] = conf(category, item)
+
+        object.__setattr__(self, "_values", MappingProxyType(values))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is read only")
+
+    def __reduce__(self):
+        # the values are passed as is so the import workers don't reload the settings
+        return (_restore_snapshot, (dict(self._values),))
+
+    def __call__(self, category: str, item: str) -> Any:
+        """
+        Get the value of a setting.
+
+        :param category: the category to which the item belongs.
+        :type category: str
+        :param item: the field to retrieve
+        :type item: str
+        :raises ValidationError: If the category and item are not a valid combination
+        :raises ValueError: If the stored value could not be converted
+        :return: The parsed value of the field.
+        :rtype: Any
+        """
+
+        try:
+            value = self._values[(category, item)]
+        except KeyError:
+            raise ValidationError(
+                f"Item '{category}/{item}' is not a valid combination"
+                " or valid for this module"
+            )
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    @property
+    def values(self) -> Dict[Tuple[str, str], Any]:
+        """The loaded values keyed by (category, item)"""
+
+        return self._values
+
+
+def _restore_snapshot(values: Dict[Tuple[str, str], Any]) -> ConfigSnapshot:
+    snapshot = object.__new__(ConfigSnapshot)
+    object.__setattr__(snapshot, "_values", MappingProxyType(values))
+    return snapshot
+
+
 def get_config(category: str, item: str) -> Any:
     """Now deprecated use Config instead to manage the value"""
     warn(
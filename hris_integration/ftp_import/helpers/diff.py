@@ -0,0 +1,169 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import logging
+
+from typing import Any, Dict, List, Tuple
+from employee.models import Employee
+from organization.models import JobRole, Location, BusinessUnit
+
+logger = logging.getLogger("ftp_import.ImportDiff")
+
+#: The key that the changes to each organization model are reported under.
+OBJECT_KEYS = {JobRole: "jobs", BusinessUnit: "business_units", Location: "locations"}
+
+
+class ImportDiff:
+    """
+    The changes that an import file would make, as computed by a dry run of the import.
+    The forms record their changes with plan instead of saving them, nothing is written
+    to the database.
+
+    The diff is keyed by the employee id of the import file:
+
+    - new: the mapped values of the employees that would be created
+    - updated: the changed fields of existing employees as (stored, imported) pairs
+    - terminated: the ids of the employees whose status would change to terminated
+    - matches: the pending employees that new or unmatched employees would be matched
+      to, more than one match leaves the employee pending
+    - jobs, business_units and locations: the objects that would be created and the
+      ones that would be renamed
+    """
+
+    def __init__(self) -> None:
+        self.new: Dict[int, Dict[str, Any]] = {}
+        self.updated: Dict[int, Dict[str, Tuple[Any, Any]]] = {}
+        self.terminated: List[int] = []
+        self.matches: Dict[int, List[Dict[str, Any]]] = {}
+        self.objects: Dict[str, Dict[str, Dict]] = {
+            key: {"new": {}, "renamed": {}} for key in OBJECT_KEYS.values()
+        }
+        self.unchanged = 0
+        self.skipped = 0
+        self.errors: List[str] = []
+
+    def add_new(self, id: int, values: Dict[str, Any]) -> None:
+        """
+        Record a new employee.
+
+        :param id: The employee id
+        :type id: int
+        :param values: The imported values keyed by the model field
+        :type values: Dict[str, Any]
+        """
+
+        self.new[id] = values
+
+    def add_update(self, id: int, changes: Dict[str, Tuple[Any, Any]]) -> None:
+        """
+        Record the changes to an existing employee.
+
+        :param id: The employee id
+        :type id: int
+        :param changes: The stored and imported value keyed by the model field
+        :type changes: Dict[str, Tuple[Any, Any]]
+        """
+
+        if changes:
+            self.updated.setdefault(id, {}).update(changes)
+        else:
+            self.unchanged += 1
+
+    def add_termination(self, id: int) -> None:
+        """Record an employee whose status would change to terminated"""
+
+        if id not in self.terminated:
+            self.terminated.append(id)
+
+    def add_matches(self, id: int, matches: List[Tuple[Employee, int]]) -> None:
+        """
+        Record the pending employees that an employee matched.
+
+        :param id: The employee id
+        :type id: int
+        :param matches: The matched employees and their score, as returned by
+            PendingIndex.match
+        :type matches: List[Tuple[Employee, int]]
+        """
+
+        if matches:
+            self.matches[id] = [
+                {"employee": emp.pk, "name": str(emp), "score": score}
+                for emp, score in matches
+            ]
+
+    def add_object(self, obj: Any, name: str) -> None:
+        """
+        Record a JobRole, BusinessUnit or Location that would be created.
+
+        :param obj: The unsaved object
+        :type obj: Any
+        :param name: The name that it would be created with
+        :type name: str
+        """
+
+        self.objects[OBJECT_KEYS[obj.__class__]]["new"].setdefault(obj.pk, name)
+
+    def rename_object(self, obj: Any, name: str) -> None:
+        """
+        Record a JobRole, BusinessUnit or Location that would be renamed.
+
+        :param obj: The stored object
+        :type obj: Any
+        :param name: The new name
+        :type name: str
+        """
+
+        self.objects[OBJECT_KEYS[obj.__class__]]["renamed"][obj.pk] = (obj.name, name)
+
+    def is_new(self, model, id: int) -> bool:
+        """
+        Check if an object is created by an earlier row of the file.
+
+        :param model: The EmployeeImport, JobRole, BusinessUnit or Location model
+        :type model: django.db.models.Model
+        :param id: The primary key of the object
+        :type id: int
+        :return: If the object would be created
+        :rtype: bool
+        """
+
+        if model in OBJECT_KEYS:
+            return id in self.objects[OBJECT_KEYS[model]]["new"]
+        return id in self.new
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the diff as a dict of json serializable values"""
+
+        output = {
+            "summary": {
+                "new": len(self.new),
+                "updated": len(self.updated),
+                "terminated": len(self.terminated),
+                "unchanged": self.unchanged,
+                "skipped": self.skipped,
+                "errors": len(self.errors),
+            },
+            "new": self.new,
+            "updated": {
+                id: {k: list(v) for k, v in changes.items()}
+                for id, changes in self.updated.items()
+            },
+            "terminated": self.terminated,
+            "matches": self.matches,
+            "errors": self.errors,
+        }
+        for key, changes in self.objects.items():
+            output["summary"][f"new_{key}"] = len(changes["new"])
+            output[key] = {
+                "new": changes["new"],
+                "renamed": {k: list(v) for k, v in changes["renamed"].items()},
+            }
+        return json.loads(json.dumps(output, default=str))
+
+    def __str__(self):
+        summary = self.as_dict()["summary"]
+        return "\n".join(
+            f"\t{k.replace('_', ' ').title() + ':':<23}{v}" for k, v in summary.items()
+        )
@@ -0,0 +1,135 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+import time
+
+from contextlib import nullcontext
+from typing import Dict, List, Tuple
+from django.db import connection, transaction
+
+from ftp_import.exceptions import ObjectCreationError
+
+from . import config, tree
+from .stats import Metrics, Stats
+
+logger = logging.getLogger("ftp_import.parallel")
+
+
+def save_row(
+    form, field_config: List[Dict], line: int, row: Dict[str, str], **kwargs
+) -> bool:
+    """
+    Initialize the form with the row data and save it, errors are logged and added to
+    the Stats against the line of the row. The row is saved in a savepoint so that the
+    changes of a row that fails are rolled back without affecting the rest of the batch.
+    The time taken is added to the row latency of the Stats.
+
+    :param form: The configured import form class
+    :type form: ftp_import.forms.BaseImport
+    :param field_config: The field configuration of the file being imported
+    :type field_config: List[Dict]
+    :param line: The line number of the row in the file, used for error reporting
+    :type line: int
+    :param row: The parsed row data
+    :type row: Dict[str, str]
+    :param kwargs: passed to the form, pre_saved is passed to the save call
+    :return: False if changes of the row were rolled back
+    :rtype: bool
+    """
+
+    save_kwargs = {}
+    if kwargs.pop("pre_saved", False):
+        save_kwargs["pre_saved"] = True
+
+    started = time.perf_counter()
+    saving = False
+    try:
+        with transaction.atomic():
+            with Stats.phase("map"):
+                f = form(field_config, **kwargs, **row)
+            saving = True
+            with Stats.phase("save"):
+                f.save(**save_kwargs)
+        return True
+    except ValueError as e:
+        logger.error("Failed to save Employee refer to previous logs for more details")
+        logger.debug(f"{e}")
+        Stats.errors.append(f"Line: {line} - Error: {e}")
+    except ObjectCreationError as e:
+        logger.error(
+            "Caught exception while creating employee, failed to create reference "
+            "object. Refer to above logs"
+        )
+        Stats.errors.append(f"Line: {line} - Error: {e}")
+    finally:
+        Stats.observe_row(time.perf_counter() - started)
+
+    return not saving
+
+
+def batch_transaction(snapshot: config.ConfigSnapshot):
+    """
+    Get the transaction that a batch of rows is saved in, if batches are disabled every
+    row is committed on its own.
+
+    :param snapshot: The configuration of the import run
+    :type snapshot: config.ConfigSnapshot
+    """
+
+    if snapshot(config.CAT_CSV, config.CSV_COMMIT_SIZE):
+        return transaction.atomic()
+    return nullcontext()
+
+
+def supported() -> bool:
+    """SQLite only allows one writer at a time so the rows can't be saved in parallel"""
+
+    return connection.vendor != "sqlite"
+
+
+def init_worker() -> None:
+    """Setup Django in an import worker process"""
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def import_rows(
+    form,
+    field_config: List[Dict],
+    snapshot,
+    rows: List[Tuple[int, Dict[str, str]]],
+) -> Dict:
+    """
+    Save a partition of independent rows in an import worker. save_pre has already been
+    run for the rows by the parent process.
+
+    :param form: The configured import form class
+    :type form: ftp_import.forms.BaseImport
+    :param field_config: The field configuration of the file being imported
+    :type field_config: List[Dict]
+    :param snapshot: The configuration of the import run
+    :type snapshot: config.ConfigSnapshot
+    :param rows: The line number and parsed data of the rows
+    :type rows: List[Tuple[int, Dict[str, str]]]
+    :return: The metrics collected while saving the rows
+    :rtype: Dict
+    """
+
+    metrics = Metrics()
+    if snapshot(config.CAT_CSV, config.CSV_DEFER_TREE):
+        # the parent process rebuilds the trees at the end of the file
+        trees = tree.disabled_tree_updates()
+    else:
+        trees = nullcontext()
+
+    with metrics.activate(), trees, batch_transaction(snapshot):
+        for line, row in rows:
+            save_row(form, field_config, line, row, snapshot=snapshot, pre_saved=True)
+
+    logger.debug(f"Saved {len(rows)} rows")
+    return metrics.collect()
@@ -0,0 +1,183 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+
+from typing import Dict, List, Set, Tuple
+from employee.models import Employee
+
+from .text_utils import fuzz_name
+
+logger = logging.getLogger("ftp_import.PendingIndex")
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def normalize(name: str) -> str:
+    """Lower case the name and strip everything that isn't a letter"""
+
+    return "".join(c for c in str(name or "").lower() if c.isalpha())
+
+
+def soundex(name: str) -> str:
+    """
+    Get the soundex code of a normalized name.
+
+    :param name: The normalized name
+    :type name: str
+    :return: The soundex code or an empty string if the name is empty
+    :rtype: str
+    """
+
+    if not name:
+        return ""
+
+    code = name[0]
+    last = SOUNDEX_CODES.get(name[0], "")
+    for char in name[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            last = digit
+
+    return code.ljust(4, "0")
+
+
+def blocking_keys(first_name: str, last_name: str) -> Set[str]:
+    """
+    Get the blocking keys for a name. Two names are only scored against each other if
+    they share at least one key, for each part of the name the keys are the soundex code
+    and the first and last three letters.
+
+    :param first_name: The first name
+    :type first_name: str
+    :param last_name: The last name
+    :type last_name: str
+    :return: The keys for the name
+    :rtype: Set[str]
+    """
+
+    keys = set()
+    for prefix, name in (("f", normalize(first_name)), ("l", normalize(last_name))):
+        if not name:
+            continue
+        keys.add(f"{prefix}:s:{soundex(name)}")
+        keys.add(f"{prefix}:p:{name[:3]}")
+        keys.add(f"{prefix}:e:{name[-3:]}")
+
+    return keys
+
+
+class PendingIndex:
+    """
+    An index of the pending (not imported) employees used to find the possible matches
+    for new employees in the import file.
+
+    The pending employees are loaded once, the first time the index is used, and are
+    grouped by their blocking keys so that a new employee is only scored against the
+    pending employees that have a similar first or last name instead of the whole table.
+    Employees that are matched are removed from the index.
+    """
+
+    def __init__(self) -> None:
+        self._built = False
+        self.employees: Dict[int, Tuple[Employee, str, str]] = {}
+        self.blocks: Dict[str, Set[int]] = {}
+
+    def build(self) -> None:
+        """Load the pending employees and build the blocking key index"""
+
+        self.employees = {}
+        self.blocks = {}
+        for emp in Employee.objects.filter(is_imported=False):
+            self.add(emp)
+
+        self._built = True
+        logger.debug(
+            f"Indexed {len(self.employees)} pending employees in "
+            f"{len(self.blocks)} blocks"
+        )
+
+    def clear(self) -> None:
+        """Forget the indexed employees, the index is rebuilt the next time it's used"""
+
+        self._built = False
+        self.employees = {}
+        self.blocks = {}
+
+    def add(self, employee: Employee) -> None:
+        """Add a pending employee to the index"""
+
+        self.employees[employee.pk] = (
+            employee,
+            employee.first_name or "",
+            employee.last_name or "",
+        )
+        for key in blocking_keys(employee.first_name, employee.last_name):
+            self.blocks.setdefault(key, set()).add(employee.pk)
+
+    def remove(self, employee: Employee) -> None:
+        """Remove an employee that has been matched from the index"""
+
+        if employee is None or employee.pk not in self.employees:
+            return
+
+        _, first_name, last_name = self.employees.pop(employee.pk)
+        for key in blocking_keys(first_name, last_name):
+            self.blocks.get(key, set()).discard(employee.pk)
+
+    def candidates(self, first_name: str, last_name: str) -> List[int]:
+        """Get the ids of the pending employees that share a blocking key with the name"""
+
+        if not self._built:
+            self.build()
+
+        ids = set()
+        for key in blocking_keys(first_name, last_name):
+            ids.update(self.blocks.get(key, ()))
+
+        return sorted(ids)
+
+    def match(
+        self, first_name: str, last_name: str, match_pcent: int = 80
+    ) -> List[Tuple[Employee, int]]:
+        """
+        Score the name against the candidate pending employees.
+
+        :param first_name: The first name of the new employee
+        :type first_name: str
+        :param last_name: The last name of the new employee
+        :type last_name: str
+        :param match_pcent: The minimum score of a match, defaults to 80
+        :type match_pcent: int, optional
+        :return: The matching employees and their score, the best match first
+        :rtype: List[Tuple[Employee, int]]
+        """
+
+        candidates = self.candidates(first_name, last_name)
+
+        matches = []
+        for pk in candidates:
+            emp, emp_fname, emp_lname = self.employees[pk]
+            state, score = fuzz_name(
+                first_name, last_name, emp_fname, emp_lname, match_pcent
+            )
+            if state:
+                matches.append((emp, score))
+
+        logger.debug(
+            f"Scored {len(candidates)} of {len(self.employees)} pending employees, "
+            f"{len(matches)} matched"
+        )
+        matches.sort(key=lambda m: m[1], reverse=True)
+        return matches
@@ -25,6 +25,7 @@ SERVER_PASSWORD = "password"
 SERVER_SSH_KEY = "ssh_key"
 SERVER_PATH = "base_path"
 SERVER_FILE_EXP = "file_name_expression"
+SERVER_DOWNLOADS = "download_workers"
 CSV_FIELD_SEP = "field_separator"
 CSV_FAIL_NOTIF = "import_failure_notification_email"
 CSV_IMPORT_CLASS = "import_form_class"
@@ -35,6 +36,16 @@ CSV_IMPORT_JOBS = "import_new_jobs"
 CSV_IMPORT_BU = "import_business_units"
 CSV_IMPORT_LOC = "import_locations"
 CSV_DATE_FMT = "date_format"
+CSV_BULK_IMPORT = "bulk_import"
+CSV_BULK_SIZE = "bulk_import_batch_size"
+CSV_FULL_REFRESH = "full_refresh"
+CSV_WORKERS = "import_workers"
+CSV_COMMIT_SIZE = "commit_batch_size"
+CSV_QUOTE_CHAR = "quote_character"
+CSV_ESCAPE_CHAR = "escape_character"
+CSV_FILE_FORMATS = "file_formats"
+CSV_FIXED_WIDTHS = "fixed_width_columns"
+CSV_DEFER_TREE = "defer_tree_updates"
 FIELD_LOC_NAME = "location_name_field"
 FIELD_JD_NAME = "job_description_name_field"
 FIELD_JD_BU = "job_description_business_unit_field"
@@ -112,6 +123,15 @@ CONFIG_DEFAULTS = {
                 "required": True,
             },
         },
+        SERVER_DOWNLOADS: {
+            "default_value": "2",
+            "field_properties": {
+                "type": "IntegerField",
+                "help_text": "Number of files to download ahead of the file being imported",
+                "required": True,
+                "min_value": 1,
+            },
+        },
     },
     CAT_CSV: {
         CSV_FIELD_SEP: {
@@ -123,6 +143,36 @@ CONFIG_DEFAULTS = {
                 "required": True,
             },
         },
+        CSV_QUOTE_CHAR: {
+            "default_value": '"',
+            "field_properties": {
+                "type": "CharField",
+                "max_length": 1,
+                "help_text": "Character that quotes fields containing the separator, leave empty if fields are never quoted",
+            },
+        },
+        CSV_ESCAPE_CHAR: {
+            "default_value": None,
+            "field_properties": {
+                "type": "CharField",
+                "max_length": 1,
+                "help_text": "Character that escapes the separator and quote character, leave empty if quotes are escaped by doubling them",
+            },
+        },
+        CSV_FILE_FORMATS: {
+            "default_value": None,
+            "field_properties": {
+                "type": "CharField",
+                "help_text": "Semicolon separated list of file name expression=format pairs, the formats are csv, fixed and jsonl. Files that don't match are read as csv unless the file name expression has a 'format' group. Gzip compressed files are detected automatically",
+            },
+        },
+        CSV_FIXED_WIDTHS: {
+            "default_value": None,
+            "field_properties": {
+                "type": "CharField",
+                "help_text": "Comma separated widths of the columns of fixed width files",
+            },
+        },
         CSV_FAIL_NOTIF: {
             "default_value": None,
             "field_properties": {
@@ -193,6 +243,54 @@ CONFIG_DEFAULTS = {
                 "required": True,
             },
         },
+        CSV_BULK_IMPORT: {
+            "default_value": "False",
+            "field_properties": {
+                "type": "BooleanField",
+                "help_text": "Preload referenced records and write unchanged-structure updates in bulk batches",
+            },
+        },
+        CSV_BULK_SIZE: {
+            "default_value": "500",
+            "field_properties": {
+                "type": "IntegerField",
+                "help_text": "Number of rows to preload and write per batch when bulk import is enabled",
+                "required": True,
+                "min_value": 1,
+            },
+        },
+        CSV_FULL_REFRESH: {
+            "default_value": "False",
+            "field_properties": {
+                "type": "BooleanField",
+                "help_text": "Process every row, even rows that haven't changed since the last import",
+            },
+        },
+        CSV_COMMIT_SIZE: {
+            "default_value": "500",
+            "field_properties": {
+                "type": "IntegerField",
+                "help_text": "Number of rows saved per transaction, each bulk import batch is one transaction. 0 commits every row on its own",
+                "required": True,
+                "min_value": 0,
+            },
+        },
+        CSV_DEFER_TREE: {
+            "default_value": "False",
+            "field_properties": {
+                "type": "BooleanField",
+                "help_text": "Rebuild the employee, business unit and location trees once at the end of each file instead of updating them on every save, faster for initial loads and large reorganizations",
+            },
+        },
+        CSV_WORKERS: {
+            "default_value": "1",
+            "field_properties": {
+                "type": "IntegerField",
+                "help_text": "Number of processes used to save independent employee updates, 1 imports serially",
+                "required": True,
+                "min_value": 1,
+            },
+        },
     },
     CAT_FIELD: {
         FIELD_LOC_NAME: {
@@ -3,22 +3,215 @@
 
 import time
 
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List
+from django.db import connection
+
+#: The phases that the time of an import run is split into.
+PHASES = ("download", "parse", "map", "save", "cascade", "notify")
+#: The upper bound in seconds of the row latency buckets, the last bucket is unbounded.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
 
 def fmt_date(sec):
     t = time.gmtime(sec)
     return f"{t.tm_year}/{t.tm_mon}/{t.tm_mday} {t.tm_hour}:{t.tm_min:02d}"
 
 
-class Stats:
-    time_start = None
-    time_end = None
-    errors = []
-    rows_processed = 0
-    rows_imported = 0
-    warnings = []
-    pending_users = []
-    new_users = []
-    files = []
+class Metrics:
+    """
+    The metrics of an import run. The run counters and lists, the time spent in each
+    phase, the number of queries run in each phase and a histogram of the time taken to
+    save each row.
+
+    A Metrics object is activated for the duration of the run so that the forms can
+    update it through Stats. The metrics of a run in another process, like an import
+    worker, are collected and merged into the metrics of the parent run.
+    """
+
+    #: The per row counters and lists that are collected from the import workers
+    COUNTERS = (
+        "rows_processed",
+        "rows_imported",
+        "rows_skipped",
+        "rows_changed",
+        "rows_new",
+    )
+    LISTS = ("errors", "warnings", "pending_users", "new_users", "files")
+
+    def __init__(self) -> None:
+        self.time_start = time.time()
+        self.time_end = None
+        for k in self.COUNTERS:
+            setattr(self, k, 0)
+        for k in self.LISTS:
+            setattr(self, k, [])
+        #: The seconds spent in each phase.
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        #: The number of queries run in each phase, queries outside a phase are "other".
+        self.phase_queries: Dict[str, int] = dict.fromkeys(PHASES + ("other",), 0)
+        #: The number of rows saved in each of the LATENCY_BUCKETS.
+        self.row_latency: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._phase_stack = []
+
+    @property
+    def queries(self) -> int:
+        """The number of queries run"""
+
+        return sum(self.phase_queries.values())
+
+    @contextmanager
+    def activate(self):
+        """
+        Make these the metrics that Stats refers to and count the queries run on the
+        database connection of this thread. The previously active metrics are restored
+        when the context exits.
+        """
+
+        global _current, _counting
+
+        previous, _current = _current, self
+        try:
+            if _counting:
+                yield self
+            else:
+                _counting = True
+                try:
+                    with connection.execute_wrapper(_count_query):
+                        yield self
+                finally:
+                    _counting = False
+        finally:
+            _current = previous
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the phase of the run. The phases are exclusive, the time of a phase that is
+        entered from another phase is only counted towards the inner phase.
+
+        :param name: The name of the phase, one of PHASES
+        :type name: str
+        """
+
+        now = time.perf_counter()
+        if self._phase_stack:
+            outer = self._phase_stack[-1]
+            self.phases[outer[0]] += now - outer[1]
+        self._phase_stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases[name] += now - self._phase_stack.pop()[1]
+            if self._phase_stack:
+                self._phase_stack[-1][1] = now
+
+    def count_query(self) -> None:
+        """Count a query against the current phase"""
+
+        phase = self._phase_stack[-1][0] if self._phase_stack else "other"
+        self.phase_queries[phase] += 1
+
+    def observe_row(self, seconds: float) -> None:
+        """
+        Add the time taken to save a row to the latency histogram.
+
+        :param seconds: The time taken to save the row
+        :type seconds: float
+        """
+
+        self.row_latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def finish(self) -> None:
+        """Set the end time of the run"""
+
+        self.time_end = time.time()
+
+    def collect(self) -> dict:
+        """Get a copy of the per row counters and lists, the phase times and counts"""
+
+        data = {k: getattr(self, k) for k in self.COUNTERS}
+        data.update({k: list(getattr(self, k)) for k in self.LISTS})
+        data["phases"] = dict(self.phases)
+        data["phase_queries"] = dict(self.phase_queries)
+        data["row_latency"] = list(self.row_latency)
+        return data
+
+    def restore(self, data: dict) -> None:
+        """Set the per row counters and lists from the output of collect, the phase
+        times and counts are kept"""
+
+        for k in self.COUNTERS:
+            setattr(self, k, data[k])
+        for k in self.LISTS:
+            setattr(self, k, list(data[k]))
+
+    def merge(self, data: dict, skip: tuple = ()) -> None:
+        """
+        Add the metrics collected from another run. The phase times of runs that ran at
+        the same time are added, so they may add up to more than the run time.
+
+        :param data: The output of collect
+        :type data: dict
+        :param skip: The counters and lists that are not merged
+        :type skip: tuple
+        """
+
+        for k in self.COUNTERS:
+            if k not in skip:
+                setattr(self, k, getattr(self, k) + data[k])
+        for k in self.LISTS:
+            if k not in skip:
+                getattr(self, k).extend(data[k])
+        for k, v in data["phases"].items():
+            self.phases[k] += v
+        for k, v in data["phase_queries"].items():
+            self.phase_queries[k] += v
+        for x, v in enumerate(data["row_latency"]):
+            self.row_latency[x] += v
+
+    def latency_percentile(self, percent: float) -> float:
+        """
+        Get the upper bound of the latency bucket that contains the percentile of the
+        saved rows.
+
+        :param percent: The percentile, between 0 and 100
+        :type percent: float
+        :return: The bucket bound in seconds, None if no rows were saved or the
+            percentile is in the unbounded bucket
+        :rtype: float
+        """
+
+        total = sum(self.row_latency)
+        if not total:
+            return None
+
+        count = 0
+        for bound, rows in zip(LATENCY_BUCKETS, self.row_latency):
+            count += rows
+            if count >= total * percent / 100:
+                return bound
+        return None
+
+    @property
+    def timings(self) -> List[tuple]:
+        """The label and value of the phase times, query counts and row latencies"""
+
+        output = [
+            (k.title(), f"{self.phases[k]:.2f}s {self.phase_queries[k]} queries")
+            for k in PHASES
+        ]
+        output.append(("Other", f"{self.phase_queries['other']} queries"))
+        for percent in (50, 95, 99):
+            bound = self.latency_percentile(percent)
+            if bound is None:
+                bound = f">{LATENCY_BUCKETS[-1] * 1000:g}ms"
+            else:
+                bound = f"<{bound * 1000:g}ms"
+            output.append((f"Row Latency p{percent}", bound))
+        return output
 
     @property
     def runtime(self):
@@ -31,14 +224,19 @@ class Stats:
             f"\tStart Time:            {fmt_date(self.time_start)}",
             f"\tEnd Time:              {fmt_date(self.time_end)}",
             f"\tTotal Processing Time: {self.runtime}s",
-            f"\tFiles Processed:       {len(self.files)}"
+            f"\tFiles Processed:       {len(self.files)}",
             f"\tRows Processed:        {self.rows_processed}",
             f"\tRows Imported:         {self.rows_imported}",
+            f"\tRows New:              {self.rows_new}",
+            f"\tRows Changed:          {self.rows_changed}",
+            f"\tRows Unchanged:        {self.rows_skipped}",
             f"\tPending Users:         {len(self.pending_users)}",
             f"\tNew users:             {len(self.new_users)}",
             f"\t# of Warning:          {len(self.warnings)}",
             f"\t# of Errors:           {len(self.errors)}",
+            f"\tQueries:               {self.queries}",
         ]
+        output.extend(f"\t{k + ':':<23}{v}" for k, v in self.timings)
         return "\n".join(output)
 
     @property
@@ -54,8 +252,17 @@ class Stats:
             f"<tr><td>Files Processed</td><td>{len(self.files)}</td></tr>",
             f"<tr><td>Rows Processed</td><td>{self.rows_processed}</td></tr>",
             f"<tr><td>Rows Imported</td><td>{self.rows_imported}</td></tr>",
+            f"<tr><td>Rows New</td><td>{self.rows_new}</td></tr>",
+            f"<tr><td>Rows Changed</td><td>{self.rows_changed}</td></tr>",
+            f"<tr><td>Rows Unchanged</td><td>{self.rows_skipped}</td></tr>",
+            f"<tr><td>Queries</td><td>{self.queries}</td></tr>",
             "</table>",
+            "<h3>Timings:</h3>",
+            '<table style="border: None;">',
         ]
+        for k, v in self.timings:
+            output.append(f"<tr><td>{k}</td><td>{v}</td></tr>")
+        output.append("</table>")
 
         if self.pending_users:
             output.append("<h3>Users Pending Import:</h3>")
@@ -99,7 +306,14 @@ class Stats:
             f"  Files Processed: {len(self.files)}",
             f"  Rows Processed:  {self.rows_processed}",
             f"  Rows Imported:   {self.rows_imported}",
+            f"  Rows New:        {self.rows_new}",
+            f"  Rows Changed:    {self.rows_changed}",
+            f"  Rows Unchanged:  {self.rows_skipped}",
+            f"  Queries:         {self.queries}",
+            "",
+            "Timings:",
         ]
+        output.extend(f"  {k + ':':<21}{v}" for k, v in self.timings)
 
         if self.pending_users:
             output.append("")
@@ -129,3 +343,37 @@ class Stats:
             output.append(f" - {r}")
 
         return "\n".join(output)
+
+
+_current = Metrics()
+_counting = False
+
+
+def _count_query(execute, sql, params, many, context):
+    _current.count_query()
+    return execute(sql, params, many, context)
+
+
+def current() -> Metrics:
+    """Get the metrics of the active import run"""
+
+    return _current
+
+
+class _CurrentMetrics(type):
+    def __getattr__(cls, name):
+        return getattr(_current, name)
+
+    def __setattr__(cls, name, value):
+        setattr(_current, name, value)
+
+
+class Stats(metaclass=_CurrentMetrics):
+    """
+    The metrics of the active import run, attributes of the class are read from and
+    written to the active Metrics object. Outside of an import run the metrics of the
+    process are used.
+    """
+
+    def __new__(cls) -> Metrics:
+        return _current
@@ -1,8 +1,11 @@
 # Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import re
+
 from datetime import datetime
-from typing import Union
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Union
 from string import ascii_letters, digits
 from fuzzywuzzy import fuzz
 from django.utils.timezone import make_aware, is_aware
@@ -107,7 +110,7 @@ def fuzz_name(
         match_pcent (int, optional): Define the matching percentage value. Defaults to 80.
 
     Returns:
-        tuple[bool,int]: If a potential match was found and what matching percentage was.
+        tuple[bool,int]: If a potential match was found and the match score.
     """
 
     ratios = (
@@ -118,19 +121,149 @@ def fuzz_name(
         )
     )
 
-    if ratios / 3 >= float(match_pcent):
-        return True, int(round(match_pcent, 0))
-    else:
-        return False, int(round(match_pcent, 0))
+    score = ratios / 3
+    return score >= float(match_pcent), int(round(score, 0))
+
+
+#: The width of the numeric strptime directives that can be sliced from a date.
+DATE_DIRECTIVES = {"Y": 4, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+
+
+class DateParser:
+    """Parse the dates of an import file that are in the same format.
+
+    Dates in a fixed width numeric format, like %Y-%m-%d or %m/%d/%Y, are sliced
+    instead of being parsed by strptime. Any date that doesn't fit the fixed width, like
+    a month without a leading zero, falls back to strptime so the same values are
+    accepted and a malformed date raises the strptime error. The parsed dates are
+    memoized as start dates and status dates repeat across the rows of a file.
+    """
+
+    def __init__(self, fmt: str, max_size: int = 65536) -> None:
+        """
+        Args:
+            fmt (str): the strptime date format
+            max_size (int, optional): the number of dates that are memoized.
+                Defaults to 65536.
+        """
+
+        self.fmt = fmt
+        self.max_size = max_size
+        self._dates: Dict[str, datetime] = {}
+        self._fields, self._literals, self._width = self._compile(fmt)
+
+    @staticmethod
+    def _compile(fmt: str) -> Tuple[List[tuple], List[tuple], int]:
+        """Find the slices of the fixed width fields and the positions of the literals
+        of the format, the fields are None if the format can't be sliced"""
+
+        fields = []
+        literals = []
+        pos = 0
+        for directive, literal in re.findall(r"%(.)|([^%]+)", fmt):
+            if literal:
+                literals.append((pos, literal))
+                pos += len(literal)
+            elif directive in DATE_DIRECTIVES:
+                fields.append((directive, pos, pos + DATE_DIRECTIVES[directive]))
+                pos += DATE_DIRECTIVES[directive]
+            else:
+                return None, None, 0
+
+        if not {"Y", "m", "d"} <= {f[0] for f in fields}:
+            return None, None, 0
+        return fields, literals, pos
+
+    def _slice(self, date_str: str) -> datetime:
+        if self._fields is None or len(date_str) != self._width:
+            return None
+        for pos, literal in self._literals:
+            if not date_str.startswith(literal, pos):
+                return None
+
+        values = {}
+        for directive, start, end in self._fields:
+            value = date_str[start:end]
+            if not value.isdigit():
+                return None
+            values[directive] = int(value)
+
+        try:
+            return datetime(
+                values["Y"],
+                values["m"],
+                values["d"],
+                values.get("H", 0),
+                values.get("M", 0),
+                values.get("S", 0),
+            )
+        except ValueError:
+            # let strptime raise the error for the out of range value
+            return None
+
+    def __call__(self, date_str: str) -> datetime:
+        """Parse a date
+
+        Args:
+            date_str (str): the date string to parse
+
+        Raises:
+            ValueError: the date doesn't match the format
+
+        Returns:
+            datetime: the timezone aware datetime
+        """
 
+        try:
+            return self._dates[date_str]
+        except KeyError:
+            pass
+
+        dt = self._slice(date_str)
+        if dt is None:
+            dt = datetime.strptime(date_str, self.fmt)
+        if not is_aware(dt):
+            dt = make_aware(dt)
+
+        if len(self._dates) < self.max_size:
+            self._dates[date_str] = dt
+        return dt
+
+
+@lru_cache(maxsize=None)
+def date_parser(fmt: str) -> Callable[[str], datetime]:
+    """Get the parser for a date format, the parser is shared by the import runs of the
+    process so the parsed dates are reused
+
+    Args:
+        fmt (str): the strptime date format
+
+    Returns:
+        Callable[[str], datetime]: the date parser
+    """
+
+    return DateParser(fmt)
+
+
+def parse_date(date_str: str, fmt: str = None) -> datetime:
+    """Parse a date from the import file
+
+    Args:
+        date_str (str): the date string to parse
+        fmt (str, optional): the date format, loaded from the configuration if not set
+
+    Raises:
+        ValueError: the date doesn't match the format
+
+    Returns:
+        datetime: the timezone aware datetime
+    """
 
-def parse_date(date_str: str) -> datetime:
-    from .config import CAT_CSV, CSV_DATE_FMT, Config
+    if fmt is None:
+        from .config import CAT_CSV, CSV_DATE_FMT, Config
 
-    setting = Config()
-    setting.get(CAT_CSV, CSV_DATE_FMT)
-    dt = datetime.strptime(date_str, setting.value)
-    if not is_aware(dt):
-        dt = make_aware(dt)
+        setting = Config()
+        setting.get(CAT_CSV, CSV_DATE_FMT)
+        fmt = setting.value
 
-    return dt
+    return date_parser(fmt)(date_str)
@@ -0,0 +1,260 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, List, Set, Tuple
+from uuid import uuid4
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_save
+from employee.models import Employee, EmployeeImport
+from organization.models import BusinessUnit, Location
+
+from .stats import Stats
+
+logger = logging.getLogger("ftp_import.tree")
+
+#: The MPTT models that are written by an import
+TREE_MODELS = (EmployeeImport, Employee, BusinessUnit, Location)
+#: The number of primary keys in each query of a rebuild
+BATCH_SIZE = 500
+
+
+@contextmanager
+def disabled_tree_updates(models: tuple = TREE_MODELS):
+    """
+    Disable the MPTT tree updates of the models in the current thread, the trees need
+    to be rebuilt once the context exits.
+
+    :param models: The MPTT models to disable the updates of, defaults to TREE_MODELS
+    :type models: tuple, optional
+    """
+
+    with ExitStack() as stack:
+        for model in models:
+            stack.enter_context(model._tree_manager.disable_mptt_updates())
+        yield
+
+
+class TreeChanges:
+    """
+    The nodes of the MPTT models that were inserted or moved while the tree updates are
+    deferred, and the trees that the moved nodes were taken out of. A node is moved when
+    its parent or one of the fields that order its siblings has changed since it was
+    loaded.
+    """
+
+    def __init__(self, models: tuple) -> None:
+        #: The primary keys of the inserted and moved nodes of each model
+        self.nodes: Dict[Any, Set[int]] = {model: set() for model in models}
+        #: The trees that the moved nodes of each model were in
+        self.trees: Dict[Any, Set[int]] = {model: set() for model in models}
+
+    def track(self, sender, instance, created: bool, **kwargs) -> None:
+        """The post_save receiver that records the node if it was inserted or moved"""
+
+        opts = sender._mptt_meta
+        if not created:
+            # the cached fields aren't updated by saves while the updates are disabled
+            cached = instance._mptt_cached_fields
+            if all(
+                v == opts.get_raw_field_value(instance, f) for f, v in cached.items()
+            ):
+                return
+            self.trees[sender].add(getattr(instance, opts.tree_id_attr))
+        self.nodes[sender].add(instance.pk)
+
+
+@contextmanager
+def deferred_tree_updates(models: tuple = TREE_MODELS):
+    """
+    Disable the MPTT tree updates of the models for the duration of the context, the
+    trees that nodes were inserted into, moved into or moved out of are rebuilt from the
+    parent links once the context exits and then checked.
+
+    Every insert or re-parent of a node otherwise shifts the tree fields of the nodes
+    after it, a file with many new employees or manager changes becomes a single
+    rebuild per changed tree instead of thousands of incremental shifts. The tree fields
+    are not valid until the rebuild, nothing that reads the trees may run in the context.
+
+    The updates are only disabled for the current thread, the nodes are recorded by
+    post_save so they need to be saved by this thread. The rows saved by the import
+    workers are never inserted or moved, see EmployeeForm.independent.
+
+    :param models: The MPTT models to defer, defaults to TREE_MODELS
+    :type models: tuple, optional
+    """
+
+    changes = TreeChanges(models)
+    uid = uuid4().hex
+
+    for model in models:
+        post_save.connect(changes.track, sender=model, weak=False, dispatch_uid=uid)
+    try:
+        with disabled_tree_updates(models):
+            yield changes
+    finally:
+        for model in models:
+            post_save.disconnect(sender=model, dispatch_uid=uid)
+        # the trees are rebuilt even if the import failed, the committed batches of
+        # the file need them
+        for model in models:
+            if changes.nodes[model]:
+                rebuild(model, changes.nodes[model], changes.trees[model])
+
+
+def _chunks(items, size: int = BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def rebuild(model, nodes: Set[int], trees: Set[int] = frozenset()) -> List[int]:
+    """
+    Rebuild the trees of the model that the nodes are in, and the trees that they were
+    moved out of, with partial_rebuild the same way as TreeManager.delay_mptt_updates.
+
+    The nodes still have the tree id of the tree they were in, or of the cached parent
+    they were inserted under. The root of each node is found from the parent links and
+    the node and its descendants are moved to the tree of that root first. Nodes that
+    became roots start a new tree.
+
+    Nodes that aren't reachable from a root, such as managers that report to each other,
+    can't be placed by the rebuild and are reported as errors together with the nodes
+    that are inconsistent with their parent after the rebuild.
+
+    :param model: The MPTT model
+    :type model: django.db.models.Model
+    :param nodes: The primary keys of the inserted and moved nodes
+    :type nodes: Set[int]
+    :param trees: The tree ids that the moved nodes were in, defaults to none
+    :type trees: Set[int], optional
+    :return: The primary keys of the nodes that are not consistent with the tree
+    :rtype: List[int]
+    """
+
+    opts = model._mptt_meta
+    manager = model._tree_manager
+    parent_id = model._meta.get_field(opts.parent_attr).attname
+    tree_id = opts.tree_id_attr
+    trees = set(trees)
+
+    with Stats.phase("save"), transaction.atomic():
+        # the parent and tree of the nodes and all of their ancestors
+        links: Dict[int, Tuple[int, int]] = {}
+        pending = set(nodes)
+        while pending:
+            found = manager.only(parent_id, tree_id).in_bulk(pending)
+            for pk, obj in found.items():
+                links[pk] = (getattr(obj, parent_id), getattr(obj, tree_id))
+            pending = {p for p, _ in (links[pk] for pk in found)} - set(links)
+            pending.discard(None)
+
+        def root(pk):
+            seen = set()
+            while pk in links and pk not in seen:
+                seen.add(pk)
+                if links[pk][0] is None:
+                    return pk
+                pk = links[pk][0]
+            return None
+
+        next_tree = (manager.aggregate(m=Max(tree_id))["m"] or 0) + 1
+        root_trees: Dict[int, int] = {}
+        target: Dict[int, int] = {}
+        invalid: Set[int] = set()
+        for pk in nodes:
+            if pk not in links:
+                # deleted since it was saved
+                continue
+            top = root(pk)
+            if top is None:
+                invalid.add(pk)
+                continue
+            if top not in root_trees:
+                if top in nodes:
+                    root_trees[top] = next_tree
+                    next_tree += 1
+                else:
+                    root_trees[top] = links[top][1]
+            target[pk] = root_trees[top]
+        trees.update(root_trees.values())
+
+        # move the nodes and their descendants to the tree of their root, the
+        # descendants of a node that moved to another tree still have the old tree id
+        pending = {pk: t for pk, t in target.items() if links[pk][1] != t}
+        moved: Set[int] = set()
+        while pending:
+            moved.update(pending)
+            by_tree: Dict[int, List[int]] = {}
+            for pk, t in pending.items():
+                by_tree.setdefault(t, []).append(pk)
+            for t, pks in by_tree.items():
+                for chunk in _chunks(pks):
+                    manager.filter(pk__in=chunk).update(**{tree_id: t})
+            children = {}
+            for chunk in _chunks(pending):
+                rows = manager.filter(**{f"{parent_id}__in": chunk})
+                for pk, parent in rows.values_list("pk", parent_id):
+                    if pk not in moved:
+                        children[pk] = target.get(pk, pending[parent])
+            pending = children
+
+        for t in sorted(trees):
+            try:
+                manager.partial_rebuild(t)
+            except RuntimeError:
+                logger.warning(f"Tree {t} of {model.__name__} has more than one root")
+                manager.rebuild()
+                break
+        invalid.update(check_tree(model, trees))
+
+    invalid = sorted(invalid)
+    logger.info(f"Rebuilt {len(trees)} {model.__name__} trees")
+    if invalid:
+        logger.error(
+            f"{len(invalid)} {model.__name__} nodes are not consistent with their "
+            f"parent after the rebuild: {invalid[:20]}"
+        )
+        Stats.errors.append(
+            f"The {model.__name__} tree is inconsistent for {len(invalid)} records, "
+            "check for circular parent references"
+        )
+    return invalid
+
+
+def check_tree(model, trees: Set[int] = None) -> List[int]:
+    """
+    Find the nodes whose tree fields don't place them within their parent, or roots
+    that don't start a tree.
+
+    :param model: The MPTT model
+    :type model: django.db.models.Model
+    :param trees: Only check the nodes of these tree ids, defaults to all trees
+    :type trees: Set[int], optional
+    :return: The primary keys of the inconsistent nodes
+    :rtype: List[int]
+    """
+
+    opts = model._mptt_meta
+    parent = opts.parent_attr
+    left, right = opts.left_attr, opts.right_attr
+    tree_id, level = opts.tree_id_attr, opts.level_attr
+    nodes = model._tree_manager.all()
+    if trees is not None:
+        nodes = nodes.filter(**{f"{tree_id}__in": list(trees)})
+
+    children = nodes.filter(**{f"{parent}__isnull": False}).exclude(
+        **{
+            f"{left}__gt": F(f"{parent}__{left}"),
+            f"{right}__lt": F(f"{parent}__{right}"),
+            tree_id: F(f"{parent}__{tree_id}"),
+            level: F(f"{parent}__{level}") + 1,
+        }
+    )
+    roots = nodes.filter(**{f"{parent}__isnull": True}).exclude(**{left: 1, level: 0})
+    invalid: Set[int] = set(children.values_list("pk", flat=True))
+    invalid.update(roots.values_list("pk", flat=True))
+    return sorted(invalid)
@@ -0,0 +1,32 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Show the changes that importing a csv file would make, without saving them"
+    requires_migrations_checks = True
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="the csv file to plan the import of")
+        parser.add_argument(
+            "--summary", action="store_true", help="only output the change counts"
+        )
+
+    def handle(self, *args, **kwargs):
+        from ftp_import.csv import CsvImport
+
+        with open(kwargs["file"], "rb") as fh:
+            # the reader is picked by the extension of the file
+            name = os.path.basename(kwargs["file"])
+            diff = CsvImport(fh, dry_run=True, name=name).diff
+
+        if kwargs["summary"]:
+            self.stdout.write(str(diff))
+        else:
+            self.stdout.write(json.dumps(diff.as_dict(), indent=2))
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.12 on 2022-06-24 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ftp_import", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filetrack",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="filetrack",
+            name="line",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="filetrack",
+            name="status",
+            field=models.CharField(
+                choices=[("running", "Running"), ("complete", "Complete")],
+                default="complete",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.12 on 2022-06-27 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ftp_import", "0002_filetrack_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("time_start", models.DateTimeField()),
+                ("time_end", models.DateTimeField(blank=True, null=True)),
+                ("rows_processed", models.IntegerField(default=0)),
+                ("rows_imported", models.IntegerField(default=0)),
+                ("rows_new", models.IntegerField(default=0)),
+                ("rows_changed", models.IntegerField(default=0)),
+                ("rows_skipped", models.IntegerField(default=0)),
+                ("errors", models.IntegerField(default=0)),
+                ("warnings", models.IntegerField(default=0)),
+                ("queries", models.IntegerField(default=0)),
+                ("_timings", models.TextField(blank=True, default="{}")),
+            ],
+            options={
+                "ordering": ["-time_start"],
+            },
+        ),
+    ]
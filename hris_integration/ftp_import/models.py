@@ -1,11 +1,164 @@
 # Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import json
+import logging
+
+from datetime import datetime, timezone
+from typing import List
 from django.db import models
+from django.utils.translation import gettext_lazy as _t
+
+logger = logging.getLogger("ftp_import.FileTrack")
 
 
 class FileTrack(models.Model):
-    """Table to track which files have been imported already"""
+    """
+    Table to track which files have been imported already. Files are tracked from the
+    start of their import, the line of the last committed row is checkpointed so that
+    an import that is interrupted resumes after it on the next run.
+    """
+
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETE = "complete"
+
+    status_choices: List[tuple] = [
+        (STATUS_RUNNING, _t("Running")),
+        (STATUS_COMPLETE, _t("Complete")),
+    ]
 
     #: The name of the imported file.
     name: str = models.CharField(max_length=255, unique=True)
+    #: The import status of the file.
+    status: str = models.CharField(
+        max_length=16, choices=status_choices, default=STATUS_COMPLETE
+    )
+    #: The line of the last row of the file that has been committed.
+    line: int = models.IntegerField(default=0)
+    #: The sha256 hash of the file content.
+    content_hash: str = models.CharField(max_length=64, blank=True, null=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.status})"
+
+    @classmethod
+    def start(cls, name: str, content_hash: str) -> "FileTrack":
+        """
+        Start or resume the import of a file. An interrupted import is resumed from its
+        checkpoint unless the content of the file has changed.
+
+        :param name: The name of the file
+        :type name: str
+        :param content_hash: The sha256 hash of the file content
+        :type content_hash: str
+        :return: The tracking object of the file
+        :rtype: FileTrack
+        """
+
+        track, created = cls.objects.get_or_create(
+            name=name,
+            defaults={"status": cls.STATUS_RUNNING, "content_hash": content_hash},
+        )
+        if created:
+            return track
+
+        if track.content_hash != content_hash:
+            logger.warning(f"{name} has changed, importing from the start")
+            track.line = 0
+            track.content_hash = content_hash
+        else:
+            logger.info(f"Resuming the import of {name} after line {track.line}")
+
+        track.status = cls.STATUS_RUNNING
+        track.save()
+        return track
+
+    def checkpoint(self, line: int) -> None:
+        """
+        Record the line of the last row that has been saved. This should be called in
+        the transaction that the rows are committed in.
+
+        :param line: The line number of the last saved row
+        :type line: int
+        """
+
+        self.line = line
+        FileTrack.objects.filter(pk=self.pk).update(line=line)
+
+    def complete(self) -> None:
+        """Mark the file as imported"""
+
+        self.status = self.STATUS_COMPLETE
+        self.save()
+
+
+class ImportRun(models.Model):
+    """
+    The metrics of the import of a file, see ftp_import.helpers.stats.Metrics. The
+    counters are stored as fields so that runs can be compared, the phase times and the
+    row latency histogram are stored as JSON.
+    """
+
+    #: The name of the imported file.
+    name: str = models.CharField(max_length=255)
+    #: When the import started.
+    time_start: datetime = models.DateTimeField()
+    #: When the import finished.
+    time_end: datetime = models.DateTimeField(null=True, blank=True)
+    rows_processed: int = models.IntegerField(default=0)
+    rows_imported: int = models.IntegerField(default=0)
+    rows_new: int = models.IntegerField(default=0)
+    rows_changed: int = models.IntegerField(default=0)
+    rows_skipped: int = models.IntegerField(default=0)
+    errors: int = models.IntegerField(default=0)
+    warnings: int = models.IntegerField(default=0)
+    #: The number of queries that were run.
+    queries: int = models.IntegerField(default=0)
+    #: The phase times, phase query counts and the row latency histogram.
+    _timings: str = models.TextField(blank=True, default="{}")
+
+    class Meta:
+        ordering = ["-time_start"]
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.time_start})"
+
+    @property
+    def timings(self) -> dict:
+        """The phase times, phase query counts and the row latency histogram"""
+
+        return json.loads(self._timings or "{}")
+
+    @classmethod
+    def record(cls, name: str, metrics) -> "ImportRun":
+        """
+        Save the metrics of the import of a file.
+
+        :param name: The name of the file
+        :type name: str
+        :param metrics: The metrics of the import
+        :type metrics: ftp_import.helpers.stats.Metrics
+        :return: The saved run
+        :rtype: ImportRun
+        """
+
+        def when(sec):
+            return datetime.fromtimestamp(sec, timezone.utc) if sec else None
+
+        data = metrics.collect()
+        return cls.objects.create(
+            name=name,
+            time_start=when(metrics.time_start),
+            time_end=when(metrics.time_end),
+            rows_processed=metrics.rows_processed,
+            rows_imported=metrics.rows_imported,
+            rows_new=metrics.rows_new,
+            rows_changed=metrics.rows_changed,
+            rows_skipped=metrics.rows_skipped,
+            errors=len(metrics.errors),
+            warnings=len(metrics.warnings),
+            queries=metrics.queries,
+            _timings=json.dumps(
+                {k: data[k] for k in ("phases", "phase_queries", "row_latency")}
+            ),
+        )
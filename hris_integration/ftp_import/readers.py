@@ -0,0 +1,312 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import csv
+import gzip
+import io
+import json
+import logging
+import re
+import string
+
+from typing import Iterator, List, Tuple
+
+from .helpers import config
+from .helpers.text_utils import decode
+from .exceptions import ConfigurationError
+
+logger = logging.getLogger("ftp_import.readers")
+
+#: The first bytes of a gzip compressed file
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def text_stream(file_handle) -> io.TextIOBase:
+    """
+    Wrap binary file handles, such as the temporary file that the sftp download is
+    written to, so that they can be read as text. Gzip compressed files are decompressed
+    as they are read.
+
+    :param file_handle: The open file handle
+    :type file_handle: file object
+    :return: A text file handle
+    :rtype: io.TextIOBase
+    """
+
+    if isinstance(file_handle, io.TextIOBase):
+        return file_handle
+
+    # the readers read from the start of the file, whatever was read already
+    start = file_handle.tell()
+    file_handle.seek(0)
+    if file_handle.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        logger.debug("Decompressing gzip file")
+        file_handle.seek(0)
+        file_handle = gzip.GzipFile(fileobj=file_handle, mode="rb")
+    else:
+        file_handle.seek(start)
+    return io.TextIOWrapper(file_handle, encoding="utf-8", newline="")
+
+
+def release_stream(stream: io.TextIOBase, file_handle) -> None:
+    """
+    Release the stream returned by text_stream without closing the callers file handle.
+
+    :param stream: The text stream
+    :type stream: io.TextIOBase
+    :param file_handle: The file handle that was passed to text_stream
+    :type file_handle: file object
+    """
+
+    if stream is file_handle:
+        return
+    raw = stream.detach()
+    if raw is not file_handle:
+        # the GzipFile doesn't close the file object that it reads from
+        raw.close()
+
+
+class Reader:
+    """
+    Read the header and rows of an import file. A reader is created for each file, the
+    header is read first and the rows are then streamed from the same text file handle
+    so that only the current row is held in memory.
+
+    The values of each row are returned in the same order as the header keys.
+    """
+
+    #: The name that the format is configured with
+    name = None
+
+    def __init__(self, snapshot: config.ConfigSnapshot) -> None:
+        self.config = snapshot
+        #: The number of lines before the first row
+        self.header_lines = 0
+
+    def headers(self, file_handle: io.TextIOBase) -> List[str]:
+        """
+        Read the header keys from the start of the file.
+
+        :param file_handle: The text file handle
+        :type file_handle: io.TextIOBase
+        :return: The header keys in column order
+        :rtype: List[str]
+        """
+
+        raise NotImplementedError
+
+    def rows(self, file_handle: io.TextIOBase) -> Iterator[Tuple[int, List[str]]]:
+        """
+        Read the rows following the header.
+
+        :param file_handle: The text file handle positioned after the header
+        :type file_handle: io.TextIOBase
+        :yield: The line number that the row starts on and its values, None if the row
+            can't be parsed
+        :rtype: Iterator[Tuple[int, List[str]]]
+        """
+
+        raise NotImplementedError
+
+
+class CsvReader(Reader):
+    """
+    Delimited text read with the csv module using the configured dialect, quoted fields
+    may contain the separator or span multiple lines. Lines before the header that don't
+    start with a letter, digit or quote are discarded.
+    """
+
+    name = "csv"
+
+    def __init__(self, snapshot: config.ConfigSnapshot) -> None:
+        super().__init__(snapshot)
+        self.dialect = self.get_dialect(snapshot)
+
+    @staticmethod
+    def get_dialect(snapshot: config.ConfigSnapshot) -> csv.Dialect:
+        """Build the csv dialect from the configuration"""
+
+        quote = snapshot(config.CAT_CSV, config.CSV_QUOTE_CHAR) or None
+        attrs = {
+            "delimiter": snapshot(config.CAT_CSV, config.CSV_FIELD_SEP),
+            "quotechar": quote,
+            "quoting": csv.QUOTE_MINIMAL if quote else csv.QUOTE_NONE,
+            "escapechar": snapshot(config.CAT_CSV, config.CSV_ESCAPE_CHAR) or None,
+            "doublequote": not snapshot(config.CAT_CSV, config.CSV_ESCAPE_CHAR),
+        }
+        return type("ImportDialect", (csv.excel,), attrs)
+
+    def headers(self, file_handle: io.TextIOBase) -> List[str]:
+        valid = string.ascii_letters + string.digits + "'" + '"'
+        sep = self.dialect.delimiter
+
+        file_handle.seek(0)
+        headers = decode(file_handle.readline())
+        self.header_lines = 1
+        logger.debug(f"parsing potential header row {headers[0:60]}")
+
+        while headers[0] not in valid:
+            logger.debug(
+                "Discarding starting line(s) as it doesn't start with a valid character"
+            )
+            logger.debug(f"line: {headers}")
+            if headers[0] == sep:
+                logger.error(
+                    "The csv file doesn't seem to have a valid header row or we discarded it"
+                )
+                raise IndexError(
+                    "The csv file does not seem to have a valid header row"
+                )
+            headers = decode(file_handle.readline())
+            self.header_lines += 1
+            logger.debug(f"parsing potential header row {headers[0:60]}")
+
+        return next(csv.reader([headers], dialect=self.dialect))
+
+    def rows(self, file_handle: io.TextIOBase) -> Iterator[Tuple[int, List[str]]]:
+        reader = csv.reader(file_handle, dialect=self.dialect)
+        last_line = 0
+
+        for vals in reader:
+            # a quoted field may span lines, the row starts after the previous one
+            line = self.header_lines + last_line + 1
+            last_line = reader.line_num
+            yield line, vals
+
+
+class FixedWidthReader(Reader):
+    """
+    Fixed width text, the header and every row are split at the configured column
+    widths and the values are stripped of the padding. A row that ends before its last
+    column starts can't be parsed.
+    """
+
+    name = "fixed"
+
+    def __init__(self, snapshot: config.ConfigSnapshot) -> None:
+        super().__init__(snapshot)
+        widths = snapshot(config.CAT_CSV, config.CSV_FIXED_WIDTHS) or ""
+        try:
+            widths = [int(w) for w in widths.split(",") if w.strip()]
+        except ValueError as e:
+            raise ConfigurationError(f"Invalid fixed width columns '{widths}'") from e
+        if not widths:
+            raise ConfigurationError(f"{config.CSV_FIXED_WIDTHS} is not configured")
+
+        self.slices = []
+        start = 0
+        for width in widths:
+            self.slices.append(slice(start, start + width))
+            start += width
+
+    def split(self, line: str) -> List[str]:
+        line = line.rstrip("\r\n")
+        if len(line) <= self.slices[-1].start:
+            return None
+        return [line[s].strip() for s in self.slices]
+
+    def headers(self, file_handle: io.TextIOBase) -> List[str]:
+        file_handle.seek(0)
+        self.header_lines = 1
+        headers = self.split(decode(file_handle.readline()))
+        if headers is None:
+            raise IndexError("The file does not seem to have a valid header row")
+        return headers
+
+    def rows(self, file_handle: io.TextIOBase) -> Iterator[Tuple[int, List[str]]]:
+        for x, line in enumerate(file_handle, self.header_lines + 1):
+            yield x, self.split(line) if line.strip() else []
+
+
+class JsonLinesReader(Reader):
+    """
+    JSON lines, one object per line. The keys of the first object are used as the
+    header, the first object is then read as a row like the others. Keys that are
+    missing from a row are read as empty values.
+    """
+
+    name = "jsonl"
+
+    def headers(self, file_handle: io.TextIOBase) -> List[str]:
+        file_handle.seek(0)
+        self.header_lines = 0
+        for line in file_handle:
+            if line.strip():
+                break
+            self.header_lines += 1
+        else:
+            raise IndexError("The file does not contain any rows")
+
+        self.keys = list(json.loads(line).keys())
+        # read the first object again as a row
+        file_handle.seek(0)
+        for _ in range(self.header_lines):
+            file_handle.readline()
+        return self.keys
+
+    def rows(self, file_handle: io.TextIOBase) -> Iterator[Tuple[int, List[str]]]:
+        for x, line in enumerate(file_handle, self.header_lines + 1):
+            if not line.strip():
+                yield x, []
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                logger.debug(f"Invalid JSON on line {x}")
+                yield x, None
+                continue
+            if not isinstance(data, dict):
+                yield x, None
+                continue
+            yield x, [self.value(data.get(k)) for k in self.keys]
+
+    @staticmethod
+    def value(value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return str(value).lower()
+        return str(value)
+
+
+#: The readers by the name that they are configured with
+READERS = {r.name: r for r in (CsvReader, FixedWidthReader, JsonLinesReader)}
+
+
+def get_reader(snapshot: config.ConfigSnapshot, name: str = None) -> Reader:
+    """
+    Get the reader for a file. The format is taken from the first file format pattern
+    that matches the file name, then from the "format" group of the file name
+    expression, csv is used if neither selects a format. Gzip compressed files are
+    detected from their content so they don't need a format of their own.
+
+    :param snapshot: The configuration of the import run
+    :type snapshot: config.ConfigSnapshot
+    :param name: The name of the file, defaults to None
+    :type name: str, optional
+    :raises ConfigurationError: The selected format isn't known
+    :return: The reader for the file
+    :rtype: Reader
+    """
+
+    fmt = None
+    if name:
+        formats = snapshot(config.CAT_CSV, config.CSV_FILE_FORMATS) or ""
+        for pair in formats.split(";"):
+            pattern, _, value = pair.strip().rpartition("=")
+            if pattern and re.search(pattern, name):
+                fmt = value.strip()
+                break
+
+        if fmt is None:
+            expr = snapshot(config.CAT_SERVER, config.SERVER_FILE_EXP)
+            match = re.search(expr, name) if expr else None
+            if match is not None:
+                fmt = match.groupdict().get("format")
+
+    fmt = (fmt or CsvReader.name).lower()
+    if fmt not in READERS:
+        raise ConfigurationError(f"Unknown file format '{fmt}' for {name}")
+
+    logger.debug(f"Reading {name} as {fmt}")
+    return READERS[fmt](snapshot)
@@ -2,10 +2,11 @@
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
+import re
 
-from pyad import ADGroup
-from organization.models import GroupMapping
-from common import validators
+from typing import Iterable, List, Tuple
+from organization.group_names import GroupNames
+from organization.group_rules import GroupRules
 
 logger = logging.getLogger("organization.GroupManager")
 
@@ -35,6 +36,7 @@ class GroupManager:
         job: "organization.models.JobRole",
         bu: "organization.models.BusinessUnit",
         location: "organization.models.Location",
+        rules: GroupRules = None,
     ) -> None:
         """
         Setup the GroupManager class
@@ -45,107 +47,28 @@ class GroupManager:
         :type bu: organization.models.BusinessUnit
         :param location: The location that the employee is located in
         :type location: organization.models.Location
+        :param rules: The compiled group mappings, defaults to the rules of the process
+        :type rules: GroupRules, optional
         """
 
         self.add_groups = []
         self.remove_groups = []
         self.groups_leave = []
-        all_groups = GroupMapping.objects.all()
+        if rules is None:
+            rules = GroupRules.get()
 
-        for group in all_groups:
-            if group.all:
-                self._add(group.dn)
-
-        self.get_jobs(all_groups, job)
-        self.get_business_units(all_groups, bu)
-        self.get_locations(all_groups, location)
-        self.parse_config_groups()
-
-    def get_jobs(
-        self, groups: "django.db.models.QuerySet", job: "organization.models.JobRole"
-    ) -> None:
-        """
-        Parse the groups associated or explicitly not associated with the job role.
-
-        :param groups: The queryset of groups to check against
-        :type groups: django.db.models.QuerySet
-        :param job: The job role to parse
-        :type job: organization.models.JobRole
-        """
-
-        for group in groups:
-            if self.__iter_group(group.jobs, job) and group.jobs_not == False:
-                self._add(group.dn)
-            elif self.__iter_group(group.jobs, job) and group.jobs_not == True:
-                self._remove(group.dn)
-            elif not self.__iter_group(group.jobs, job) and group.jobs_not == True:
-                self._add(group.dn)
-
-    def get_business_units(
-        self,
-        groups: "django.db.models.QuerySet",
-        business_unit: "organization.models.BusinessUnit",
-    ) -> None:
-        """
-        Parse the groups associated or explicitly not associated with the business unit.
-
-        :param groups: The queryset of groups to check against
-        :type groups: django.db.models.QuerySet
-        :param business_unit: The business unit to parse
-        :type business_unit: organization.models.BusinessUnit
-        """
-
-        for group in groups:
-            if (
-                self.__iter_group(group.business_unit, business_unit)
-                and group.business_unit_not == False
-            ):
-                self._add(group.dn)
-            elif (
-                self.__iter_group(group.business_unit, business_unit)
-                and group.business_unit_not == True
-            ):
-                self._remove(group.dn)
-            elif (
-                not self.__iter_group(group.business_unit, business_unit)
-                and group.business_unit_not == True
-            ):
-                self._add(group.dn)
-
-    def get_locations(
-        self,
-        groups: "django.db.models.QuerySet",
-        location: "organization.models.Location",
-    ) -> None:
-        """
-        Parse the groups associated or explicitly not associated with the location.
-
-        :param groups: The queryset of groups to check against
-        :type groups: django.db.models.QuerySet
-        :param location: The location to parse
-        :type location: organization.models.Location
-        """
+        for group, add in rules.actions(job, bu, location):
+            if add:
+                self._add(group)
+            else:
+                self._remove(group)
 
-        for group in groups:
-            if (
-                self.__iter_group(group.location, location)
-                and group.location_not == False
-            ):
-                self._add(group.dn)
-            elif (
-                self.__iter_group(group.location, location)
-                and group.location_not == True
-            ):
-                self._remove(group.dn)
-            elif (
-                not self.__iter_group(group.location, location)
-                and group.location_not == True
-            ):
-                self._add(group.dn)
+        self.groups_leave = list(rules.groups_leave)
 
     def add_application(self, app: "user_applications.models.Software") -> None:
         """
-        If the application has a group mapping, add the group to the add_groups list
+        If the application has a group mapping, add the group to the add_groups list.
+        The mapping may be a DN, which is added as it is configured, or a group name.
 
         :param app: The Software instance
         :type app: user_applications.models.Software
@@ -153,7 +76,11 @@ class GroupManager:
 
         if app.mapped_group:
             logger.debug(f"Adding application {app.name}")
-            self._add(app.mapped_group)
+            if "=" in app.mapped_group:
+                self._add(app.mapped_group)
+                return
+            for group in self.parse_group(app.mapped_group):
+                self._add(group)
 
     def _add(self, group) -> None:
         """
@@ -190,20 +117,42 @@ class GroupManager:
     def parse_config_groups(self) -> None:
         """Parse config groups by dn or cn"""
 
+        self.groups_leave = self.config_groups()
+
+    @classmethod
+    def config_groups(cls) -> list:
+        """
+        Parse the leave groups from the configuration.
+
+        :return: The distinguished names of the leave groups
+        :rtype: list
+        """
+
+        return cls.parse_group(cls.leave_setting())
+
+    @staticmethod
+    def leave_setting() -> str:
+        """
+        The unparsed leave groups from the configuration.
+
+        :return: The configured groups
+        :rtype: str
+        """
+
         from organization.helpers.config import Config, GROUPS_CAT, GROUPS_LEAVE_GROUP
 
         config = Config()
-        self.groups_leave = self.parse_group(config(GROUPS_CAT, GROUPS_LEAVE_GROUP))
+        return config(GROUPS_CAT, GROUPS_LEAVE_GROUP)
 
-    def parse_group(self, groups: str) -> list:
+    @staticmethod
+    def split_groups(groups: str) -> List[Tuple[str, bool]]:
         """
-        Parse a string of groups into a list of groups and attempt to resolve non-dn
-        strings to valid AD Groups.
+        Split a string of groups into the DNs and the bare group names.
 
         :param groups: String of groups to parse
         :type groups: str
-        :return: The distinguished names for each parsed group
-        :rtype: list
+        :return: Each group and whether it is a bare group name
+        :rtype: List[Tuple[str, bool]]
         """
 
         output = []
@@ -211,23 +160,18 @@ class GroupManager:
         if not groups:
             return []
 
-        logger.debug(f"parsing the following groups: {groups}")
-
-        for group in groups.strip("'\"").split(","):
+        # escaped commas are part of the DN
+        for group in re.split(r"(?<!\\),", groups.strip("'\"")):
             if group and len(group.split("=")) == 1:
                 if dn != []:
-                    output.append(",".join(dn))
+                    output.append((",".join(dn), False))
                     dn = []
-                try:
-                    output.append(ADGroup.from_cn(group).dn)
-                except Exception as e:
-                    logger.warning(f"{group} doesn't appear to be valid")
-                    logger.debug(f"Caught exception while retrieving group: {e}")
+                output.append((group, True))
 
             else:
                 if group[:3].lower() == "cn=":
                     if dn != []:
-                        output.append(",".join(dn))
+                        output.append((",".join(dn), False))
                         dn = []
                     dn.append(group)
                 elif group:
@@ -235,32 +179,47 @@ class GroupManager:
 
         # Ensure that we're not leaving a DN out of the output
         if dn != []:
-            output.append(",".join(dn))
+            output.append((",".join(dn), False))
 
-        # Check that we are only returning valid DN's
-        for x in range(0, len(output)):
-            try:
-                validators.DnValidator(output[x])
-            except validators.ValidationError:
-                logger.warn(f"Got invalid or incomplete DN: {output[x]}")
-                output.pop(x)
+        return output
+
+    @classmethod
+    def parse_group(cls, groups: str) -> list:
+        """
+        Parse a string of groups into a list of groups and attempt to resolve non-dn
+        strings to valid AD Groups. The group names are resolved through GroupNames,
+        so each name is only looked up in AD once for all employees.
+
+        :param groups: String of groups to parse
+        :type groups: str
+        :return: The distinguished names for each parsed group
+        :rtype: list
+        """
+
+        output = []
+        for group, is_name in cls.split_groups(groups):
+            if is_name:
+                group = GroupNames.resolve(group)
+                if group is None:
+                    continue
+            # Check that we are only returning valid DN's
+            if GroupNames.is_valid_dn(group):
+                output.append(group)
 
         return output
 
-    @staticmethod
-    def __iter_group(set: "django.db.models.QuerySet", value: str) -> bool:
+    @classmethod
+    def warm(cls, groups: Iterable[str]) -> None:
         """
-        Helper function to check if a value is in a django QuerySet.
-
-        :param set: The QuerySet to check
-        :type set: django.db.models.QuerySet
-        :param value: the value to check for
-        :type value: str
-        :return: if the value exists in the set
-        :rtype: bool
+        Resolve the group names of many strings of groups with a single directory
+        query, such as the configured groups before the groups of a batch of employees
+        are parsed.
+
+        :param groups: The strings of groups
+        :type groups: Iterable[str]
         """
 
-        for item in set.all():
-            if item == value:
-                return True
-        return False
+        names = []
+        for value in groups:
+            names.extend(g for g, is_name in cls.split_groups(value) if is_name)
+        GroupNames.warm(names)
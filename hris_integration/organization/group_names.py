@@ -0,0 +1,161 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+import threading
+
+from time import monotonic
+from typing import Dict, Iterable, Optional, Tuple
+from django.core.exceptions import ValidationError
+from pyad import ADQuery
+from common import validators
+
+logger = logging.getLogger("organization.group_names")
+
+#: The seconds that the DN of a group name is kept for
+RESOLVE_TTL = 3600
+#: The seconds that a group name that couldn't be resolved is kept for
+NEGATIVE_TTL = 300
+
+
+class GroupNames:
+    """
+    A process wide cache of the distinguished names of AD groups by their common name,
+    so that the group names in the configuration are looked up in the directory once
+    every RESOLVE_TTL seconds instead of once per employee. Names that don't match
+    exactly one group are cached as None for NEGATIVE_TTL seconds.
+
+    The names are looked up one at a time as they are used, warm looks up all of the
+    names that will be used with a single query.
+    """
+
+    #: The DN, or None, and the time it expires keyed by the lower case name
+    _names: Dict[str, Tuple[Optional[str], float]] = {}
+    #: If each DN string that has been checked is valid
+    _valid: Dict[str, bool] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str) -> str:
+        """The key that a name is cached by"""
+
+        return name.strip().lower()
+
+    @classmethod
+    def cached(cls, name: str) -> Tuple[bool, Optional[str]]:
+        """
+        Get the cached DN of a group name.
+
+        :param name: The common name of the group
+        :type name: str
+        :return: If the name is cached and its DN
+        :rtype: Tuple[bool, Optional[str]]
+        """
+
+        dn, expires = cls._names.get(cls.key(name), (None, 0))
+        return expires > monotonic(), dn
+
+    @classmethod
+    def store(cls, name: str, dn: Optional[str]) -> None:
+        """Cache the DN of a group name, None if the name isn't valid"""
+
+        ttl = RESOLVE_TTL if dn else NEGATIVE_TTL
+        with cls._lock:
+            cls._names[cls.key(name)] = (dn, monotonic() + ttl)
+
+    @classmethod
+    def query(cls, names: Iterable[str]) -> None:
+        """
+        Look up the DNs of the group names with one directory query and cache them.
+        Names that match no group or more than one group are cached as invalid. Nothing
+        is cached if the query fails, so the names are looked up again on their next use.
+
+        :param names: The common names of the groups
+        :type names: Iterable[str]
+        """
+
+        names = {cls.key(name): name.strip() for name in names if name.strip()}
+        if not names:
+            return
+
+        where = " or ".join(
+            "cn = '%s'" % name.replace("'", "''") for name in names.values()
+        )
+        found: Dict[str, list] = {key: [] for key in names}
+        try:
+            q = ADQuery()
+            q.execute_query(
+                attributes=["cn", "distinguishedName"],
+                where_clause=f"objectCategory = 'group' and ({where})",
+            )
+            for row in q.get_results():
+                found.setdefault(cls.key(row["cn"]), []).append(
+                    row["distinguishedName"]
+                )
+        except Exception as e:
+            logger.warning(f"Failed to look up the groups {list(names.values())}")
+            logger.debug(f"Caught exception while retrieving groups: {e}")
+            return
+
+        for key, name in names.items():
+            dns = found[key]
+            if len(dns) != 1:
+                logger.warning(f"{name} doesn't appear to be valid")
+            cls.store(name, dns[0] if len(dns) == 1 else None)
+        logger.debug(f"Looked up {len(names)} group names")
+
+    @classmethod
+    def resolve(cls, name: str) -> Optional[str]:
+        """
+        Get the DN of a group by its common name.
+
+        :param name: The common name of the group
+        :type name: str
+        :return: The DN of the group or None if there isn't exactly one group
+        :rtype: Optional[str]
+        """
+
+        hit, dn = cls.cached(name)
+        if not hit:
+            cls.query([name])
+            dn = cls.cached(name)[1]
+        return dn
+
+    @classmethod
+    def warm(cls, names: Iterable[str]) -> None:
+        """
+        Look up the group names that aren't cached with a single query.
+
+        :param names: The common names of the groups
+        :type names: Iterable[str]
+        """
+
+        cls.query([name for name in names if not cls.cached(name)[0]])
+
+    @classmethod
+    def is_valid_dn(cls, dn: str) -> bool:
+        """
+        Check that a string is a valid DN, each distinct string is only checked once.
+
+        :param dn: The DN string
+        :type dn: str
+        :return: If the DN is valid
+        :rtype: bool
+        """
+
+        if dn not in cls._valid:
+            try:
+                validators.DnValidator()(dn)
+                cls._valid[dn] = True
+            except ValidationError:
+                logger.warning(f"Got invalid or incomplete DN: {dn}")
+                cls._valid[dn] = False
+        return cls._valid[dn]
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop all of the cached names"""
+
+        with cls._lock:
+            cls._names = {}
+            cls._valid = {}
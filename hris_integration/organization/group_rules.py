@@ -0,0 +1,188 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from settings.models import Setting
+
+from .models import GroupMapping
+from .helpers.settings_fields import GROUP_CONFIG, GROUPS_CAT, GROUPS_LEAVE_GROUP
+
+logger = logging.getLogger("organization.group_rules")
+
+#: The GroupMapping fields that a mapping is matched on, in the order that they apply
+DIMENSIONS = ("jobs", "business_unit", "location")
+
+#: A group and whether it is added (True) or removed (False)
+Action = Tuple[str, bool]
+
+#: The path of the leave groups setting
+LEAVE_SETTING = Setting.FIELD_SEP.join((GROUP_CONFIG, GROUPS_CAT, GROUPS_LEAVE_GROUP))
+
+
+class GroupRules:
+    """
+    The GroupMappings compiled into an index of the groups that apply to each job,
+    business unit and location. The mappings are loaded with a fixed number of queries
+    and the groups of an employee are then found with dict lookups, instead of checking
+    every mapping against the employee.
+
+    The process wide rules returned by get are compiled on first use and dropped when a
+    GroupMapping or the leave groups setting is changed in this process.
+    """
+
+    #: The rules used by the GroupManagers of this process, see get
+    _rules: "GroupRules" = None
+
+    def __init__(self, mappings: List[GroupMapping]) -> None:
+        """
+        :param mappings: The group mappings with their jobs, business units and
+            locations prefetched
+        :type mappings: List[GroupMapping]
+        """
+
+        #: The groups that apply to all employees
+        self.all: List[str] = []
+        #: The mappings that add their group to the members of each dimension, as the
+        #: mapping index and group keyed by the primary key of the member
+        self.members: Dict[str, Dict[int, List[Tuple[int, str]]]] = {}
+        #: The mappings that remove their group from the members of each dimension and
+        #: add it to everyone else, as the mapping index, group and member keys
+        self.negated: Dict[str, List[Tuple[int, str, Set[int]]]] = {}
+        self._actions: Dict[tuple, Tuple[Action, ...]] = {}
+        self._leave_setting: str = None
+
+        for dimension in DIMENSIONS:
+            self.members[dimension] = defaultdict(list)
+            self.negated[dimension] = []
+
+        for index, mapping in enumerate(mappings):
+            if mapping.all:
+                self.all.append(mapping.dn)
+            for dimension in DIMENSIONS:
+                keys = {item.pk for item in getattr(mapping, dimension).all()}
+                if getattr(mapping, f"{dimension}_not"):
+                    self.negated[dimension].append((index, mapping.dn, keys))
+                else:
+                    for key in keys:
+                        self.members[dimension][key].append((index, mapping.dn))
+
+        logger.debug(f"Compiled {len(mappings)} group mappings")
+
+    @classmethod
+    def load(cls) -> "GroupRules":
+        """
+        Compile the rules from the database.
+
+        :return: The compiled rules
+        :rtype: GroupRules
+        """
+
+        mappings = GroupMapping.objects.prefetch_related(*DIMENSIONS)
+        return cls(list(mappings))
+
+    @classmethod
+    def get(cls) -> "GroupRules":
+        """
+        Get the rules of this process, they are compiled on first use.
+
+        :return: The compiled rules
+        :rtype: GroupRules
+        """
+
+        if cls._rules is None:
+            cls._rules = cls.load()
+        return cls._rules
+
+    @classmethod
+    def clear_cache(cls, sender, **kwargs) -> None:
+        """Signal handler to recompile the rules after a mapping is changed"""
+
+        cls._rules = None
+
+    @classmethod
+    def setting_changed(cls, sender, instance, **kwargs) -> None:
+        """Signal handler to reload the leave groups after they are changed"""
+
+        if instance.setting == LEAVE_SETTING:
+            cls._rules = None
+
+    def dimension(self, dimension: str, key: int) -> Tuple[Action, ...]:
+        """
+        The groups that the mappings of a dimension add or remove for a member, in the
+        order of the mappings.
+
+        :param dimension: The GroupMapping field
+        :type dimension: str
+        :param key: The primary key of the member, None if the employee doesn't have one
+        :type key: int
+        :return: The actions of the mappings that apply to the member
+        :rtype: Tuple[Action, ...]
+        """
+
+        actions = [(i, dn, True) for i, dn in self.members[dimension].get(key, [])]
+        for index, dn, keys in self.negated[dimension]:
+            actions.append((index, dn, key not in keys))
+        actions.sort(key=lambda action: action[0])
+        return tuple((dn, add) for _, dn, add in actions)
+
+    def actions(
+        self,
+        job: "organization.models.JobRole",
+        bu: "organization.models.BusinessUnit",
+        location: "organization.models.Location",
+    ) -> Tuple[Action, ...]:
+        """
+        The groups to add or remove for an employee in the order that they are applied,
+        the actions are kept for each combination of job, business unit and location.
+
+        :param job: The primary job of the employee
+        :type job: organization.models.JobRole
+        :param bu: The business unit that the employee belongs to
+        :type bu: organization.models.BusinessUnit
+        :param location: The location that the employee is located in
+        :type location: organization.models.Location
+        :return: The groups and whether they are added
+        :rtype: Tuple[Action, ...]
+        """
+
+        keys = tuple(getattr(item, "pk", None) for item in (job, bu, location))
+        if keys not in self._actions:
+            actions = [(dn, True) for dn in self.all]
+            for dimension, key in zip(DIMENSIONS, keys):
+                actions.extend(self.dimension(dimension, key))
+            self._actions[keys] = tuple(actions)
+        return self._actions[keys]
+
+    @property
+    def leave_setting(self) -> str:
+        """The unparsed leave groups from the configuration"""
+
+        if self._leave_setting is None:
+            from .group_manager import GroupManager
+
+            self._leave_setting = GroupManager.leave_setting() or ""
+        return self._leave_setting
+
+    @property
+    def groups_leave(self) -> List[str]:
+        """
+        The parsed leave groups from the configuration. The group names are parsed on
+        each use so that they expire with the GroupNames cache.
+        """
+
+        from .group_manager import GroupManager
+
+        return GroupManager.parse_group(self.leave_setting)
+
+
+post_save.connect(GroupRules.clear_cache, sender=GroupMapping)
+post_delete.connect(GroupRules.clear_cache, sender=GroupMapping)
+post_save.connect(GroupRules.setting_changed, sender=Setting)
+for dimension in DIMENSIONS:
+    m2m_changed.connect(
+        GroupRules.clear_cache, sender=getattr(GroupMapping, dimension).through
+    )
@@ -8,9 +8,10 @@ from django.db import models
 from hris_integration.models.encryption import FieldEncryption
 from copy import deepcopy
 from django.db.models.query import QuerySet
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.utils.translation import gettext_lazy as _t
 from string import ascii_letters, digits, capwords
+from typing import Dict
 from warnings import warn
 
 logger = logging.getLogger("settings.Models")
@@ -236,5 +237,55 @@ class WordList(models.Model):
     #: The expanded form of the word
     replace: str = models.CharField(max_length=256)
 
+    #: The expansions keyed by the source word, loaded by expansions
+    _expansions: Dict[str, str] = None
+
     def __str__(self) -> str:
         return f"{self.src} -> {self.replace}"
+
+    @classmethod
+    def expansions(cls) -> Dict[str, str]:
+        """
+        Get the expanded form of each source word. The list is loaded once per process
+        and reloaded after a word is saved or deleted.
+
+        :return: The expansions keyed by the source word
+        :rtype: Dict[str, str]
+        """
+
+        if cls._expansions is None:
+            expansions = {}
+            for src, replace in cls.objects.order_by("pk").values_list(
+                "src", "replace"
+            ):
+                # the first expansion of a word is used
+                expansions.setdefault(src, replace)
+            cls._expansions = expansions
+            logger.debug(f"Loaded {len(expansions)} word expansions")
+
+        return cls._expansions
+
+    @classmethod
+    def expand(cls, data: str) -> str:
+        """
+        Replace each word of the string with its expanded form. Words are split on white
+        space and the result is joined with single spaces.
+
+        :param data: The source string to expand
+        :type data: str
+        :return: The expanded string
+        :rtype: str
+        """
+
+        expansions = cls.expansions()
+        return " ".join(expansions.get(word, word) for word in data.split())
+
+    @classmethod
+    def clear_cache(cls, sender, **kwargs) -> None:
+        """Signal handler to reload the expansions after a word is changed"""
+
+        cls._expansions = None
+
+
+post_save.connect(WordList.clear_cache, sender=WordList)
+post_delete.connect(WordList.clear_cache, sender=WordList)
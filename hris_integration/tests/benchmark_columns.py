@@ -0,0 +1,128 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Benchmark the ColumnPlan against the per row field scans that it replaced.
+
+The rows of employee_data.csv are repeated to build the file, every row is mapped and
+each of its keys is looked up the same way the EmployeeForm does.
+
+Usage: python -m tests.benchmark_columns [rows]
+"""
+
+import csv
+import io
+import sys
+import time
+
+from itertools import cycle, islice
+from pathlib import Path
+
+from ftp_import.helpers.columns import ColumnPlan
+from ftp_import.helpers.text_utils import safe
+
+IMPORTED = {
+    "employee_number": "id",
+    "first_name": "first_name",
+    "last_name": "last_name",
+    "hire_date": "start_date",
+    "employee_status": "status",
+    "address": "street1",
+    "city": "city",
+    "province": "province",
+    "zip": "postal_code",
+    "country": "country",
+    "phone_1": "number",
+    "ll4": "location",
+    "ll7": "primary_job",
+    "reports_to": "manager",
+}
+LOOKUPS = ("id", "primary_job", "location", "manager", "number", "phone_label")
+
+
+def build_file(rows: int) -> io.StringIO:
+    source = Path(__file__).resolve().parent / "employee_data.csv"
+    with open(source) as f:
+        header, *data = list(csv.reader(f))
+
+    fh = io.StringIO()
+    writer = csv.writer(fh, lineterminator="\n")
+    writer.writerow(header)
+    for x, row in enumerate(islice(cycle(data), rows)):
+        writer.writerow([str(x + 1)] + row[1:])
+    return fh
+
+
+def build_fields(fh: io.StringIO) -> list:
+    fh.seek(0)
+    fields = []
+    for key in next(csv.reader(fh)):
+        key = safe(key)
+        fields.append(
+            {"field": key, "import": key in IMPORTED, "map_to": IMPORTED.get(key, "")}
+        )
+    return fields
+
+
+def scan(fh: io.StringIO, fields: list) -> int:
+    """The previous implementation, the field list is scanned for every row and key"""
+
+    def get_map_to(key):
+        for field in fields:
+            if field["field"] == key:
+                return field["map_to"]
+        return ""
+
+    def get_field_name(key):
+        for field in fields:
+            if field["map_to"] == key and field["import"]:
+                return field["field"]
+        return ""
+
+    count = 0
+    fh.seek(0)
+    fh.readline()
+    for vals in csv.reader(fh):
+        row = {}
+        for x in range(len(fields)):
+            if fields[x] and fields[x]["import"]:
+                row[fields[x]["field"]] = vals[x]
+        for key in LOOKUPS:
+            get_field_name(key)
+        for key in row:
+            count += bool(get_map_to(key))
+    return count
+
+
+def plan(fh: io.StringIO, fields: ColumnPlan) -> int:
+    count = 0
+    fh.seek(0)
+    fh.readline()
+    for vals in csv.reader(fh):
+        row = fields.row(vals)
+        for key in LOOKUPS:
+            fields.field_name(key)
+        for key in row:
+            count += bool(fields.map_to(key))
+    return count
+
+
+def main(rows: int = 50000) -> None:
+    fh = build_file(rows)
+    fields = build_fields(fh)
+
+    results = {}
+    for name, func, conf in (
+        ("scan", scan, fields),
+        ("plan", plan, ColumnPlan(fields)),
+    ):
+        start = time.perf_counter()
+        results[name] = func(fh, conf)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {rows} rows in {elapsed:.2f}s, {rows / elapsed:.0f} rows/s")
+
+    assert results["scan"] == results["plan"]
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
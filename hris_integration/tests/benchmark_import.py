@@ -0,0 +1,199 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Benchmark CsvImport with synthetic HRIS extracts.
+
+A test database is created for the configured database backend and the extracts of
+tests.synthetic are imported into it. For each scenario the rows per second, queries
+per row and peak memory are reported and compared to benchmark_baseline.json. The
+command exits with an error if a result regressed by more than its tolerance.
+
+The scenarios run in order against the same database:
+
+- initial: the first extract, every employee is new
+- unchanged: the same extract again, every row is skipped
+- period: the extract after a pay period of churn, hires, terminations and renamed
+  jobs and locations
+
+The scenarios are run twice, each time against a new test database. Peak memory is
+measured with tracemalloc in the second pass, as tracing slows the import down too much
+for the first pass to be timed with it.
+
+The baseline is only compared when it was recorded with the same options and database
+backend. Rows per second depend on the machine, so update the baseline from the
+machine that runs the benchmark.
+
+Usage: python -m tests.benchmark_import [--rows 1000] [--bulk] [--update-baseline]
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+
+BASELINE = Path(__file__).resolve().parent / "benchmark_baseline.json"
+#: The allowed regression of each result, as a fraction of the baseline.
+TOLERANCE = {"rows_per_sec": -0.3, "queries_per_row": 0.1, "peak_mb": 0.3}
+
+
+def configure(bulk: bool) -> None:
+    """Install the settings and field mapping that the import tests use"""
+
+    from ftp_import.csv import CsvImport
+    from ftp_import.helpers import config
+    from tests import setup_tests
+    from tests.synthetic import HEADER
+
+    # load the setting fixtures and create the fields of the extract
+    config.ConfigSnapshot()
+    CsvImport(io.StringIO(",".join(HEADER) + "\n"))
+    setup_tests.setup_ftp_import()
+    setup_tests.set_configuration(
+        config.GROUP_CONFIG,
+        {config.CAT_CSV: {config.CSV_BULK_IMPORT: str(bulk)}},
+    )
+
+
+def run(fh: io.StringIO) -> dict:
+    """Import an extract and return the results"""
+
+    from ftp_import.csv import CsvImport
+
+    start = time.perf_counter()
+    metrics = CsvImport(fh).metrics
+    seconds = time.perf_counter() - start
+
+    rows = max(metrics.rows_processed, 1)
+    return {
+        "rows": metrics.rows_processed,
+        "errors": len(metrics.errors),
+        "seconds": round(seconds, 2),
+        "rows_per_sec": round(rows / seconds, 1),
+        "queries_per_row": round(metrics.queries / rows, 2),
+    }
+
+
+def run_traced(fh: io.StringIO) -> dict:
+    """Import an extract and return the peak memory"""
+
+    from ftp_import.csv import CsvImport
+
+    tracemalloc.start()
+    try:
+        CsvImport(fh)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"peak_mb": round(peak / 2**20, 1)}
+
+
+def measure(args: argparse.Namespace, func) -> dict:
+    """Run the scenarios against a new test database"""
+
+    from django.db import connection
+
+    results = {}
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        configure(args.bulk)
+        for name, fh in scenarios(args):
+            results[name] = func(fh)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return results
+
+
+def scenarios(args: argparse.Namespace):
+    from tests.synthetic import HrisGenerator
+
+    generator = HrisGenerator(args.rows, args.seed)
+    yield "initial", generator.extract()
+    yield "unchanged", generator.extract()
+    generator.advance(args.churn, args.hires, args.terminations, args.org_changes)
+    yield "period", generator.extract()
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Get the results that regressed by more than their tolerance"""
+
+    regressions = []
+    for name, result in results.items():
+        for key, tolerance in TOLERANCE.items():
+            expected = baseline.get(name, {}).get(key)
+            if not expected:
+                continue
+            change = (result[key] - expected) / expected
+            if (tolerance > 0 and change > tolerance) or (
+                tolerance < 0 and change < tolerance
+            ):
+                regressions.append(
+                    f"{name} {key}: {result[key]} (baseline {expected}, {change:+.0%})"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--hires", type=float, default=0.01)
+    parser.add_argument("--terminations", type=float, default=0.01)
+    parser.add_argument("--org-changes", type=float, default=0.01)
+    parser.add_argument("--bulk", action="store_true", help="use the bulk import")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hris_integration.settings")
+    import django
+
+    django.setup()
+    from django.db import connection
+
+    # the import logs every row, which would be most of the time measured
+    logging.disable(logging.ERROR)
+
+    params = {
+        k: v for k, v in vars(args).items() if k not in ("baseline", "update_baseline")
+    }
+    params["database"] = connection.vendor
+
+    results = measure(args, run)
+    for name, peak in measure(args, run_traced).items():
+        results[name].update(peak)
+        print(name, " ".join(f"{k}={v}" for k, v in results[name].items()))
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as fh:
+            json.dump({"params": params, "results": results}, fh, indent=2)
+            fh.write("\n")
+        print(f"Updated {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}")
+        return 0
+
+    if baseline["params"] != params:
+        print("The baseline was recorded with different options, not comparing")
+        return 0
+
+    regressions = compare(results, baseline["results"])
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# Copyright: (c) 2022, Josh Carswell <josh.carswell@thecarswells.ca>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Generate synthetic HRIS extracts in the format of employee_data.csv.
+
+Each extract is a full snapshot of the employees, the way the HRIS system exports them.
+The generator keeps the state of the organization so that the following extracts
+contain the changes of a pay period: updated employees, new hires, terminations and
+renamed jobs and locations.
+
+Usage: python -m tests.synthetic [rows] [periods] > employee_synthetic.csv
+"""
+
+import csv
+import datetime
+import io
+import random
+import sys
+
+from typing import Dict, List, TextIO
+
+HEADER = (
+    "Employee Number,First Name,Last Name,Hire Date,Username,Employee Status,"
+    "Employee Status Date,Birth Date,Standard Hours Per Day,Address,City,Province,Zip,"
+    "Country,Phone 1,Phone 2,Phone 3,Email,Union Code,Pay Cycle,Hourly/Salary,"
+    "Base Rate of Pay,Base Wage,Position Change Date,LL1,LL2,LL3,LL4,LL5,LL6,LL7,"
+    "LL1 Desc,LL2 Desc,LL3 Desc,LL4 Desc,LL5 Desc,LL6 Desc,LL7 Desc,Reports To,"
+    "Worker Type,Badge Number,Mobile License,Manager License,Schedule License,Timezone,"
+    "SeniorityDate,DrawNumber,EligibleJobs,Posting,PostingEndDate,BankVacation,"
+    "BankOvertime,SecondaryLabour"
+).split(",")
+
+FIRST_NAMES = (
+    "Orie Eloy Loma Paris Matilda Joshua Tanya Robert Rupert Alice Brenda Carlos Dana "
+    "Elena Farid Grace Hiro Imani Jonas Keira Liam Mona Nadia Omar Priya Quinn Rosa "
+    "Samir Tessa Umar Vera Wade Xena Yusuf Zoe"
+).split()
+LAST_NAMES = (
+    "Sambireddy Beer Moen Torp Jacob Kelly Ortiz Ashcraft Pfister Lee Nguyen Smith "
+    "Garcia Patel Okafor Novak Silva Murphy Cohen Rossi Larsen Kowalski Haddad Tanaka "
+    "Dubois Fischer Moreau Brennan Ivanova Mendes"
+).split()
+STREETS = "Basil Parsly Rosmary Sage Thyme Cedar Maple Albert Broad Victoria".split()
+WORDS = (
+    "Guest Experience Operations Finance Building Maintenance Support Services Sales "
+    "Retail Kitchen Security Facilities Marketing Payroll Logistics"
+).split()
+TITLES = "Mgr Dir Asst Host Clerk Carpenter Analyst Cook Lead Agent".split()
+CITIES = (("Regina", "SK"), ("Saskatoon", "SK"), ("Toronto", "ON"), ("Ottawa", "ON"))
+
+
+class HrisGenerator:
+    """
+    The state of a synthetic organization that the extracts are written from.
+
+    :param rows: The number of employees in the first extract
+    :type rows: int
+    :param seed: The seed of the random generator, the same seed and calls produce the
+        same extracts
+    :type seed: int
+    """
+
+    def __init__(self, rows: int = 1000, seed: int = 1) -> None:
+        self.random = random.Random(seed)
+        self.date = datetime.date(2021, 1, 1)
+        self.next_id = 1
+
+        self.business_units = {
+            3000 + x: f"{self.words(2)} {x}" for x in range(max(2, rows // 500))
+        }
+        self.locations = {
+            1000 + x: f"{self.random.choice(CITIES)[0]} {self.words(1)} {x}"
+            for x in range(max(2, rows // 100))
+        }
+        self.jobs = {
+            100 + x: (f"{self.random.choice(TITLES)} {self.words(1)} {x}", bu)
+            for x, bu in enumerate(
+                self.random.choice(list(self.business_units))
+                for _ in range(max(4, rows // 25))
+            )
+        }
+
+        self.employees: Dict[int, Dict[str, str]] = {}
+        for _ in range(rows):
+            self.hire()
+
+    def words(self, count: int) -> str:
+        return " ".join(self.random.choice(WORDS) for _ in range(count))
+
+    def fmt(self, date: datetime.date) -> str:
+        return date.strftime("%m/%d/%Y")
+
+    def address(self, suffix: str) -> str:
+        return f"{self.random.randint(1, 999)} {self.random.choice(STREETS)} {suffix}"
+
+    def managers(self) -> List[int]:
+        """The active employees that can be managers, the first tenth of the ids"""
+
+        active = [e for e, row in self.employees.items() if row["status"] == "AC"]
+        return active[: max(1, len(active) // 10)]
+
+    def hire(self) -> int:
+        """Add a new active employee and return their id"""
+
+        emp_id = self.next_id
+        self.next_id += 1
+        first = self.random.choice(FIRST_NAMES)
+        last = self.random.choice(LAST_NAMES)
+        city, province = self.random.choice(CITIES)
+        managers = self.managers() if self.employees else []
+
+        self.employees[emp_id] = {
+            "first_name": first,
+            "last_name": last,
+            "hire_date": self.fmt(
+                self.date - datetime.timedelta(self.random.randint(0, 9000))
+            ),
+            "status": "AC",
+            "status_date": self.fmt(self.date),
+            "address": self.address("Ave"),
+            "city": city,
+            "province": province,
+            "phone": str(self.random.randint(2000000000, 9999999999)),
+            "location": self.random.choice(list(self.locations)),
+            "job": self.random.choice(list(self.jobs)),
+            "manager": str(self.random.choice(managers)) if managers else "",
+        }
+        return emp_id
+
+    def advance(
+        self,
+        churn: float = 0.05,
+        hires: float = 0.01,
+        terminations: float = 0.01,
+        org_changes: float = 0.01,
+    ) -> None:
+        """
+        Move the organization forward by a pay period.
+
+        :param churn: The fraction of employees whose address, phone, job, location or
+            manager changes
+        :type churn: float
+        :param hires: The number of new hires as a fraction of the employees
+        :type hires: float
+        :param terminations: The fraction of active employees that are terminated
+        :type terminations: float
+        :param org_changes: The fraction of jobs and locations that are renamed
+        :type org_changes: float
+        """
+
+        self.date += datetime.timedelta(14)
+        count = len(self.employees)
+        managers = self.managers()
+
+        for emp_id in self.random.sample(list(self.employees), int(count * churn)):
+            row = self.employees[emp_id]
+            change = self.random.randrange(5)
+            if change == 0:
+                row["address"] = self.address("St")
+            elif change == 1:
+                row["phone"] = str(self.random.randint(2000000000, 9999999999))
+            elif change == 2:
+                row["job"] = self.random.choice(list(self.jobs))
+            elif change == 3:
+                row["location"] = self.random.choice(list(self.locations))
+            else:
+                # managers always have a lower id so the tree can't have a cycle
+                manager = self.random.choice(managers)
+                if manager < emp_id:
+                    row["manager"] = str(manager)
+
+        active = [e for e, row in self.employees.items() if row["status"] == "AC"]
+        for emp_id in self.random.sample(active[1:], int(len(active) * terminations)):
+            self.employees[emp_id]["status"] = "TER"
+            self.employees[emp_id]["status_date"] = self.fmt(self.date)
+
+        for _ in range(int(count * hires)):
+            self.hire()
+
+        jobs = self.random.sample(list(self.jobs), int(len(self.jobs) * org_changes))
+        for job in jobs:
+            name, bu = self.jobs[job]
+            self.jobs[job] = (f"{name} II", bu)
+        for loc in self.random.sample(
+            list(self.locations), int(len(self.locations) * org_changes)
+        ):
+            self.locations[loc] = f"{self.locations[loc]} II"
+
+    def row(self, emp_id: int) -> List[str]:
+        e = self.employees[emp_id]
+        job, bu = self.jobs[e["job"]]
+        username = f"{e['first_name'][0]}{e['last_name']}"
+        return [
+            str(emp_id),
+            e["first_name"],
+            e["last_name"],
+            e["hire_date"],
+            username,
+            e["status"],
+            e["status_date"],
+            "01/01/1980",
+            "8",
+            e["address"],
+            e["city"],
+            e["province"],
+            "S4X6K3",
+            "CA",
+            e["phone"],
+            "",
+            "",
+            f"{e['first_name']}.{e['last_name']}@example.com",
+            "1",
+            "14",
+            "H",
+            "21.50",
+            "",
+            e["status_date"],
+            "C F and O",
+            "Inscope",
+            "6500",
+            str(e["location"]),
+            str(bu),
+            "1000",
+            str(e["job"]),
+            "Corporate Finance and Operations",
+            "Inscope Staff",
+            "Salaries Inscope",
+            self.locations[e["location"]],
+            self.business_units[bu],
+            "Day to Day",
+            job,
+            e["manager"],
+            "1",
+            "",
+            "N",
+            "N",
+            "N",
+            "",
+            "1980/01/01",
+            "0",
+            "",
+            "N",
+            "",
+            "N",
+            "N",
+            str(e["job"]),
+        ]
+
+    def write(self, fh: TextIO) -> None:
+        """
+        Write the current extract, the employees are in id order.
+
+        :param fh: The text file to write to
+        :type fh: TextIO
+        """
+
+        writer = csv.writer(fh, lineterminator="\n")
+        writer.writerow(HEADER)
+        for emp_id in self.employees:
+            writer.writerow(self.row(emp_id))
+
+    def extract(self) -> io.StringIO:
+        """Get the current extract as an in memory file"""
+
+        fh = io.StringIO()
+        self.write(fh)
+        fh.seek(0)
+        return fh
+
+
+if __name__ == "__main__":
+    args = list(map(int, sys.argv[1:3]))
+    generator = HrisGenerator(*args[:1])
+    for _ in range(args[1] if len(args) > 1 else 0):
+        generator.advance()
+    generator.write(sys.stdout)
@@ -4,13 +4,37 @@
 import logging
 import unittest
 import time
+import io
+import datetime
+import gzip
+import hashlib
+import pickle
+import shutil
+import tempfile
+
+from concurrent.futures import Future
+from unittest import mock
 
 from ftp_import.forms import form
-from ftp_import import csv
-from ftp_import.helpers.stats import Stats
+from ftp_import import csv, readers
+from ftp_import.ftp import FTPClient, LocalSFTP
+from ftp_import.models import FileTrack, ImportRun
+from ftp_import.helpers.stats import Metrics, Stats
+from ftp_import.helpers import config
+from ftp_import.helpers.cache import ImportCache
+from ftp_import.helpers.columns import ColumnPlan
+from ftp_import.helpers.pending import soundex, blocking_keys
+from ftp_import.helpers.text_utils import DateParser
+from ftp_import.helpers.tree import check_tree, deferred_tree_updates
 from ftp_import import ObjectCreationError
 from pathlib import Path
-from employee.models import Employee
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from employee.models import Employee, EmployeeImport
+from organization.models import BusinessUnit, JobRole, Location
+from settings.models import Setting, WordList
+from tests.synthetic import HrisGenerator
 
 logger = logging.getLogger("test.csv_import")
 
@@ -26,6 +50,26 @@ employees = [
 ]
 
 
+def employee_rows(*rows: dict) -> io.StringIO:
+    """
+    Build an import file from the first row of employee_data.csv, one line for each
+    dict of column values that replace the values of the template row
+    """
+
+    path = Path(__file__).resolve().parent / "employee_data.csv"
+    with open(path) as fh:
+        header = fh.readline().strip()
+        template = fh.readline().strip().split(",")
+    lines = [header]
+    header = header.split(",")
+    for columns in rows:
+        row = list(template)
+        for column, value in columns.items():
+            row[header.index(column)] = str(value)
+        lines.append(",".join(row))
+    return io.StringIO("\n".join(lines) + "\n")
+
+
 class manual_import(form):
     def save_post(self):
         logger.debug("converting source employee back to pending")
@@ -39,25 +83,37 @@ class manual_import(form):
 
 
 class PendingImport(csv.CsvImport):
-    def add_data(self):
-        for row in range(0, len(self.data)):
-            try:
-                i = manual_import(self.fields, **self.data[row])
-                i.save()
-                Stats.rows_processed += 1
-            except ValueError as e:
-                logger.error(
-                    "Failed to save Employee refer to previous logs for more details"
-                )
-                Stats.errors.append(f"Line: {row} - Error: {e}")
-            except ObjectCreationError as e:
-                logger.error(
-                    f"Caught exception '{str(e)}' while creating employee, failed to create "
-                    "reference object. Refer to above logs"
-                )
-                Stats.errors.append(f"Line: {row} - Error: {e}")
-            except Exception as e:
-                logger.debug(e)
+    def add_row(self, form, line, row, cache=None):
+        try:
+            i = manual_import(self.fields, **row)
+            i.save()
+            Stats.rows_processed += 1
+        except ValueError as e:
+            logger.error(
+                "Failed to save Employee refer to previous logs for more details"
+            )
+            Stats.errors.append(f"Line: {line} - Error: {e}")
+        except ObjectCreationError as e:
+            logger.error(
+                f"Caught exception '{str(e)}' while creating employee, failed to create "
+                "reference object. Refer to above logs"
+            )
+            Stats.errors.append(f"Line: {line} - Error: {e}")
+        except Exception as e:
+            logger.debug(e)
+
+
+class kwargs_import(form):
+    ids = []
+
+    def save_pre(self):
+        kwargs_import.ids.append(self.kwargs[self.get_field_name("id")])
+        super().save_pre()
+
+
+class KwargsImport(csv.CsvImport):
+    def add_row(self, form, line, row, cache=None):
+        kwargs_import(self.fields, snapshot=self.config, **row).save()
 
 
 class TestCSVImport(unittest.TestCase):
@@ -72,7 +128,7 @@ class TestCSVImport(unittest.TestCase):
                 logger.debug(f"Created employee for import match test: {str(e)}")
                 pms.append(repr(e))
         FILE = "employee_data.csv"
-        path = str(Path(__file__).resolve().parent) + "\\" + FILE
+        path = Path(__file__).resolve().parent / FILE
         with open(path) as data:
             csv.CsvImport(data)
         Stats.files.append(FILE)
@@ -82,7 +138,7 @@ class TestCSVImport(unittest.TestCase):
 
     def test_manual_import(self):
         FILE = "employee_data2.csv"
-        path = str(Path(__file__).resolve().parent) + "\\" + FILE
+        path = Path(__file__).resolve().parent / FILE
         with open(path) as data:
             PendingImport(data)
         Stats.files.append(FILE)
@@ -95,3 +151,568 @@ class TestCSVImport(unittest.TestCase):
         logger.info(Stats())
         logger.info("Warnings: \n" + "\n - ".join(Stats.warnings))
         logger.info("Errors: \n" + "\n - ".join(Stats.errors))
+
+
+class TestCSVParse(unittest.TestCase):
+    def setUp(self):
+        self.importer = csv.CsvImport.__new__(csv.CsvImport)
+        self.importer.reader = readers.CsvReader(config.ConfigSnapshot())
+        self.importer.reader.header_lines = 1
+        self.importer.parse_error = []
+        self.importer.resume_line = 0
+        self.importer.fields = ColumnPlan(
+            [
+                {"import": True, "field": "id", "map_to": "id"},
+                {"import": True, "field": "street", "map_to": "street1"},
+                {"import": False, "field": "city", "map_to": ""},
+            ]
+        )
+
+    def test_multiline_fields(self):
+        data = io.StringIO('1,"12 Main St\nUnit 4",Ottawa\n2,"1 King, St",Toronto\n')
+        rows = list(self.importer.parse_data(data))
+        self.assertEqual(
+            rows,
+            [
+                (2, {"id": "1", "street": "12 Main St\nUnit 4"}),
+                (4, {"id": "2", "street": "1 King, St"}),
+            ],
+        )
+
+    def test_parse_error_line(self):
+        data = io.StringIO('1,"12 Main St\nUnit 4",Ottawa\n2,Toronto\n3,Street,City\n')
+        rows = list(self.importer.parse_data(data))
+        self.assertEqual([r[0] for r in rows], [2, 5])
+        self.assertEqual(self.importer.parse_error, ["2"])
+        self.assertTrue(Stats.errors[-1].startswith("Line: 4 "))
+
+
+class TestReaders(unittest.TestCase):
+    def test_jsonl_gzip(self):
+        data = b'{"id": 1, "street": "12 Main St"}\n\n{"street": null, "id": 2}\n{\n'
+        stream = readers.text_stream(io.BytesIO(gzip.compress(data)))
+        reader = readers.JsonLinesReader(config.ConfigSnapshot())
+        self.assertEqual(reader.headers(stream), ["id", "street"])
+        self.assertEqual(
+            list(reader.rows(stream)),
+            [(1, ["1", "12 Main St"]), (2, []), (3, ["2", ""]), (4, None)],
+        )
+
+    def test_default_reader(self):
+        reader = readers.get_reader(config.ConfigSnapshot(), "employee_data.csv")
+        self.assertIsInstance(reader, readers.CsvReader)
+
+
+class TestRowRollback(unittest.TestCase):
+    def setUp(self):
+        # the hire date isn't imported by the test setup
+        conf = config.CsvSetting()
+        if "hire_date" not in conf.fields:
+            conf.add_field("hire_date")
+        self.mapping = {}
+        for item, value in (("map_to", "start_date"), ("import", "True")):
+            s = Setting.objects.get_by_path(config.GROUP_MAP, "hire_date", item)[0]
+            self.mapping[s] = s.value
+            s.value = value
+            s.save()
+
+    def tearDown(self):
+        for s, value in self.mapping.items():
+            s.value = value
+            s.save()
+
+    def test_failed_row(self):
+        data = employee_rows(
+            {"Employee Number": 990001, "LL7": 990777, "Hire Date": "99/99/2000"}
+        )
+        importer = csv.CsvImport(data)
+
+        self.assertEqual(len(importer.metrics.errors), 1)
+        self.assertTrue(importer.metrics.errors[0].startswith("Line: 2 "))
+        self.assertFalse(EmployeeImport.objects.filter(pk=990001).exists())
+        # the job created by the failed row is rolled back with it
+        self.assertFalse(JobRole.objects.filter(pk=990777).exists())
+
+
+class TestFormKwargs(unittest.TestCase):
+    def test_employee_id(self):
+        KwargsImport(employee_rows({"Employee Number": 990002, "Reports To": ""}))
+
+        # the id is still available to the save steps of custom forms
+        self.assertEqual(kwargs_import.ids, ["990002"])
+        self.assertTrue(EmployeeImport.objects.filter(pk=990002).exists())
+
+
+class TestRenameCascade(unittest.TestCase):
+    def employees(self, emp_id, location, job):
+        direct = Employee.objects.create(
+            first_name="Cascade", last_name="Direct", location=location, primary_job=job
+        )
+        matched = Employee.objects.create(first_name="Cascade", last_name="Matched")
+        imported, _ = EmployeeImport.objects.update_or_create(
+            pk=emp_id,
+            defaults={
+                "first_name": "Cascade",
+                "last_name": "Imported",
+                "location": location,
+                "primary_job": job,
+                "employee": matched,
+                "is_matched": True,
+            },
+        )
+        # the matched employee is only reached through its EmployeeImport
+        Employee.objects.filter(pk=matched.pk).update(
+            location=self.other_location, primary_job=self.other_job
+        )
+        return [direct, imported, matched]
+
+    def test_flag_updated(self):
+        other_bu, bu = (
+            BusinessUnit.objects.update_or_create(
+                pk=pk, defaults={"name": f"Cascade BU {pk}"}
+            )[0]
+            for pk in (990301, 990302)
+        )
+        self.other_job, job, bu_job = (
+            JobRole.objects.update_or_create(
+                pk=pk, defaults={"name": f"Cascade Job {pk}", "business_unit": unit}
+            )[0]
+            for pk, unit in ((990401, other_bu), (990402, other_bu), (990403, bu))
+        )
+        self.other_location, location = (
+            Location.objects.update_or_create(
+                pk=pk, defaults={"name": f"Cascade Location {pk}"}
+            )[0]
+            for pk in (990201, 990202)
+        )
+
+        flagged = (
+            self.employees(990211, location, self.other_job)
+            + self.employees(990212, self.other_location, job)
+            + self.employees(990213, self.other_location, bu_job)
+        )
+        unrelated = self.employees(990214, self.other_location, self.other_job)
+        past = timezone.now() - datetime.timedelta(days=1)
+        for obj in flagged + unrelated:
+            obj.__class__.objects.filter(pk=obj.pk).update(updated_on=past)
+
+        rows = []
+        for emp_id, loc, loc_name, unit, unit_name, role, role_name in (
+            (990298, location, "Renamed", other_bu, other_bu.name, job, "Renamed"),
+            (990299, self.other_location, None, bu, "Renamed", bu_job, None),
+        ):
+            rows.append(
+                {
+                    "Employee Number": emp_id,
+                    "Reports To": "",
+                    "SecondaryLabour": role.pk,
+                    "LL4": loc.pk,
+                    "LL4 Desc": loc_name or loc.name,
+                    "LL5": unit.pk,
+                    "LL5 Desc": unit_name,
+                    "LL7": role.pk,
+                    "LL7 Desc": role_name or role.name,
+                }
+            )
+
+        csv.CsvImport(employee_rows(*rows))
+
+        for obj in flagged:
+            obj.refresh_from_db()
+            self.assertGreater(obj.updated_on, past, obj)
+        for obj in unrelated:
+            obj.refresh_from_db()
+            self.assertEqual(obj.updated_on, past, obj)
+
+
+class TestDryRun(unittest.TestCase):
+    def test_dry_run(self):
+        counts = (EmployeeImport.objects.count(), JobRole.objects.count())
+        path = Path(__file__).resolve().parent / "employee_data2.csv"
+        with open(path) as data:
+            importer = csv.CsvImport(data, dry_run=True)
+
+        self.assertEqual(
+            (EmployeeImport.objects.count(), JobRole.objects.count()), counts
+        )
+        summary = importer.diff.as_dict()["summary"]
+        planned = sum(
+            summary[k] for k in ("new", "updated", "unchanged", "skipped", "errors")
+        )
+        self.assertEqual(planned, importer.metrics.rows_processed)
+
+
+class TestStoredState(unittest.TestCase):
+    def test_change_detection(self):
+        e = Employee.objects.create(first_name="Stored", last_name="State")
+        e = Employee.objects.get(pk=e.pk)
+        updated_on = e.updated_on
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(e.stored_instance(), e)
+        self.assertEqual(len(queries), 0)
+
+        e.save()
+        self.assertEqual(e.updated_on, updated_on)
+
+        e.last_name = "Changed"
+        self.assertEqual(e.changed_fields(e.stored_instance()), ["last_name"])
+        e.save()
+        self.assertGreater(e.updated_on, updated_on)
+        self.assertEqual(e.changed_fields(e.stored_instance()), [])
+
+
+class TestDeferredTree(unittest.TestCase):
+    def test_rebuild(self):
+        with deferred_tree_updates((Employee,)) as changes:
+            manager = Employee.objects.create(first_name="Tree", last_name="Manager")
+            report = Employee.objects.create(first_name="Tree", last_name="Report")
+            report.manager = manager
+            report.save()
+
+        self.assertEqual(changes.nodes[Employee], {manager.pk, report.pk})
+        self.assertEqual(check_tree(Employee), [])
+        manager.refresh_from_db()
+        descendants = manager.get_descendants().values_list("pk", flat=True)
+        self.assertEqual(list(descendants), [report.pk])
+
+        # moving the report only rebuilds the trees it was moved out of and into
+        other = Employee.objects.create(first_name="Tree", last_name="Other")
+        report = Employee.objects.get(pk=report.pk)
+        with deferred_tree_updates((Employee,)) as changes:
+            Employee.objects.get(pk=manager.pk).save()
+            report.manager = other
+            report.save()
+
+        self.assertEqual(changes.nodes[Employee], {report.pk})
+        self.assertEqual(changes.trees[Employee], {manager.tree_id})
+        self.assertEqual(check_tree(Employee), [])
+        other.refresh_from_db()
+        descendants = other.get_descendants().values_list("pk", flat=True)
+        self.assertEqual(list(descendants), [report.pk])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_run(self):
+        outer = Stats()
+        metrics = Metrics()
+        with metrics.activate():
+            Stats.rows_processed += 1
+            with Stats.phase("save"):
+                with Stats.phase("cascade"):
+                    WordList.objects.exists()
+            Stats.observe_row(0.003)
+        self.assertIs(Stats(), outer)
+        self.assertEqual(metrics.rows_processed, 1)
+        self.assertEqual(metrics.phase_queries["cascade"], 1)
+        self.assertEqual(metrics.phase_queries["save"], 0)
+        self.assertEqual(metrics.latency_percentile(50), 0.005)
+
+        merged = Metrics()
+        merged.merge(metrics.collect())
+        merged.merge(metrics.collect())
+        self.assertEqual(merged.rows_processed, 2)
+        self.assertEqual(merged.queries, 2)
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        snapshot = config.ConfigSnapshot()
+        conf = config.Config()
+        for category, items in config.CONFIG_DEFAULTS.items():
+            for item in items.keys():
+                self.assertEqual(snapshot(category, item), conf(category, item))
+
+    def test_read_only(self):
+        snapshot = config.ConfigSnapshot()
+        with self.assertRaises(AttributeError):
+            snapshot.values = {}
+        with self.assertRaises(TypeError):
+            snapshot.values[(config.CAT_CSV, config.CSV_FIELD_SEP)] = ";"
+
+    def test_pickle(self):
+        snapshot = config.ConfigSnapshot()
+        copy = pickle.loads(pickle.dumps(snapshot))
+        self.assertEqual(dict(copy.values), dict(snapshot.values))
+        with self.assertRaises(AttributeError):
+            copy.values = {}
+
+
+class InlineExecutor:
+    """Run the tasks of the import workers in the test process"""
+
+    submitted = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        InlineExecutor.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class InlineParallelImport(csv.CsvImport):
+    def add_data(self, rows):
+        with mock.patch.object(csv, "ProcessPoolExecutor", InlineExecutor):
+            with mock.patch.object(csv.connections, "close_all"):
+                self.add_data_parallel(form, rows, 2)
+
+
+class TestParallelImport(unittest.TestCase):
+    IDS = (990101, 990102, 990103)
+
+    @classmethod
+    def setUpClass(cls):
+        data = employee_rows(
+            *(
+                {
+                    "Employee Number": emp_id,
+                    "Reports To": manager,
+                    "SecondaryLabour": 315,
+                }
+                for emp_id, manager in zip(cls.IDS, ("", "990101", "990101"))
+            )
+        )
+        lines = data.getvalue().splitlines()[1:]
+        cls.importer = csv.CsvImport(data)
+        # username and email_alias aren't imported by the default configuration
+        cls.fields = ColumnPlan(
+            list(cls.importer.fields)
+            + [
+                {"field": "hris_username", "import": True, "map_to": "username"},
+                {"field": "hris_alias", "import": True, "map_to": "email_alias"},
+            ]
+        )
+        cls.rows = {
+            emp_id: cls.fields.row(line.split(",") + ["", ""])
+            for emp_id, line in zip(cls.IDS, lines)
+        }
+
+    def row(self, emp_id, **changes):
+        row = dict(self.rows.get(emp_id, self.rows[990102]), last_name="Parallel")
+        row.update(changes, employee_number=str(emp_id))
+        return row
+
+    def independent(self, row):
+        cache = ImportCache(self.fields, False, 1, self.importer.config)
+        cache.preload([row])
+        f = form(self.fields, cache=cache, snapshot=self.importer.config, **row)
+        stored = (
+            EmployeeImport.objects.filter(pk=f.employee_id)
+            .values(*form.INDEPENDENT_VALUES)
+            .first()
+        )
+        return f.independent(stored)
+
+    def test_independent(self):
+        self.assertTrue(self.independent(self.row(990102)))
+        self.assertFalse(self.independent(self.row(990199)))
+        self.assertFalse(self.independent(self.row(990102, employee_status="L")))
+        self.assertFalse(self.independent(self.row(990102, first_name="Changed")))
+        self.assertFalse(self.independent(self.row(990102, hris_username="changed")))
+        self.assertFalse(self.independent(self.row(990102, hris_alias="changed")))
+        self.assertFalse(self.independent(self.row(990102, reports_to="990103")))
+        self.assertFalse(self.independent(self.row(990102, ll7="990999")))
+        self.assertFalse(self.independent(self.row(990102, ll4="990998")))
+        self.assertFalse(self.independent(self.row(990102, secondarylabour="990997")))
+
+        EmployeeImport.objects.filter(pk=990102).update(is_matched=False)
+        try:
+            self.assertFalse(self.independent(self.row(990102)))
+        finally:
+            EmployeeImport.objects.filter(pk=990102).update(is_matched=True)
+
+    def test_managed_by_dependent(self):
+        plan = lambda *rows: self.importer._plan_batch(form, list(rows))
+        self.assertEqual(plan(self.row(990101), self.row(990102)), {0, 1})
+        # the manager is saved by the parent so the rows it manages are too
+        manager = self.row(990101, employee_status="L")
+        self.assertEqual(plan(manager, self.row(990102), self.row(990103)), set())
+
+    def dump(self):
+        employees = {}
+        for row in Employee.objects.values():
+            employees[row["id"]] = row
+        keys = {pk: row["employee_id"] for pk, row in employees.items()}
+
+        ignored = ("id", "created_on", "updated_on", "password")
+        imports = []
+        for row in EmployeeImport.objects.order_by("pk").values():
+            employee = employees.get(row.pop("employee_id"), {})
+            employee = {k: v for k, v in employee.items() if k not in ignored}
+            # the primary keys of new employees depend on the database
+            employee["manager_id"] = keys.get(employee.get("manager_id"))
+            imports.append(
+                ({k: v for k, v in row.items() if k not in ignored[1:]}, employee)
+            )
+        return imports
+
+    def test_equivalent(self):
+        generator = HrisGenerator(200, seed=6)
+        base = generator.extract().getvalue()
+        generator.advance(churn=0.3)
+        period = generator.extract().getvalue()
+
+        results = []
+        submitted = InlineExecutor.submitted
+        # terminated employees get a username with the current time
+        clock = mock.patch("employee.models.employee.time", return_value=1700000000)
+        for importer in (csv.CsvImport, InlineParallelImport):
+            with clock, transaction.atomic():
+                csv.CsvImport(io.StringIO(base))
+                importer(io.StringIO(period))
+                results.append(self.dump())
+                transaction.set_rollback(True)
+
+        self.assertGreater(InlineExecutor.submitted, submitted)
+        self.assertEqual(results[0], results[1])
+
+
+class TestColumnPlan(unittest.TestCase):
+    def test_plan(self):
+        plan = ColumnPlan(
+            [
+                {"field": "employee_number", "import": True, "map_to": "id"},
+                {"field": "badge", "import": False, "map_to": ""},
+                {"field": "reports_to", "import": True, "map_to": "manager"},
+                {"field": "old_manager", "import": False, "map_to": "manager"},
+            ]
+        )
+        self.assertEqual(
+            plan.row(["12", "b", "3", "4"]),
+            {"employee_number": "12", "reports_to": "3"},
+        )
+        self.assertEqual(plan.map_to("reports_to"), "manager")
+        self.assertEqual(plan.field_name("manager"), "reports_to")
+        self.assertEqual(plan.field_name("location"), "")
+
+
+class TestDateParser(unittest.TestCase):
+    def test_parse(self):
+        parse = DateParser("%m/%d/%Y")
+        self.assertEqual(parse("01/05/2021"), parse("1/5/2021"))
+        self.assertEqual(parse("12/31/1999").date(), datetime.date(1999, 12, 31))
+        self.assertIs(parse("12/31/1999"), parse("12/31/1999"))
+        for value in ("13/01/2021", "02/30/2021", "2021-01-05"):
+            with self.assertRaises(ValueError):
+                parse(value)
+
+
+class TestWordExpansion(unittest.TestCase):
+    def test_expand(self):
+        WordList.objects.get_or_create(src="Mgr", replace="Manager")
+        word, _ = WordList.objects.get_or_create(src="Asst", replace="Assistant")
+        self.assertEqual(WordList.expand("Asst  Mgr"), "Assistant Manager")
+        word.replace = "Assist"
+        word.save()
+        self.assertEqual(WordList.expand("Asst Mgr"), "Assist Manager")
+        word.delete()
+        self.assertEqual(WordList.expand("Asst Mgr"), "Asst Manager")
+
+
+class TestPendingIndex(unittest.TestCase):
+    def test_soundex(self):
+        self.assertEqual(soundex("robert"), "r163")
+        self.assertEqual(soundex("rupert"), "r163")
+        self.assertEqual(soundex("ashcraft"), "a261")
+        self.assertEqual(soundex("pfister"), "p236")
+        self.assertEqual(soundex("lee"), "l000")
+
+    def test_blocking_keys(self):
+        self.assertTrue(
+            blocking_keys("Mitilda", "Jacob") & blocking_keys("Matilda", "Jacobi")
+        )
+        self.assertTrue(
+            blocking_keys("Josh", "Kelly") & blocking_keys("Joshua", "Kely")
+        )
+        self.assertFalse(
+            blocking_keys("Josh", "Kelly") & blocking_keys("Tanya", "Ortiz")
+        )
+
+
+class TestRowFingerprint(unittest.TestCase):
+    def test_reimport(self):
+        skipped = Stats.rows_skipped
+        FILE = "employee_data.csv"
+        path = Path(__file__).resolve().parent / FILE
+        with open(path) as data:
+            csv.CsvImport(data)
+        self.assertGreater(Stats.rows_skipped, skipped)
+
+    def test_terminated_manager(self):
+        manager = {"Employee Number": 990501, "Reports To": "", "SecondaryLabour": 315}
+        report = dict(manager, **{"Employee Number": 990502, "Reports To": 990501})
+        csv.CsvImport(employee_rows(manager, report))
+        self.assertEqual(EmployeeImport.objects.get(pk=990502).manager_id, 990501)
+
+        terminated = EmployeeImport.objects.get(pk=990501)
+        terminated.status = EmployeeImport.STATE_TERM
+        terminated.save()
+        # the row of the report is the same but its manager is no longer valid
+        importer = csv.CsvImport(employee_rows(report))
+        self.assertEqual(importer.metrics.rows_skipped, 0)
+        self.assertIsNone(EmployeeImport.objects.get(pk=990502).manager_id)
+
+
+class TestLocalSFTP(unittest.TestCase):
+    def test_run_import(self):
+        source = Path(__file__).resolve().parent
+        names = [f"sftp_{time.time_ns()}_{x}.csv" for x in range(3)]
+        with tempfile.TemporaryDirectory() as root:
+            for name, file in zip(
+                names, ["employee_data.csv", "employee_data2.csv"] * 2
+            ):
+                shutil.copy(source / file, Path(root, name))
+            FileTrack.objects.create(name=names[1])
+
+            client = FTPClient(sftp=LocalSFTP(root))
+            client.run_import()
+
+        self.assertEqual(client.metrics.files, [names[0], names[2]])
+        self.assertEqual(FileTrack.objects.filter(name__in=names).count(), 3)
+        run = ImportRun.objects.get(name=names[0])
+        self.assertEqual(run.rows_processed, client.metrics.rows_processed // 2)
+        self.assertGreater(run.queries, 0)
+        self.assertEqual(sum(run.timings["row_latency"]), run.rows_processed)
+
+    def test_failed_import(self):
+        source = Path(__file__).resolve().parent / "employee_data.csv"
+        name = f"sftp_{time.time_ns()}_failed.csv"
+        with tempfile.TemporaryDirectory() as root:
+            shutil.copy(source, Path(root, name))
+            client = FTPClient(sftp=LocalSFTP(root))
+            with mock.patch.object(csv.CsvImport, "add_data", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    client.run_import()
+
+        run = ImportRun.objects.get(name=name)
+        self.assertIsNotNone(run.time_end)
+        self.assertEqual(run.rows_processed, 0)
+
+    def test_resume_import(self):
+        source = Path(__file__).resolve().parent / "employee_data.csv"
+        name = f"sftp_{time.time_ns()}_resume.csv"
+        content_hash = hashlib.sha256(source.read_bytes()).hexdigest()
+        FileTrack.objects.create(
+            name=name,
+            status=FileTrack.STATUS_RUNNING,
+            line=len(source.read_text().splitlines()),
+            content_hash=content_hash,
+        )
+        with tempfile.TemporaryDirectory() as root:
+            shutil.copy(source, Path(root, name))
+            client = FTPClient(sftp=LocalSFTP(root))
+            client.run_import()
+
+        self.assertEqual(client.metrics.files, [name])
+        self.assertEqual(client.metrics.rows_processed, 0)
+        track = FileTrack.objects.get(name=name)
+        self.assertEqual(track.status, FileTrack.STATUS_COMPLETE)